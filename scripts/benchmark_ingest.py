@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+import click
+
+import pybpmn
+
+
+def _debugger_excepthook(*exc_info):
+    # fallback to debugger on error, IPython is only imported when an error occurs
+    from IPython.core import ultratb
+    ultratb.FormattedTB(mode="Verbose", color_scheme="Linux", call_pdb=1)(*exc_info)
+
+
+sys.excepthook = _debugger_excepthook
+
+_logger = logging.getLogger(__name__)
+
+
+@click.command()
+@click.argument("bpmn_root", type=click.Path(file_okay=False, exists=True))
+@click.option("--threads", "-t", multiple=True, type=int, default=[1, 2, 4, 8])
+@click.option("--n_jobs", default=4, type=int, help="number of processes of the process pool baseline")
+@click.option("--repeat", default=1, type=int, help="parse each file repeat times")
+@click.option("--quiet", "log_level", flag_value=logging.WARNING)
+@click.option("-v", "--verbose", "log_level", flag_value=logging.INFO, default=True)
+@click.version_option(pybpmn.__version__)
+def main(bpmn_root: str, threads: List[int], n_jobs: int, repeat: int, log_level: int):
+    """Compares the files/s of the thread pool ingestion (pybpmn.ingest) with a process pool that pickles the results"""
+    from concurrent.futures import ProcessPoolExecutor
+
+    from pybpmn import serialize
+    from pybpmn.ingest import ingest
+    from pybpmn.parser import BpmnParser
+
+    logging.basicConfig(format="%(asctime)s %(levelname)s - %(message)s", level=log_level)
+    paths = sorted(Path(bpmn_root).rglob("*.bpmn")) * repeat
+    _logger.info("%d files", len(paths))
+    parser = BpmnParser()
+
+    for n_threads in threads:
+        start = time.perf_counter()
+        n_errors = sum(r.error is not None for r in ingest(paths, parser, n_threads=n_threads))
+        _report(f"threads={n_threads}", len(paths), time.perf_counter() - start, n_errors)
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(n_jobs, initializer=_init_worker) as pool:
+        # the results have to be transferred to the main process, like in BpmnDataset.iter_split
+        anns_data = list(pool.map(_parse_serialized, paths, chunksize=16))
+        anns = [serialize.loads(d) for d in anns_data if d is not None]
+    n_errors = len(paths) - len(anns)
+    _report(f"processes={n_jobs}", len(paths), time.perf_counter() - start, n_errors)
+
+
+_worker_parser = None
+
+
+def _init_worker():
+    # like the thread pool, each worker creates its parser once
+    from pybpmn.parser import BpmnParser
+
+    global _worker_parser
+    _worker_parser = BpmnParser()
+
+
+def _parse_serialized(bpmn_path: Path):
+    from pybpmn import serialize
+
+    try:
+        return serialize.dumps(_worker_parser.parse_bpmn_anns(bpmn_path))
+    except Exception:
+        # counted as error like the failed IngestResults
+        return None
+
+
+def _report(name: str, n_files: int, seconds: float, n_errors: int):
+    _logger.info("%-14s %8.1f files/s (%d errors)", name, n_files / seconds, n_errors)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import sys
+from typing import List
+
+import click
+
+import pybpmn
+from pybpmn import syntax
+from pybpmn.constants import VALID_SPLITS
+
+
+def _debugger_excepthook(*exc_info):
+    # fallback to debugger on error, IPython is only imported when an error occurs
+    from IPython.core import ultratb
+    ultratb.FormattedTB(mode="Verbose", color_scheme="Linux", call_pdb=1)(*exc_info)
+
+
+sys.excepthook = _debugger_excepthook
+
+_logger = logging.getLogger(__name__)
+
+
+@click.command()
+@click.argument("hdbpmn_root", type=click.Path(file_okay=False, exists=True))
+@click.argument("shards_root", type=click.Path(file_okay=False))
+@click.option("--target_max_size", default=1333, type=int)
+@click.option("--shard_size", default=256, type=int)
+@click.option("--n_jobs", default=1, type=int)
+@click.option("--splits", "-s", multiple=True, default=list(VALID_SPLITS))
+@click.option("--quiet", "log_level", flag_value=logging.WARNING)
+@click.option("-v", "--verbose", "log_level", flag_value=logging.INFO, default=True)
+@click.option("-vv", "--very-verbose", "log_level", flag_value=logging.DEBUG)
+@click.version_option(pybpmn.__version__)
+def main(
+        hdbpmn_root: str,
+        shards_root: str,
+        target_max_size: int,
+        shard_size: int,
+        n_jobs: int,
+        splits: List[str],
+        log_level: int,
+):
+    # imported here so that --help and --version do not import the dataset dependencies
+    from pybpmn.dataset import HdBpmnDataset
+    from pybpmn.shards import compile_split
+
+    logging.basicConfig(format="%(asctime)s %(levelname)s - %(message)s", level=log_level)
+
+    # same dataset configuration as dump_coco.py
+    excluded_label_categories = [c for c in syntax.ACTIVITY_CATEGORIES if c not in syntax.ACTIVITIES_WITH_CHILD_SHAPES]
+    ds = HdBpmnDataset(
+        bpmn_dataset_root=hdbpmn_root,
+        coco_dataset_root=shards_root,
+        category_translate_dict={syntax.TERMINATE_EVENT: syntax.END_EVENT},
+        excluded_categories={syntax.ASSOCIATION, syntax.TEXT_ANNOTATION},
+        excluded_label_categories=excluded_label_categories,
+    )
+
+    for split in splits:
+        split_root = compile_split(ds, split, shards_root, target_max_size, shard_size, n_jobs)
+        _logger.info("Compiled split=%s to %s", split, split_root)
+
+
+if __name__ == "__main__":
+    main()
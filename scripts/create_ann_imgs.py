@@ -1,40 +1,21 @@
-import os
-from pathlib import Path
+import logging
+from typing import Optional
 
 import click
-import yamlu
 
-from pybpmn.parser import BpmnParser, InvalidBpmnException
+from pybpmn.ann_imgs import create_ann_imgs
+
 
 @click.command()
 @click.argument("dataset_root", type=click.Path(file_okay=False, exists=True))
-def main(dataset_root: str):
-
-    # (i) Get all available annotation paths with img path that do not have an annotated img already
-    dataset_root = Path(dataset_root)
-    anns_root = dataset_root / "annotations"
-    bpmn_paths = yamlu.glob(anns_root, "**/*.bpmn")
+@click.option("--n_jobs", default=None, type=int)
+@click.option("--force", is_flag=True, help="recreate annotated images that are up-to-date")
+def main(dataset_root: str, n_jobs: Optional[int], force: bool):
+    logging.basicConfig(format="%(asctime)s %(levelname)s - %(message)s", level=logging.INFO)
 
-    imgs_root = dataset_root / "images"
-    imgs_ann_root = dataset_root / "images-annotated"
-    valid_bpmn_to_img_path = {}
-    for bpmn_path in bpmn_paths:
-        img_paths = yamlu.glob(imgs_root, f"{bpmn_path.stem}.*")
-        ann_img_exists = os.path.exists(imgs_ann_root / f"{bpmn_path.stem}.jpg")
-        if len(img_paths) > 0 and not ann_img_exists:
-            valid_bpmn_to_img_path[bpmn_path] = img_paths[0]
-    
-    print(f"Found {len(valid_bpmn_to_img_path)} annotation files with images that don't have an annotated image already")
+    report = create_ann_imgs(dataset_root, parser_kwargs={"scale_to_ann_width": False}, n_jobs=n_jobs, force=force)
+    print(report.summary())
 
-    # (ii) Parse to annotated img
-    bpmn_parser = BpmnParser(scale_to_ann_width=False)
-    for bpmn_path, img_path in valid_bpmn_to_img_path.items():
-        try:
-            ann_img = bpmn_parser.parse_bpmn_img(bpmn_path, img_path)
-            ann_img.save_with_anns(imgs_ann_root, suffix="")
-            print(f"Created annotated img of {bpmn_path.stem}")
-        except InvalidBpmnException as e:
-            print(f"{e.error_type}, {e.details} in diagram {bpmn_path.stem}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
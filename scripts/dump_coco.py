@@ -5,16 +5,19 @@ import sys
 from typing import List, Optional
 
 import click
-from IPython.core import ultratb
-from yamlu.coco import CocoDatasetExport
 
 import pybpmn
 from pybpmn import syntax
 from pybpmn.constants import VALID_SPLITS
-from pybpmn.dataset import HdBpmnDataset
 
-# fallback to debugger on error
-sys.excepthook = ultratb.FormattedTB(mode="Verbose", color_scheme="Linux", call_pdb=1)
+
+def _debugger_excepthook(*exc_info):
+    # fallback to debugger on error, IPython is only imported when an error occurs
+    from IPython.core import ultratb
+    ultratb.FormattedTB(mode="Verbose", color_scheme="Linux", call_pdb=1)(*exc_info)
+
+
+sys.excepthook = _debugger_excepthook
 
 _logger = logging.getLogger(__name__)
 
@@ -27,6 +30,8 @@ _logger = logging.getLogger(__name__)
 @click.option("--write_img", default=True, type=bool)
 @click.option("--write_ann_img", default=False, type=bool)
 @click.option("--splits", "-s", multiple=True, default=list(VALID_SPLITS))
+@click.option("--metrics_path", default=None, type=click.Path(dir_okay=False),
+              help="write export metrics to a prometheus textfile (*.prom) or append them as JSON lines")
 @click.option("--quiet", "log_level", flag_value=logging.WARNING)
 @click.option("-v", "--verbose", "log_level", flag_value=logging.INFO, default=True)
 @click.option("-vv", "--very-verbose", "log_level", flag_value=logging.DEBUG)
@@ -39,8 +44,14 @@ def main(
         write_img: bool,
         write_ann_img: bool,
         splits: List[str],
+        metrics_path: Optional[str],
         log_level: int,
 ):
+    # imported here so that --help and --version do not import the dataset dependencies
+    from pybpmn.dataset import HdBpmnDataset
+    from pybpmn.export import BpmnCocoDatasetExport
+    from pybpmn.metrics import Metrics, create_sink
+
     logging.basicConfig(format="%(asctime)s %(levelname)s - %(message)s", level=log_level)
     # logging.getLogger("yamlu.img").setLevel(logging.ERROR)
 
@@ -59,8 +70,9 @@ def main(
         excluded_label_categories=excluded_label_categories,
     )
 
-    exporter = CocoDatasetExport(
+    exporter = BpmnCocoDatasetExport(
         ds=ds,
+        metrics=Metrics(sinks=[create_sink(metrics_path)] if metrics_path is not None else []),
         write_img=write_img,
         write_ann_img=write_ann_img,
         sample=sample,
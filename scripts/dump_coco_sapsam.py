@@ -4,12 +4,10 @@ import logging
 from typing import List, Optional
 
 import click
-from yamlu.coco import CocoDatasetExport
 
 import pybpmn
 from pybpmn import syntax
 from pybpmn.constants import VALID_SPLITS
-from pybpmn.dataset import ComputerGeneratedDataset
 
 _logger = logging.getLogger(__name__)
 
@@ -36,6 +34,10 @@ def main(
         splits: List[str],
         log_level: int,
 ):
+    # imported here so that --help and --version do not import the dataset dependencies
+    from yamlu.coco import CocoDatasetExport
+    from pybpmn.dataset import ComputerGeneratedDataset
+
     logging.basicConfig(format="%(asctime)s %(levelname)s - %(message)s", level=log_level)
     # logging.getLogger("yamlu.img").setLevel(logging.ERROR)
 
@@ -0,0 +1,196 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from collections import defaultdict
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+from pybpmn.parser import BpmnParser, InvalidBpmnException
+
+_logger = logging.getLogger(__name__)
+
+# maps the image stem to the hash of the bpmn and image file an annotated image was created from
+MANIFEST_FILENAME = ".manifest.json"
+
+_DONE = object()
+# BpmnParser of a worker process, see _init_worker
+_worker_parser: Optional[BpmnParser] = None
+
+
+class AnnImgTask(NamedTuple):
+    bpmn_path: Path
+    img_path: Path
+    out_path: Path
+
+
+class AnnImgReport:
+    def __init__(self):
+        self.created: List[str] = []
+        self.skipped: List[str] = []
+        # error_type -> [(image stem, details)]
+        self.failures: Dict[str, List[Tuple[str, Optional[str]]]] = defaultdict(list)
+
+    @property
+    def n_failed(self) -> int:
+        return sum(len(v) for v in self.failures.values())
+
+    def summary(self) -> str:
+        lines = [f"Created {len(self.created)} annotated images, skipped {len(self.skipped)} up-to-date images, "
+                 f"{self.n_failed} failed"]
+        for error_type, failures in sorted(self.failures.items(), key=lambda kv: -len(kv[1])):
+            lines.append(f"{error_type}: {len(failures)}")
+            lines += [f"  {stem}: {details}" for stem, details in failures]
+        return "\n".join(lines)
+
+
+def index_images(imgs_root: Path) -> Dict[str, Path]:
+    """
+    :return: mapping from image stem to image path of all images in imgs_root (first path for duplicate stems)
+    """
+    stem_to_img_path = {}
+    for p in sorted(imgs_root.iterdir()):
+        if p.is_file():
+            stem_to_img_path.setdefault(p.stem, p)
+    return stem_to_img_path
+
+
+def find_ann_img_tasks(dataset_root: Path, out_root: Optional[Path] = None) -> List[AnnImgTask]:
+    """
+    :param dataset_root: directory with annotations/**/*.bpmn and images/ subdirectories
+    :param out_root: directory of the annotated images, defaults to dataset_root/images-annotated
+    :return: tasks for all bpmn files that have an image
+    """
+    out_root = dataset_root / "images-annotated" if out_root is None else out_root
+    stem_to_img_path = index_images(dataset_root / "images")
+
+    tasks = []
+    for bpmn_path in sorted((dataset_root / "annotations").glob("**/*.bpmn")):
+        img_path = stem_to_img_path.get(bpmn_path.stem, None)
+        if img_path is not None:
+            tasks.append(AnnImgTask(bpmn_path, img_path, out_root / f"{bpmn_path.stem}.jpg"))
+    return tasks
+
+
+def create_ann_imgs(
+        dataset_root: Union[Path, str],
+        out_root: Union[Path, str, None] = None,
+        parser_kwargs: Optional[Dict] = None,
+        n_jobs: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        force: bool = False,
+        jpg_quality: int = 75,
+        max_size: Optional[int] = None,
+) -> AnnImgReport:
+    """
+    Draws the annotations of each bpmn file onto its image in a pipeline: files are read in a background thread,
+    parsed, drawn and encoded in a pool of worker processes and written in another background thread.
+    Outputs that are newer than their bpmn and image file or that were created from files with the same content
+    (according to the manifest in out_root) are skipped.
+    :param parser_kwargs: BpmnParser arguments
+    :param n_jobs: number of worker processes, defaults to the number of CPUs
+    :param queue_size: maximum number of images that are buffered between two stages, defaults to 2 * n_jobs
+    :param force: recreate up-to-date annotated images
+    :param max_size: downscale the annotated images such that their larger side is at most max_size (see render)
+    """
+    dataset_root = Path(dataset_root)
+    out_root = dataset_root / "images-annotated" if out_root is None else Path(out_root)
+    out_root.mkdir(exist_ok=True, parents=True)
+    n_jobs = os.cpu_count() if n_jobs is None else n_jobs
+    queue_size = 2 * n_jobs if queue_size is None else queue_size
+
+    manifest_path = out_root / MANIFEST_FILENAME
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+
+    report = AnnImgReport()
+    tasks = []
+    for task in find_ann_img_tasks(dataset_root, out_root):
+        if not force and _is_newer(task):
+            report.skipped.append(task.bpmn_path.stem)
+        else:
+            tasks.append(task)
+    _logger.info("%d annotated images to create, %d up-to-date", len(tasks), len(report.skipped))
+
+    read_q = queue.Queue(maxsize=queue_size)
+    render_q = queue.Queue(maxsize=queue_size)
+    reader = threading.Thread(target=_read_stage, args=(tasks, read_q), daemon=True)
+    writer = threading.Thread(target=_write_stage, args=(render_q, manifest, report), daemon=True)
+
+    # spawn instead of fork, as the reader thread is already running when the workers are started
+    mp_context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(n_jobs, mp_context=mp_context, initializer=_init_worker,
+                             initargs=(parser_kwargs or {},)) as pool:
+        reader.start()
+        writer.start()
+        while (item := read_q.get()) is not _DONE:
+            task, content_hash, content = item
+            if not force and manifest.get(task.bpmn_path.stem, None) == content_hash and task.out_path.exists():
+                # same content, e.g. the files were touched by a checkout
+                os.utime(task.out_path)
+                report.skipped.append(task.bpmn_path.stem)
+                continue
+            if isinstance(content, Exception):
+                future = Future()
+                future.set_exception(content)
+            else:
+                future = pool.submit(_render, *content, task.img_path.name, jpg_quality, max_size)
+            render_q.put((task, content_hash, future))
+        render_q.put(_DONE)
+        writer.join()
+
+    manifest_path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    return report
+
+
+def _is_newer(task: AnnImgTask) -> bool:
+    if not task.out_path.exists():
+        return False
+    out_mtime = task.out_path.stat().st_mtime
+    return out_mtime >= task.bpmn_path.stat().st_mtime and out_mtime >= task.img_path.stat().st_mtime
+
+
+def _read_stage(tasks: List[AnnImgTask], read_q: queue.Queue):
+    for task in tasks:
+        try:
+            content = (task.bpmn_path.read_bytes(), task.img_path.read_bytes())
+            content_hash = hashlib.sha256(content[0] + content[1]).hexdigest()
+        except OSError as e:
+            content, content_hash = e, None
+        read_q.put((task, content_hash, content))
+    read_q.put(_DONE)
+
+
+def _write_stage(render_q: queue.Queue, manifest: Dict[str, str], report: AnnImgReport):
+    while (item := render_q.get()) is not _DONE:
+        task, content_hash, future = item
+        stem = task.bpmn_path.stem
+        try:
+            task.out_path.write_bytes(future.result())
+        except InvalidBpmnException as e:
+            report.failures[e.error_type].append((stem, e.details))
+            continue
+        except Exception as e:
+            _logger.debug("%s: failed to create annotated image", stem, exc_info=e)
+            report.failures[type(e).__name__].append((stem, str(e)))
+            continue
+        manifest[stem] = content_hash
+        report.created.append(stem)
+        _logger.info("Created annotated img of %s", stem)
+
+
+def _init_worker(parser_kwargs: Dict):
+    global _worker_parser
+    _worker_parser = BpmnParser(**parser_kwargs)
+
+
+def _render(bpmn_content: bytes, img_content: bytes, filename: str, jpg_quality: int,
+            max_size: Optional[int]) -> bytes:
+    """parses, draws and encodes an annotated image in a worker process"""
+    from pybpmn.render import encode_ann_img
+
+    ann_img = _worker_parser.parse_bpmn_img(bpmn_content, img_content, filename=filename)
+    return encode_ann_img(ann_img, jpg_quality, max_size=max_size)
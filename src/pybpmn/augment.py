@@ -0,0 +1,337 @@
+import logging
+import math
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+from yamlu.img import AnnotatedImage, Annotation, BoundingBox
+
+from pybpmn import syntax
+from pybpmn.constants import ARROW_KEYPOINT_FIELDS, RELATIONS
+
+_logger = logging.getLogger(__name__)
+
+_EDGE_CATEGORIES = set(syntax.BPMNDI_EDGE_CATEGORIES)
+# relations that are removed if the related annotation is dropped, pool is set to None instead (see _link_pools)
+_REMOVABLE_RELATIONS = (*RELATIONS, "lane")
+
+
+class DiagramGeometry(NamedTuple):
+    """all coordinates of the annotations of a diagram as arrays"""
+    # (n, 4) boxes as (t, l, b, r)
+    boxes: np.ndarray
+    # (n,) True for edges, whose boxes are derived from their waypoints
+    is_edge: np.ndarray
+    # waypoints of annotation i are waypoints[waypoint_offsets[i]:waypoint_offsets[i + 1]]
+    waypoint_offsets: np.ndarray
+    # (m, 2) waypoints as (x, y)
+    waypoints: np.ndarray
+    # (n, len(ARROW_KEYPOINT_FIELDS), 2) tail and head as (x, y), nan if the annotation does not have them
+    keypoints: np.ndarray
+
+    @classmethod
+    def from_anns(cls, anns: List[Annotation]) -> "DiagramGeometry":
+        n = len(anns)
+        keypoints = np.full((n, len(ARROW_KEYPOINT_FIELDS), 2), np.nan)
+        n_waypoints = np.zeros(n, dtype=np.int64)
+        waypoints = []
+        for i, a in enumerate(anns):
+            if "waypoints" in a:
+                wps = np.asarray(a.waypoints, dtype=np.float64).reshape(-1, 2)
+                n_waypoints[i] = len(wps)
+                waypoints.append(wps)
+            for j, field in enumerate(ARROW_KEYPOINT_FIELDS):
+                if field in a and a.get(field) is not None:
+                    keypoints[i, j] = a.get(field)
+        return cls(
+            boxes=np.array([a.bb.tlbr for a in anns], dtype=np.float64).reshape(n, 4),
+            is_edge=np.array([a.category in _EDGE_CATEGORIES for a in anns], dtype=bool),
+            waypoint_offsets=np.concatenate([[0], np.cumsum(n_waypoints)]),
+            waypoints=np.concatenate(waypoints) if len(waypoints) > 0 else np.zeros((0, 2)),
+            keypoints=keypoints,
+        )
+
+
+class TransformedGeometry(NamedTuple):
+    geometry: DiagramGeometry
+    # (n,) False for annotations that are (mostly) outside of the transformed image
+    keep: np.ndarray
+
+
+def scale_matrix(sx: float, sy: Optional[float] = None) -> np.ndarray:
+    return np.diag([sx, sx if sy is None else sy, 1.0])
+
+
+def translation_matrix(tx: float, ty: float) -> np.ndarray:
+    return np.array([[1.0, 0.0, tx], [0.0, 1.0, ty], [0.0, 0.0, 1.0]])
+
+
+def rotation_matrix(degrees: float, center: Tuple[float, float]) -> np.ndarray:
+    """clockwise rotation in image coordinates (y pointing down) around center"""
+    rad = math.radians(degrees)
+    cos, sin = math.cos(rad), math.sin(rad)
+    rotation = np.array([[cos, -sin, 0.0], [sin, cos, 0.0], [0.0, 0.0, 1.0]])
+    cx, cy = center
+    return translation_matrix(cx, cy) @ rotation @ translation_matrix(-cx, -cy)
+
+
+def hflip_matrix(width: float) -> np.ndarray:
+    return np.array([[-1.0, 0.0, width], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]])
+
+
+def vflip_matrix(height: float) -> np.ndarray:
+    return np.array([[1.0, 0.0, 0.0], [0.0, -1.0, height], [0.0, 0.0, 1.0]])
+
+
+def perspective_matrix(src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+    """:return: homography that maps the 4 (x, y) src points to the 4 dst points"""
+    src, dst = np.asarray(src, dtype=np.float64), np.asarray(dst, dtype=np.float64)
+    assert src.shape == (4, 2) and dst.shape == (4, 2), f"expected 4 points each: {src.shape}, {dst.shape}"
+    a = np.zeros((8, 8))
+    a[0::2, 0:2], a[0::2, 2] = src, 1
+    a[1::2, 3:5], a[1::2, 5] = src, 1
+    a[0::2, 6:8] = -src * dst[:, :1]
+    a[1::2, 6:8] = -src * dst[:, 1:]
+    h = np.linalg.solve(a, dst.reshape(-1))
+    return np.append(h, 1.0).reshape(3, 3)
+
+
+def random_transform(
+        rng: np.random.Generator,
+        width: int,
+        height: int,
+        scale: Tuple[float, float] = (0.8, 1.2),
+        max_rotation: float = 5.0,
+        hflip_p: float = 0.0,
+        vflip_p: float = 0.0,
+        max_perspective: float = 0.0,
+        crop_size: Optional[Tuple[int, int]] = None,
+) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """
+    :param scale: range of the (uniform) scale factor
+    :param max_rotation: maximum rotation in degrees (in both directions)
+    :param max_perspective: maximum displacement of the image corners as fraction of the image size
+    :param crop_size: (width, height) of a random crop of the transformed image, default: the scaled image
+    :return: transformation matrix and the (width, height) of the transformed image
+    """
+    s = rng.uniform(*scale)
+    out_w, out_h = round(width * s), round(height * s)
+    m = rotation_matrix(rng.uniform(-max_rotation, max_rotation), (out_w / 2, out_h / 2)) @ scale_matrix(s)
+    if rng.random() < hflip_p:
+        m = hflip_matrix(out_w) @ m
+    if rng.random() < vflip_p:
+        m = vflip_matrix(out_h) @ m
+    if max_perspective > 0:
+        corners = np.array([[0, 0], [out_w, 0], [out_w, out_h], [0, out_h]], dtype=np.float64)
+        displacement = rng.uniform(-max_perspective, max_perspective, size=(4, 2)) * [out_w, out_h]
+        m = perspective_matrix(corners, corners + displacement) @ m
+    if crop_size is not None:
+        crop_w, crop_h = crop_size
+        tx = rng.uniform(min(0, out_w - crop_w), max(0, out_w - crop_w))
+        ty = rng.uniform(min(0, out_h - crop_h), max(0, out_h - crop_h))
+        m = translation_matrix(-tx, -ty) @ m
+        out_w, out_h = crop_w, crop_h
+    return m, (out_w, out_h)
+
+
+def transform_points(matrices: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """
+    :param matrices: (3, 3) matrix or (n, 3, 3) matrix of each point
+    :param points: (n, 2) points as (x, y)
+    """
+    hom = np.concatenate([points, np.ones((len(points), 1))], axis=1)
+    if matrices.ndim == 2:
+        out = hom @ matrices.T
+    else:
+        out = np.einsum("nij,nj->ni", matrices, hom)
+    return out[:, :2] / out[:, 2:]
+
+
+def transform_geometries(
+        geometries: Sequence[DiagramGeometry],
+        matrices: Sequence[np.ndarray],
+        out_sizes: Sequence[Tuple[int, int]],
+        arrow_min_whs: Sequence[float],
+        min_visible: float = 0.5,
+) -> List[TransformedGeometry]:
+    """
+    Transforms the geometry of a batch of diagrams with one matrix operation per kind of coordinate.
+    Shape and label boxes become the bounding box of their transformed corners, edge boxes are derived from the
+    transformed waypoints (like BoundingBox.from_points) and padded to arrow_min_wh (like
+    BpmnParser.resize_arrows_to_min_wh). Annotations whose box is less than min_visible within the image are
+    marked to be dropped, the geometry of the others is clipped to the image.
+    :param out_sizes: (width, height) of each transformed image
+    :param arrow_min_whs: minimum edge box width and height of each diagram
+    """
+    counts = np.array([len(g.boxes) for g in geometries], dtype=np.int64)
+    wp_counts = np.array([len(g.waypoints) for g in geometries], dtype=np.int64)
+    matrices = np.asarray(matrices, dtype=np.float64).reshape(-1, 3, 3)
+    sizes = np.asarray(out_sizes, dtype=np.float64).reshape(-1, 2)
+    n = int(counts.sum())
+
+    boxes = _concat([g.boxes for g in geometries], (0, 4))
+    is_edge = _concat([g.is_edge for g in geometries], (0,), dtype=bool)
+    keypoints = _concat([g.keypoints for g in geometries], (0, len(ARROW_KEYPOINT_FIELDS), 2))
+    waypoints = _concat([g.waypoints for g in geometries], (0, 2))
+    ann_m = np.repeat(matrices, counts, axis=0)
+    ann_wh = np.repeat(sizes, counts, axis=0)
+    wp_wh = np.repeat(sizes, wp_counts, axis=0)
+
+    # box corners as (x, y): (l, t), (r, t), (r, b), (l, b)
+    t, l, b, r = boxes.T
+    corners = np.stack([np.stack([l, t], 1), np.stack([r, t], 1), np.stack([r, b], 1), np.stack([l, b], 1)], 1)
+    corners = transform_points(np.repeat(ann_m, 4, axis=0), corners.reshape(-1, 2)).reshape(n, 4, 2)
+    new_boxes = np.concatenate([corners.min(axis=1)[:, ::-1], corners.max(axis=1)[:, ::-1]], axis=1)
+
+    new_waypoints = transform_points(np.repeat(matrices, wp_counts, axis=0), waypoints)
+    kp_valid = ~np.isnan(keypoints).any(axis=2)
+    new_keypoints = np.full_like(keypoints, np.nan)
+    new_keypoints[kp_valid] = transform_points(np.repeat(ann_m[:, None], keypoints.shape[1], axis=1)[kp_valid],
+                                               keypoints[kp_valid])
+
+    # edges: box of the waypoints, i.e. +1 to convert from pixel to coordinate-based (see BoundingBox.from_points)
+    offsets = np.concatenate([[0], np.cumsum(np.concatenate([np.diff(g.waypoint_offsets) for g in geometries]))]) \
+        if n > 0 else np.zeros(1, dtype=np.int64)
+    has_wps = is_edge & (np.diff(offsets) > 0)
+    if has_wps.any():
+        starts = offsets[:-1][has_wps]
+        new_boxes[has_wps, :2] = np.minimum.reduceat(new_waypoints, starts, axis=0)[:, ::-1]
+        new_boxes[has_wps, 2:] = np.maximum.reduceat(new_waypoints, starts, axis=0)[:, ::-1] + 1
+
+    clipped = _clip_boxes(new_boxes, ann_wh)
+    area = (new_boxes[:, 2] - new_boxes[:, 0]) * (new_boxes[:, 3] - new_boxes[:, 1])
+    clipped_area = (clipped[:, 2] - clipped[:, 0]) * (clipped[:, 3] - clipped[:, 1])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        visible = np.where(area > 0, clipped_area / area, (clipped_area >= 0).astype(np.float64))
+    keep = visible >= min_visible
+
+    # waypoints and keypoints are clipped to the image, edge boxes are derived from the clipped waypoints
+    new_waypoints = np.clip(new_waypoints, 0, wp_wh)
+    new_keypoints = np.clip(new_keypoints, 0, ann_wh[:, None])
+    if has_wps.any():
+        starts = offsets[:-1][has_wps]
+        lt = np.minimum.reduceat(new_waypoints, starts, axis=0)
+        rb = np.maximum.reduceat(new_waypoints, starts, axis=0) + 1
+        min_wh = np.repeat(np.asarray(arrow_min_whs, dtype=np.float64), counts)[has_wps, None]
+        center = (lt + rb) / 2
+        wh = np.maximum(rb - lt, min_wh)
+        # (l, t, r, b) -> (t, l, b, r)
+        clipped[has_wps] = np.concatenate([center - wh / 2, center + wh / 2], axis=1)[:, [1, 0, 3, 2]]
+        clipped = _clip_boxes(clipped, ann_wh)
+
+    results = []
+    ann_splits = np.cumsum(counts)[:-1]
+    wp_splits = np.cumsum(wp_counts)[:-1]
+    for g, g_boxes, g_keep, g_keypoints, g_waypoints in zip(
+            geometries, np.split(clipped, ann_splits), np.split(keep, ann_splits), np.split(new_keypoints, ann_splits),
+            np.split(new_waypoints, wp_splits)):
+        geometry = DiagramGeometry(g_boxes, g.is_edge, g.waypoint_offsets, g_waypoints, g_keypoints)
+        results.append(TransformedGeometry(geometry, g_keep))
+    return results
+
+
+def augment_batch(
+        ais: Sequence[AnnotatedImage],
+        matrices: Sequence[np.ndarray],
+        out_sizes: Sequence[Tuple[int, int]],
+        arrow_min_wh: float = 20,
+        img_max_size_ref: int = 1000,
+        min_visible: float = 0.5,
+        fill: int = 255,
+) -> List[AnnotatedImage]:
+    """
+    Applies an affine or perspective transformation to the image and the annotations of each AnnotatedImage,
+    the geometry of the whole batch is transformed at once with transform_geometries.
+    Annotations that are dropped are removed consistently: labels of dropped elements are dropped as well,
+    relations to dropped annotations are removed (pool is set to None), like for excluded categories in BpmnParser.
+    The input images and annotations are not modified.
+    :param matrices: (3, 3) transformation matrix of each image, e.g. from random_transform
+    :param out_sizes: (width, height) of each transformed image
+    :param arrow_min_wh: minimum edge width and height relative to img_max_size_ref, as in BpmnParser
+    :param min_visible: minimum fraction of a box that has to be within the transformed image
+    :param fill: value of pixels outside of the source image
+    """
+    assert len(ais) == len(matrices) == len(out_sizes), f"{len(ais)}, {len(matrices)}, {len(out_sizes)}"
+    geometries = [DiagramGeometry.from_anns(ai.annotations) for ai in ais]
+    arrow_min_whs = [arrow_min_wh * max(size) / img_max_size_ref for size in out_sizes]
+    transformed = transform_geometries(geometries, matrices, out_sizes, arrow_min_whs, min_visible)
+
+    results = []
+    for ai, m, size, (geometry, keep) in zip(ais, matrices, out_sizes, transformed):
+        anns = _transformed_anns(ai.annotations, geometry, keep)
+        img = _transform_img(ai.img, np.asarray(m, dtype=np.float64), size, fill) if ai.img is not None else None
+        results.append(AnnotatedImage(ai.filename, width=size[0], height=size[1], annotations=anns, img=img))
+    return results
+
+
+def augment(ai: AnnotatedImage, matrix: np.ndarray, out_size: Tuple[int, int], **kwargs) -> AnnotatedImage:
+    """see augment_batch"""
+    return augment_batch([ai], [matrix], [out_size], **kwargs)[0]
+
+
+def _transformed_anns(anns: List[Annotation], geometry: DiagramGeometry, keep: np.ndarray) -> List[Annotation]:
+    keep = keep.tolist()
+    idx = {id(a): i for i, a in enumerate(anns)}
+    # labels of dropped elements are dropped as well
+    for i, a in enumerate(anns):
+        owner = a.get("text_belongs_to") if a.category == syntax.LABEL and "text_belongs_to" in a else None
+        if isinstance(owner, Annotation) and id(owner) in idx and not keep[idx[id(owner)]]:
+            keep[i] = False
+
+    boxes = geometry.boxes.tolist()
+    offsets = geometry.waypoint_offsets.tolist()
+    new_anns = {}
+    for i, a in enumerate(anns):
+        if not keep[i]:
+            continue
+        fields = a.extra_fields
+        if "waypoints" in fields:
+            fields["waypoints"] = geometry.waypoints[offsets[i]:offsets[i + 1]].copy()
+        for j, field in enumerate(ARROW_KEYPOINT_FIELDS):
+            if fields.get(field, None) is not None:
+                fields[field] = geometry.keypoints[i, j].copy()
+        new_anns[id(a)] = Annotation(a.category, BoundingBox(*boxes[i], allow_neg_coord=True), **fields)
+
+    relink_subset_(new_anns)
+    return list(new_anns.values())
+
+
+def relink_subset_(new_anns: Dict[int, Annotation]):
+    """
+    Points the relations of copied annotations to the copies, relations to annotations that were not copied are
+    removed (pool is set to None), like for excluded categories in BpmnParser.
+    :param new_anns: id() of each copied annotation -> its copy, the copies still reference the original annotations
+    """
+    for new_a in new_anns.values():
+        for rel in (*_REMOVABLE_RELATIONS, "pool"):
+            related = new_a.get(rel) if rel in new_a else None
+            if not isinstance(related, Annotation):
+                continue
+            if id(related) in new_anns:
+                new_a.set(rel, new_anns[id(related)])
+            elif rel == "pool":
+                new_a.pool = None
+            else:
+                delattr(new_a, rel)
+
+
+def _transform_img(img: Image.Image, m: np.ndarray, size: Tuple[int, int], fill: int) -> Image.Image:
+    # PIL maps output to input coordinates
+    inv = np.linalg.inv(m)
+    inv /= inv[2, 2]
+    fillcolor = fill if img.mode in ("L", "I", "F") else (fill,) * len(img.getbands())
+    if np.allclose(inv[2, :2], 0):
+        return img.transform(size, Image.AFFINE, tuple(inv.reshape(-1)[:6]), Image.BILINEAR, fillcolor=fillcolor)
+    return img.transform(size, Image.PERSPECTIVE, tuple(inv.reshape(-1)[:8]), Image.BILINEAR, fillcolor=fillcolor)
+
+
+def _clip_boxes(boxes: np.ndarray, wh: np.ndarray) -> np.ndarray:
+    """:param wh: (n, 2) image width and height of each box"""
+    hw = wh[:, ::-1]
+    return np.concatenate([np.clip(boxes[:, :2], 0, hw), np.clip(boxes[:, 2:], 0, hw)], axis=1)
+
+
+def _concat(arrays: List[np.ndarray], empty_shape, dtype=np.float64) -> np.ndarray:
+    if len(arrays) == 0:
+        return np.zeros(empty_shape, dtype=dtype)
+    return np.concatenate(arrays).astype(dtype, copy=False)
@@ -0,0 +1,185 @@
+import logging
+from typing import Any, Dict, Iterator, List, Tuple, Type
+
+import numpy as np
+from yamlu.img import Annotation, BoundingBox
+
+from pybpmn import syntax
+from pybpmn.constants import ARROW_NEXT_REL, ARROW_PREV_REL, TEXT_BELONGS_TO_REL
+
+_logger = logging.getLogger(__name__)
+
+
+class BpmnElement:
+    """
+    Memory-compact counterpart of a yamlu Annotation with a fixed set of fields.
+    Geometry is stored in contiguous arrays of the owning CompactDiagram, the element only keeps its index.
+    Fields that are not set on the corresponding Annotation are left unset (accessing them raises AttributeError),
+    rarely used fields are kept in the side table CompactDiagram.extra_fields.
+    """
+    __slots__ = ("_diagram", "_index", "category_code", "id", "name")
+    # Annotation fields that are stored in slots
+    FIELDS: Tuple[str, ...] = ("id", "name")
+
+    def __init__(self, diagram: "CompactDiagram", index: int, category: str):
+        """
+        :param category: one of syntax.ALL_CATEGORIES
+        """
+        self._diagram = diagram
+        self._index = index
+        self.category_code = syntax.CATEGORY_TO_CODE[category]
+
+    @property
+    def category(self) -> str:
+        return syntax.ALL_CATEGORIES[self.category_code]
+
+    @property
+    def box(self) -> np.ndarray:
+        """(t, l, b, r) view into CompactDiagram.boxes"""
+        return self._diagram.boxes[self._index]
+
+    @property
+    def bb(self) -> BoundingBox:
+        return BoundingBox(*self.box.tolist(), allow_neg_coord=True)
+
+    def __repr__(self):
+        fields = [f"{k}={getattr(self, k)!r}" for k in self.FIELDS
+                  if hasattr(self, k) and not isinstance(getattr(self, k), BpmnElement)]
+        return f"{self.__class__.__name__}(category='{self.category}', box={self.box.tolist()}, {', '.join(fields)})"
+
+
+class BpmnShape(BpmnElement):
+    __slots__ = ("pool", "lane")
+    FIELDS = (*BpmnElement.FIELDS, "pool", "lane")
+
+
+class BpmnEdge(BpmnElement):
+    __slots__ = (ARROW_PREV_REL, ARROW_NEXT_REL, "keypoints_from_waypoints")
+    FIELDS = (*BpmnElement.FIELDS, ARROW_PREV_REL, ARROW_NEXT_REL)
+
+    def __init__(self, diagram: "CompactDiagram", index: int, category: str):
+        super().__init__(diagram, index, category)
+        # True if the annotation has tail/head fields that equal the first/last waypoint (see scale_anns_to_img_width_)
+        self.keypoints_from_waypoints = False
+
+    @property
+    def waypoints(self) -> np.ndarray:
+        """(n, 2) view into CompactDiagram.waypoints"""
+        offsets = self._diagram.waypoint_offsets
+        return self._diagram.waypoints[offsets[self._index]:offsets[self._index + 1]]
+
+
+class BpmnLabel(BpmnElement):
+    __slots__ = (TEXT_BELONGS_TO_REL,)
+    FIELDS = (*BpmnElement.FIELDS, TEXT_BELONGS_TO_REL)
+
+
+class CompactDiagram:
+    """
+    Memory-compact representation of the annotations of a diagram, e.g. for caching parsed models.
+    Boxes and waypoints of all elements are stored in contiguous arrays, relation fields reference other elements
+    of the same diagram and vendor-specific or other rare fields are kept in a side table
+    that maps the element index to a dict of fields.
+    Annotations are only created on demand with to_annotations (e.g. at the yamlu/COCO boundary).
+
+    NOTE: This is a post-hoc compaction of parsed Annotations (see from_annotations), the parser still creates
+    all Annotations first, so memory and allocations while parsing are unchanged. Only the retained diagram is smaller,
+    e.g. about 17 KB instead of 39-45 KB for tests/resources/process.bpmn.
+    """
+    __slots__ = ("elements", "extra_fields", "boxes", "waypoints", "waypoint_offsets")
+
+    def __init__(self):
+        self.elements: List[BpmnElement] = []
+        self.extra_fields: Dict[int, Dict[str, Any]] = {}
+        self.boxes = np.zeros((0, 4), dtype=np.float64)
+        self.waypoints = np.zeros((0, 2), dtype=np.float64)
+        self.waypoint_offsets = np.zeros(1, dtype=np.int64)
+
+    @classmethod
+    def from_annotations(cls, anns: List[Annotation]) -> "CompactDiagram":
+        """:param anns: e.g. of BpmnParser.parse_bpmn_anns, they can be released afterwards"""
+        d = cls()
+        d.elements = [_element_cls(a.category)(d, i, a.category) for i, a in enumerate(anns)]
+        d.boxes = np.array([a.bb.tlbr for a in anns], dtype=np.float64).reshape(len(anns), 4)
+
+        wps = [np.asarray(a.waypoints, dtype=np.float64).reshape(-1, 2) for a in anns if "waypoints" in a]
+        n_wps = [len(a.waypoints) if "waypoints" in a else 0 for a in anns]
+        d.waypoints = np.concatenate(wps) if len(wps) > 0 else np.zeros((0, 2), dtype=np.float64)
+        d.waypoint_offsets = np.concatenate([[0], np.cumsum(n_wps, dtype=np.int64)])
+
+        ann_to_element = {id(a): el for a, el in zip(anns, d.elements)}
+
+        def to_compact(v):
+            return ann_to_element[id(v)] if isinstance(v, Annotation) else v
+
+        for i, (a, el) in enumerate(zip(anns, d.elements)):
+            kps_from_waypoints = isinstance(el, BpmnEdge) and _has_waypoint_keypoints(a)
+            if kps_from_waypoints:
+                el.keypoints_from_waypoints = True
+
+            extra = {}
+            for k, v in a.extra_fields.items():
+                if k in el.FIELDS:
+                    setattr(el, k, to_compact(v))
+                elif k == "waypoints" and isinstance(el, BpmnEdge):
+                    continue
+                elif kps_from_waypoints and k in {"head", "tail"}:
+                    continue
+                else:
+                    extra[k] = to_compact(v)
+            if len(extra) > 0:
+                d.extra_fields[i] = extra
+
+        return d
+
+    def to_annotations(self) -> List[Annotation]:
+        boxes = self.boxes.tolist()
+        anns = [Annotation(el.category, BoundingBox(*box, allow_neg_coord=True)) for el, box in
+                zip(self.elements, boxes)]
+        el_to_ann = {id(el): a for el, a in zip(self.elements, anns)}
+
+        def to_ann(v):
+            return el_to_ann[id(v)] if isinstance(v, BpmnElement) else v
+
+        for i, (el, a) in enumerate(zip(self.elements, anns)):
+            for k in el.FIELDS:
+                if hasattr(el, k):
+                    a.set(k, to_ann(getattr(el, k)))
+            if isinstance(el, BpmnEdge):
+                a.waypoints = el.waypoints.copy()
+                if el.keypoints_from_waypoints:
+                    a.tail = a.waypoints[0]
+                    a.head = a.waypoints[-1]
+            for k, v in self.extra_fields.get(i, {}).items():
+                a.set(k, to_ann(v))
+        return anns
+
+    def __len__(self):
+        return len(self.elements)
+
+    def __iter__(self) -> Iterator[BpmnElement]:
+        return iter(self.elements)
+
+    def __getitem__(self, idx) -> BpmnElement:
+        return self.elements[idx]
+
+    @property
+    def categories(self) -> List[str]:
+        return [el.category for el in self.elements]
+
+    def __repr__(self):
+        return f"CompactDiagram({len(self.elements)} elements, {len(self.extra_fields)} with extra fields)"
+
+
+def _element_cls(category: str) -> Type[BpmnElement]:
+    if category in syntax.BPMNDI_EDGE_CATEGORIES:
+        return BpmnEdge
+    if category == syntax.LABEL:
+        return BpmnLabel
+    return BpmnShape
+
+
+def _has_waypoint_keypoints(a: Annotation) -> bool:
+    if "waypoints" not in a or "tail" not in a or "head" not in a:
+        return False
+    return np.array_equal(a.tail, a.waypoints[0]) and np.array_equal(a.head, a.waypoints[-1])
@@ -1,20 +1,30 @@
 import logging
 from abc import abstractmethod
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from itertools import islice
 from pathlib import Path
-from typing import Dict, List, Union
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
 
+import numpy as np
 import yamlu
+from lxml import etree
 from yamlu.coco import Dataset
 from yamlu.img import AnnotatedImage
 
+from pybpmn import serialize
 from pybpmn.constants import ARROW_KEYPOINT_FIELDS, RELATIONS
-from pybpmn.parser import BpmnParser
+from pybpmn.parser import BpmnParser, InvalidBpmnException
 from pybpmn.syntax import *
 from pybpmn.util import split_img_id
 
 _logger = logging.getLogger(__name__)
 
+# set in worker processes by init_worker
+_worker_plan: Optional["DatasetPlan"] = None
+_worker_parser: Optional[BpmnParser] = None
+
 HDBPMN_CATEGORY_GROUPS = {
     'activity': [TASK, SUBPROCESS_COLLAPSED, SUBPROCESS_EXPANDED, CALL_ACTIVITY],
     'event': UNTYPED_EVENTS + [TERMINATE_EVENT] + MESSAGE_EVENTS + TIMER_EVENTS,
@@ -49,6 +59,7 @@ class BpmnDataset(Dataset):
         self.split_to_bpmn_paths = self.get_split_to_bpmn_paths()
         self.img_id_to_bpmn_path = {p.stem: p for ps in self.split_to_bpmn_paths.values() for p in ps}
 
+        self.parser_kwargs = parser_kwargs
         self.bpmn_parser = BpmnParser(**parser_kwargs)
         super().__init__(
             dataset_path=coco_dataset_root,
@@ -78,17 +89,91 @@ class BpmnDataset(Dataset):
         img_path = self.get_img_path(bpmn_path.stem)
 
         ai = self.bpmn_parser.parse_bpmn_img(bpmn_path, img_path)
+        _to_coco_anns_(ai, self.category_translate_dict)
+        return ai
 
-        # "id" is reserved in coco, therefore use other field name
-        for a in ai.annotations:
-            if "id" in a:
-                a.bpmn_id = a.id
-            if a.category in self.category_translate_dict.keys():
-                # noinspection PyPropertyAccess
-                a.category = self.category_translate_dict[a.category]
-
+    def iter_split(self, split: str, prefetch: int = 16, workers: int = 0, io_threads: int = 4,
+                   ordered: bool = True) -> Iterator[AnnotatedImage]:
+        """
+        Iterates the images of a split like get_split_ann_img, but reads the bpmn and image files ahead on an I/O
+        thread pool, so that storage latency overlaps with parsing and decoding.
+        At most prefetch images are read or parsed ahead of the consumer, which bounds the memory usage.
+        :param workers: number of worker processes that parse and decode, 0 to parse in the calling thread
+        :param ordered: False to yield the images as soon as they are parsed
+        """
+        plan = self.compile_plan()
+        bpmn_paths, img_paths = plan.split_bpmn_paths[split], plan.split_img_paths[split]
+        idxs = iter(range(len(bpmn_paths)))
+
+        cpu_pool = nullcontext()
+        if workers > 0:
+            cpu_pool = ProcessPoolExecutor(workers, initializer=init_worker, initargs=(plan,))
+            # starts the worker processes before the I/O threads, processes are not forked while threads are running
+            cpu_pool.submit(int).result()
+        with cpu_pool, ThreadPoolExecutor(io_threads) as io_pool:
+            def submit(idx: int) -> Future:
+                read = io_pool.submit(_read_bytes, bpmn_paths[idx], img_paths[idx])
+                if workers == 0:
+                    return read
+                return _chain(read, lambda data: cpu_pool.submit(_parse_planned_bytes, split, idx, *data))
+
+            pending = deque(submit(idx) for idx in islice(idxs, prefetch))
+            try:
+                while len(pending) > 0:
+                    if ordered:
+                        future = pending.popleft()
+                    else:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        future = next(f for f in pending if f in done)
+                        pending.remove(future)
+                    result = future.result()
+                    next_idx = next(idxs, None)
+                    if next_idx is not None:
+                        pending.append(submit(next_idx))
+
+                    if workers == 0:
+                        yield self._parse_bytes(*result)
+                    else:
+                        filename, width, height, anns_data, img = result
+                        yield AnnotatedImage(filename, width, height, serialize.loads(anns_data), img=img)
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _parse_bytes(self, bpmn_bytes: bytes, img_bytes: bytes, filename: str) -> AnnotatedImage:
+        ai = self.bpmn_parser.parse_bpmn_img(bpmn_bytes, img_bytes, filename=filename)
+        _to_coco_anns_(ai, self.category_translate_dict)
         return ai
 
+    def compile_plan(self) -> "DatasetPlan":
+        """
+        Resolves the bpmn and image paths of all images (with one scan of the images directory),
+        e.g. to send them to worker processes once with init_worker, after which tasks only need split and index.
+        """
+        stem_to_img_paths = defaultdict(list)
+        for p in self.images_root.glob("**/*"):
+            if p.is_file():
+                stem_to_img_paths[p.stem].append(p)
+
+        split_bpmn_paths = {}
+        split_img_paths = {}
+        for split, bpmn_paths in self.split_to_bpmn_paths.items():
+            img_paths = [stem_to_img_paths[p.stem] for p in bpmn_paths]
+            for bpmn_path, ps in zip(bpmn_paths, img_paths):
+                assert len(ps) == 1, f"{bpmn_path.stem}: {ps}"
+            # fixed-width string arrays are pickled as one buffer instead of one object per path
+            split_bpmn_paths[split] = np.array([str(p) for p in bpmn_paths], dtype=str)
+            split_img_paths[split] = np.array([str(ps[0]) for ps in img_paths], dtype=str)
+
+        return DatasetPlan(
+            name=self.name,
+            split_bpmn_paths=split_bpmn_paths,
+            split_img_paths=split_img_paths,
+            cat_name_to_id=dict(self.cat_name_to_id),
+            category_translate_dict=dict(self.category_translate_dict),
+            parser_kwargs=dict(self.parser_kwargs),
+        )
+
     @property
     def annotations_root(self):
         return self.bpmn_dataset_root / "data" / "annotations"
@@ -115,7 +200,7 @@ class BpmnDataset(Dataset):
         coco_categories = []
         for supercategory, categories in self.category_groups.items():
             for category in categories:
-                if category in self.bpmn_parser.excluded_categories:
+                if not self.bpmn_parser.is_included_category(category):
                     continue
                 category = self.category_translate_dict.get(category, category)
                 if category in seen_cats:
@@ -136,6 +221,90 @@ class BpmnDataset(Dataset):
         return coco_categories
 
 
+class DatasetPlan(NamedTuple):
+    """Everything that is needed to parse the images of a BpmnDataset in a worker process, see compile_plan"""
+    name: str
+    # split -> bpmn/image path of each image index
+    split_bpmn_paths: Dict[str, np.ndarray]
+    split_img_paths: Dict[str, np.ndarray]
+    cat_name_to_id: Dict[str, int]
+    category_translate_dict: Dict[str, str]
+    parser_kwargs: Dict
+
+
+def init_worker(plan: DatasetPlan):
+    """
+    Initializer of worker processes (e.g. ProcessPoolExecutor(initializer=init_worker, initargs=(plan,))).
+    With the fork start method, the plan is inherited instead of pickled.
+    """
+    global _worker_plan, _worker_parser
+    _worker_plan = plan
+    _worker_parser = BpmnParser(**plan.parser_kwargs)
+
+
+def parse_planned(split: str, idx: int) -> AnnotatedImage:
+    """Equivalent of BpmnDataset.get_split_ann_img in a worker process that was initialized with init_worker"""
+    assert _worker_plan is not None, "init_worker has not been called in this process"
+    bpmn_path = Path(_worker_plan.split_bpmn_paths[split][idx])
+    img_path = Path(_worker_plan.split_img_paths[split][idx])
+    ai = _worker_parser.parse_bpmn_img(bpmn_path, img_path)
+    _to_coco_anns_(ai, _worker_plan.category_translate_dict)
+    return ai
+
+
+def _read_bytes(bpmn_path: str, img_path: str) -> Tuple[bytes, bytes, str]:
+    img_path = Path(img_path)
+    return Path(bpmn_path).read_bytes(), img_path.read_bytes(), img_path.name
+
+
+def _parse_planned_bytes(split: str, idx: int, bpmn_bytes: bytes, img_bytes: bytes, filename: str):
+    """parse_planned with the file contents that were read ahead by BpmnDataset.iter_split"""
+    try:
+        ai = _worker_parser.parse_bpmn_img(bpmn_bytes, img_bytes, filename=filename)
+    except etree.XMLSyntaxError as e:
+        # XMLSyntaxError can not be pickled to be sent back from the worker process
+        raise InvalidBpmnException("XML syntax error", f"{filename}: {e}") from None
+    _to_coco_anns_(ai, _worker_plan.category_translate_dict)
+    # the annotations are sent back with pybpmn.serialize, which is smaller and faster than pickling them
+    return ai.filename, ai.width, ai.height, serialize.dumps(ai.annotations), ai.img
+
+
+def _chain(future: Future, then) -> Future:
+    """:return: future of then(future.result()).result(), where then submits another task"""
+    chained = Future()
+
+    def on_done(f: Future):
+        if f.cancelled() or not chained.set_running_or_notify_cancel():
+            chained.cancel()
+            return
+        try:
+            then(f.result()).add_done_callback(lambda g: _copy_result(g, chained))
+        except BaseException as e:
+            chained.set_exception(e)
+
+    future.add_done_callback(on_done)
+    return chained
+
+
+def _copy_result(source: Future, target: Future):
+    if source.cancelled():
+        target.set_exception(RuntimeError("task was cancelled"))
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def _to_coco_anns_(ai: AnnotatedImage, category_translate_dict: Dict[str, str]):
+    # "id" is reserved in coco, therefore use other field name
+    for a in ai.annotations:
+        if "id" in a:
+            a.bpmn_id = a.id
+        if a.category in category_translate_dict.keys():
+            # noinspection PyPropertyAccess
+            a.category = category_translate_dict[a.category]
+
+
 class HdBpmnDataset(BpmnDataset):
     def __init__(
             self,
@@ -226,6 +395,20 @@ class ComputerGeneratedDataset(BpmnDataset):
 
         return split_to_bpmn_paths
 
+    @staticmethod
+    def write_filename_split(bpmn_dataset_root: Union[Path, str], filename_to_split: Dict[str, str]):
+        """
+        Writes the filename_split.csv that is read by get_split_to_bpmn_paths,
+        e.g. with splits from pybpmn.fingerprint.assign_group_splits that keep near-duplicates in the same split
+        :param filename_to_split: mapping from bpmn filename (without suffix) to split
+        """
+        csv_path = Path(bpmn_dataset_root) / "data" / "filename_split.csv"
+        csv_path.parent.mkdir(exist_ok=True, parents=True)
+        with csv_path.open("w") as f:
+            f.write("filename,split\n")
+            for fname, split in filename_to_split.items():
+                f.write(f"{fname},{split}\n")
+
     def _parse_filename_to_split(self) -> Dict[str, str]:
         csv_path = self.bpmn_dataset_root / "data" / "filename_split.csv"
 
@@ -0,0 +1,204 @@
+import logging
+import multiprocessing
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from joblib import Parallel, delayed
+from tqdm import tqdm
+from yamlu.coco import CocoDatasetExport, Dataset
+from yamlu.img import AnnotatedImage
+
+from pybpmn import metrics as pipeline_metrics, render, serialize
+from pybpmn.dataset import BpmnDataset, init_worker, parse_planned
+from pybpmn.metrics import Metrics
+from pybpmn.parser import InvalidBpmnException
+
+_logger = logging.getLogger(__name__)
+
+
+class _ExportSettings(NamedTuple):
+    split: str
+    split_path: Path
+    ann_imgs_path: Path
+    write_img: bool
+    write_ann_img: bool
+    buckets: Tuple[float, ...]
+
+
+# set in worker processes by _init_export_worker
+_worker_settings: Optional[_ExportSettings] = None
+
+# filename, width, height, serialized annotations, metrics snapshot, seconds spent on the image
+# (filename and annotations are None if the diagram is invalid)
+_ImageResult = Tuple[Optional[str], int, int, Optional[bytes], dict, float]
+
+
+class BpmnCocoDatasetExport(CocoDatasetExport):
+    """
+    CocoDatasetExport that records pipeline metrics of each image (see pybpmn.metrics): bytes read/written,
+    parse, decode and write latencies and InvalidBpmnExceptions by error_type (recorded by BpmnParser).
+    Images with invalid diagrams are skipped.
+    While a split is exported, throughput, ETA and worker utilization are logged and the metrics are flushed
+    to their sinks every report_interval_s seconds.
+
+    With n_jobs > 1 and a BpmnDataset, each worker process is initialized once with the compiled plan of the dataset
+    (see BpmnDataset.compile_plan) and tasks only carry image indices, instead of pickling the dataset per task.
+    """
+
+    def __init__(self, ds: Dataset, metrics: Optional[Metrics] = None, report_interval_s: float = 30.0, **kwargs):
+        """
+        :param metrics: e.g. Metrics(sinks=[PrometheusTextfileSink(...)])
+        :param kwargs: CocoDatasetExport arguments
+        """
+        super().__init__(ds, **kwargs)
+        self.metrics = Metrics() if metrics is None else metrics
+        self.report_interval_s = report_interval_s
+
+    def dump_split(self, split: str) -> List[AnnotatedImage]:
+        _logger.info("%s: starting split=%s, write_img=%s, write_ann_img=%s, sample=%s, random_sample=%s", self.ds.name,
+                     split, self.write_img, self.write_ann_img, self.sample, self.random_sample)
+        assert split in self.ds.splits, f"{split} not in {self.ds.splits}"
+
+        split_path = self.create_split_path_dir(split, remove_existing_images=self.write_img)
+
+        ann_imgs_path = split_path.parent / f"{split}_annotated"
+        if self.write_ann_img:
+            ann_imgs_path.mkdir(exist_ok=True, parents=True)
+            # remove existing files in directory
+            for p in ann_imgs_path.iterdir():
+                p.unlink()
+
+        idxs = list(range(self.ds.split_n_imgs[split]))
+        if self.sample is not None and len(idxs) > self.sample:
+            if self.random_sample:
+                random.seed(0)
+                idxs = random.sample(idxs, self.sample)
+            else:
+                idxs = idxs[:self.sample]
+
+        # results are consumed as they are done, so that progress can be reported while the split is exported
+        if self.n_jobs > 1 and isinstance(self.ds, BpmnDataset):
+            settings = _ExportSettings(split, split_path, ann_imgs_path, self.write_img, self.write_ann_img,
+                                       self.metrics.buckets)
+            results = self._map_planned(settings, idxs)
+        else:
+            parallel = Parallel(n_jobs=self.n_jobs, return_as="generator")
+            results = parallel(delayed(self._dump_image_with_metrics)(idx, split, split_path, ann_imgs_path)
+                               for idx in idxs)
+        # the bar wraps the results, wrapping the input would measure the dispatch of the tasks
+        results = tqdm(results, total=len(idxs))
+
+        ann_imgs = []
+        n_done = 0
+        start = last_report = time.perf_counter()
+        busy_s = 0.0
+        try:
+            for filename, width, height, anns_data, snapshot, image_s in results:
+                if anns_data is not None:
+                    ann_imgs.append(AnnotatedImage(filename, width, height, serialize.loads(anns_data)))
+                self.metrics.merge(snapshot)
+                n_done += 1
+                busy_s += image_s
+                now = time.perf_counter()
+                if now - last_report >= self.report_interval_s:
+                    self._report(split, n_done, len(idxs), now - start, busy_s)
+                    last_report = now
+        finally:
+            self._report(split, n_done, len(idxs), time.perf_counter() - start, busy_s)
+        if n_done > len(ann_imgs):
+            _logger.warning("%s: split=%s skipped %d invalid diagrams", self.ds.name, split, n_done - len(ann_imgs))
+
+        with self.metrics.timer("write_ms", split=split, file="coco_json"):
+            self.coco_json_exporter.dump_split_coco_json(ann_imgs, split)
+        self.metrics.flush()
+
+        return ann_imgs
+
+    def _map_planned(self, settings: _ExportSettings, idxs: Sequence[int]) -> Iterator[_ImageResult]:
+        plan = self.ds.compile_plan()
+        # fork: the plan is inherited by the workers instead of being pickled for each of them
+        start_methods = multiprocessing.get_all_start_methods()
+        mp_context = multiprocessing.get_context("fork" if "fork" in start_methods else "spawn")
+        chunksize = max(1, min(64, len(idxs) // (4 * self.n_jobs)))
+        with ProcessPoolExecutor(self.n_jobs, mp_context=mp_context, initializer=_init_export_worker,
+                                 initargs=(plan, settings)) as pool:
+            yield from pool.map(_dump_planned_image, idxs, chunksize=chunksize)
+
+    def _dump_image_with_metrics(self, idx, split, split_path, ann_imgs_path) -> _ImageResult:
+        """
+        Runs in a worker process (or in the main process with n_jobs=1), see Metrics for the pickling semantics.
+        """
+        metrics = Metrics(buckets=self.metrics.buckets)
+        start = time.perf_counter()
+        try:
+            with metrics.activate():
+                ann_img = self.dump_image(idx, split, split_path, ann_imgs_path)
+        except InvalidBpmnException as e:
+            # counted by BpmnParser in metrics, which still have to be sent back
+            _logger.warning("%s: skipping image %d of split=%s: %s", self.ds.name, idx, split, e)
+            return _failed_result(metrics, start)
+        return _to_result(ann_img, metrics, start)
+
+    def dump_image(self, idx, split, split_path, ann_imgs_path):
+        ann_img = self.ds.get_split_ann_img(split, idx)
+        _write_image(ann_img, split, split_path, ann_imgs_path, self.write_img, self.write_ann_img)
+        return ann_img
+
+    def _report(self, split: str, n_done: int, n_total: int, elapsed_s: float, busy_s: float):
+        files_per_s = n_done / elapsed_s if elapsed_s > 0 else 0.0
+        eta_s = (n_total - n_done) / files_per_s if files_per_s > 0 else float("nan")
+        utilization = busy_s / (elapsed_s * self.n_jobs) if elapsed_s > 0 else 0.0
+        self.metrics.set_gauge("files_per_second", files_per_s, split=split)
+        self.metrics.set_gauge("eta_seconds", eta_s, split=split)
+        self.metrics.set_gauge("worker_utilization", utilization, split=split)
+        _logger.info("%s: split=%s %d/%d images, %.1f images/s, ETA %.0fs, worker utilization %.0f%%",
+                     self.ds.name, split, n_done, n_total, files_per_s, eta_s, utilization * 100)
+        self.metrics.flush()
+
+
+def _init_export_worker(plan, settings: _ExportSettings):
+    global _worker_settings
+    init_worker(plan)
+    _worker_settings = settings
+
+
+def _dump_planned_image(idx: int) -> _ImageResult:
+    s = _worker_settings
+    metrics = Metrics(buckets=s.buckets)
+    start = time.perf_counter()
+    try:
+        with metrics.activate():
+            ann_img = parse_planned(s.split, idx)
+            _write_image(ann_img, s.split, s.split_path, s.ann_imgs_path, s.write_img, s.write_ann_img)
+    except InvalidBpmnException as e:
+        _logger.warning("skipping image %d of split=%s: %s", idx, s.split, e)
+        return _failed_result(metrics, start)
+    return _to_result(ann_img, metrics, start)
+
+
+def _write_image(ann_img: AnnotatedImage, split: str, split_path: Path, ann_imgs_path: Path, write_img: bool,
+                 write_ann_img: bool):
+    with pipeline_metrics.timer("write_ms", split=split, file="img"):
+        if write_img:
+            img_path = split_path / ann_img.filename
+            ann_img.img.save(img_path)
+            pipeline_metrics.inc("bytes_written_total", img_path.stat().st_size)
+
+        if write_ann_img:
+            render.save_ann_img(ann_img, ann_imgs_path)
+
+    del ann_img.img
+    pipeline_metrics.inc("files_total", split=split)
+
+
+def _to_result(ann_img: AnnotatedImage, metrics: Metrics, start: float) -> _ImageResult:
+    # the annotations are sent back with pybpmn.serialize, which is smaller and faster than pickling them
+    anns_data = serialize.dumps(ann_img.annotations)
+    return ann_img.filename, ann_img.width, ann_img.height, anns_data, metrics.snapshot(), time.perf_counter() - start
+
+
+def _failed_result(metrics: Metrics, start: float) -> _ImageResult:
+    return None, 0, 0, None, metrics.snapshot(), time.perf_counter() - start
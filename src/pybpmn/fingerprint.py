@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import random
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, Hashable, List, Optional, Set, Tuple
+
+from pybpmn import syntax
+from pybpmn.constants import ARROW_NEXT_REL, ARROW_PREV_REL, VALID_SPLITS
+from pybpmn.graph import BpmnGraph
+
+if TYPE_CHECKING:
+    import numpy as np
+    from yamlu.img import Annotation
+
+_logger = logging.getLogger(__name__)
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+@dataclass(frozen=True, eq=False)
+class DiagramFingerprint:
+    """
+    Compact structural signature of a diagram, used to find (near-)duplicates such as template models.
+    :param category_counts: sorted category multiset
+    :param graph_shape: number of nodes, edges per edge category, weakly connected components, sources and sinks
+    :param layout_sketch: occupancy bits of a grid over the shape centers, normalized to the diagram extent
+    :param minhash: MinHash signature over labeled edge and node tokens
+    """
+    category_counts: Tuple[Tuple[str, int], ...]
+    graph_shape: Tuple[int, ...]
+    layout_sketch: int
+    minhash: np.ndarray
+
+    @property
+    def structure_key(self) -> str:
+        """Exact structural key: diagrams with the same key have the same category multiset and graph shape"""
+        s = repr((self.category_counts, self.graph_shape))
+        return hashlib.blake2b(s.encode(), digest_size=8).hexdigest()
+
+    def similarity(self, other: "DiagramFingerprint") -> float:
+        """Estimated Jaccard similarity of the labeled edge sets"""
+        assert len(self.minhash) == len(other.minhash), "fingerprints use a different number of permutations"
+        return float((self.minhash == other.minhash).mean())
+
+    def layout_distance(self, other: "DiagramFingerprint") -> int:
+        """Hamming distance between the layout sketches"""
+        return bin(self.layout_sketch ^ other.layout_sketch).count("1")
+
+
+def fingerprint_anns(anns: List[Annotation], num_perm: int = 64, grid_size: int = 8,
+                     seed: int = 0) -> DiagramFingerprint:
+    """
+    :param anns: annotations as returned by BpmnParser.parse_bpmn_anns
+    :param num_perm: number of MinHash permutations
+    :param grid_size: layout sketch grid has grid_size x grid_size cells (at most 64 bits are used)
+    :param seed: seed of the MinHash permutations, has to be identical for comparable fingerprints
+    """
+    assert grid_size * grid_size <= 64, f"grid_size too large for a 64 bit sketch: {grid_size}"
+
+    category_counts = tuple(sorted(Counter(a.category for a in anns).items()))
+
+    g = BpmnGraph.from_anns(anns)
+    n_components, _ = g.connected_components()
+    stats = g.degree_stats()
+    graph_shape = (
+        g.n_nodes,
+        *(g.n_edges(c) for c in syntax.BPMNDI_EDGE_CATEGORIES),
+        n_components,
+        stats["n_sources"],
+        stats["n_sinks"],
+    )
+
+    return DiagramFingerprint(
+        category_counts=category_counts,
+        graph_shape=graph_shape,
+        layout_sketch=_layout_sketch(g.nodes, grid_size),
+        minhash=minhash(_tokens(anns), num_perm=num_perm, seed=seed),
+    )
+
+
+def minhash(tokens: Set[str], num_perm: int = 64, seed: int = 0) -> np.ndarray:
+    """
+    :return: MinHash signature with num_perm uint64 values (hashes are truncated to 32 bits)
+    """
+    import numpy as np
+
+    a, b = _permutations(num_perm, seed)
+    if len(tokens) == 0:
+        return np.full(num_perm, _MAX_HASH, dtype=np.uint64)
+
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(t.encode(), digest_size=4).digest(), "little") for t in tokens],
+        dtype=np.uint64,
+    )
+    # universal hashing (a * x + b) mod p for all permutations at once, a and x < 2^32 so a * x does not overflow
+    prime, max_hash = np.uint64(_MERSENNE_PRIME), np.uint64(_MAX_HASH)
+    phv = ((a[:, None] * hashes[None, :]) % prime + b[:, None]) % prime & max_hash
+    return phv.min(axis=1)
+
+
+class MinHashLSH:
+    """
+    Locality-sensitive index over MinHash signatures using the banding technique:
+    two signatures become candidates if all rows of at least one band are equal.
+    Insertion and lookup are O(bands), so clustering a corpus is near-linear in its size.
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16):
+        assert num_perm % bands == 0, f"num_perm={num_perm} is not divisible by bands={bands}"
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._buckets: List[Dict[bytes, List[Hashable]]] = [defaultdict(list) for _ in range(bands)]
+        self.fingerprints: Dict[Hashable, DiagramFingerprint] = {}
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def __contains__(self, key):
+        return key in self.fingerprints
+
+    def insert(self, key: Hashable, fp: DiagramFingerprint):
+        assert key not in self.fingerprints, f"{key} already inserted"
+        self.fingerprints[key] = fp
+        for bucket, band in zip(self._buckets, self._bands(fp)):
+            bucket[band].append(key)
+
+    def query(self, fp: DiagramFingerprint) -> Set[Hashable]:
+        """
+        :return: keys of all candidates that share at least one band with fp
+        """
+        candidates = set()
+        for bucket, band in zip(self._buckets, self._bands(fp)):
+            candidates.update(bucket.get(band, ()))
+        return candidates
+
+    def near_duplicates(self, fp: DiagramFingerprint, threshold: float = 0.8) -> List[Hashable]:
+        """
+        :return: candidate keys with an estimated similarity of at least threshold
+        """
+        return [k for k in self.query(fp) if self.fingerprints[k].similarity(fp) >= threshold]
+
+    def clusters(self, threshold: float = 0.8, same_structure: bool = False) -> List[List[Hashable]]:
+        """
+        Groups all inserted keys into near-duplicate clusters (connected components of the candidate pairs).
+        :param threshold: minimum estimated similarity of a candidate pair
+        :param same_structure: additionally require an equal DiagramFingerprint.structure_key
+        """
+        parent = {k: k for k in self.fingerprints}
+
+        def find(k):
+            while parent[k] != k:
+                parent[k] = parent[parent[k]]
+                k = parent[k]
+            return k
+
+        for key, fp in self.fingerprints.items():
+            for other in self.near_duplicates(fp, threshold):
+                if other == key:
+                    continue
+                if same_structure and self.fingerprints[other].structure_key != fp.structure_key:
+                    continue
+                ra, rb = find(key), find(other)
+                if ra != rb:
+                    parent[ra] = rb
+
+        groups = defaultdict(list)
+        for k in self.fingerprints:
+            groups[find(k)].append(k)
+        return list(groups.values())
+
+    def _bands(self, fp: DiagramFingerprint):
+        assert len(fp.minhash) == self.num_perm, f"{len(fp.minhash)} != {self.num_perm}"
+        return [fp.minhash[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+
+def assign_group_splits(
+        groups: List[List[Hashable]],
+        split_ratios: Optional[Dict[str, float]] = None,
+        seed: int = 0,
+) -> Dict[Hashable, str]:
+    """
+    Assigns whole groups (e.g. MinHashLSH.clusters) to splits, so that near-duplicates never cross split boundaries.
+    The result can be saved with ComputerGeneratedDataset.write_filename_split.
+    :param groups: groups of keys
+    :param split_ratios: target fraction of keys per split
+    :return: mapping from key to split
+    """
+    if split_ratios is None:
+        split_ratios = {"train": 0.8, "val": 0.1, "test": 0.1}
+    assert all(s in VALID_SPLITS for s in split_ratios), f"Invalid splits: {list(split_ratios)}"
+
+    groups = list(groups)
+    random.Random(seed).shuffle(groups)
+    # assign large groups first so that small groups can even out the split sizes
+    groups.sort(key=len, reverse=True)
+
+    n_total = sum(len(g) for g in groups)
+    split_n = {s: 0 for s in split_ratios}
+    key_to_split = {}
+    for group in groups:
+        # split that is furthest below its target size
+        split = max(split_ratios, key=lambda s: split_ratios[s] * n_total - split_n[s])
+        split_n[split] += len(group)
+        for k in group:
+            key_to_split[k] = split
+
+    _logger.info("Assigned %d groups with %d keys to splits: %s", len(groups), n_total, split_n)
+    return key_to_split
+
+
+def _normalize_text(text: Optional[str]) -> str:
+    if text is None:
+        return ""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def _tokens(anns: List[Annotation]) -> Set[str]:
+    from yamlu.img import Annotation
+
+    def node_token(a: Annotation):
+        return f"{a.category}:{_normalize_text(a.get('name') if 'name' in a else None)}"
+
+    tokens = set()
+    for a in anns:
+        if a.category in syntax.BPMNDI_EDGE_CATEGORIES:
+            src = a.get(ARROW_PREV_REL) if ARROW_PREV_REL in a else None
+            dst = a.get(ARROW_NEXT_REL) if ARROW_NEXT_REL in a else None
+            if not isinstance(src, Annotation) or not isinstance(dst, Annotation):
+                continue
+            tokens.add(f"{node_token(src)}>{node_token(a)}>{node_token(dst)}")
+        elif a.category != syntax.LABEL:
+            # nodes are included so that diagrams without edges still have a meaningful signature
+            tokens.add(node_token(a))
+    return tokens
+
+
+def _layout_sketch(node_anns: List[Annotation], grid_size: int) -> int:
+    import numpy as np
+
+    if len(node_anns) == 0:
+        return 0
+    centers = np.array([a.bb.center for a in node_anns], dtype=np.float64)
+    lo, hi = centers.min(axis=0), centers.max(axis=0)
+    extent = np.maximum(hi - lo, 1e-6)
+    cells = np.minimum(((centers - lo) / extent * grid_size).astype(np.int64), grid_size - 1)
+    bits = np.unique(cells[:, 1] * grid_size + cells[:, 0])
+    return int(sum(1 << int(b) for b in bits))
+
+
+def _permutations(num_perm: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    import numpy as np
+
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+    b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+    return a, b
@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from pybpmn import syntax
+from pybpmn.constants import ARROW_NEXT_REL, ARROW_PREV_REL
+
+if TYPE_CHECKING:
+    import numpy as np
+    from yamlu.img import Annotation
+
+_logger = logging.getLogger(__name__)
+
+Categories = Optional[Union[str, Iterable[str]]]
+
+
+class CsrAdjacency(NamedTuple):
+    """
+    Compressed sparse row adjacency: the neighbors of node i are indices[indptr[i]:indptr[i + 1]]
+    and edge_ids holds the corresponding position of each edge in BpmnGraph.edge_anns[category].
+    """
+    indptr: np.ndarray
+    indices: np.ndarray
+    edge_ids: np.ndarray
+
+
+class BpmnGraph:
+    """
+    Integer-indexed graph view of the output of BpmnParser.parse_bpmn_anns.
+    Nodes are all annotations that are neither edges nor labels (i.e. shapes),
+    edges are stored as CSR adjacency arrays separated by edge category (see syntax.BPMNDI_EDGE_CATEGORIES).
+    """
+
+    def __init__(self, node_anns: List[Annotation], edge_anns: Dict[str, List[Annotation]]):
+        import numpy as np
+
+        self.nodes = node_anns
+        self.node_categories = np.array(
+            [syntax.CATEGORY_TO_CODE.get(a.category, -1) for a in node_anns], dtype=np.int16
+        )
+        self._node_idx = {id(a): i for i, a in enumerate(node_anns)}
+
+        self.edge_anns: Dict[str, List[Annotation]] = {}
+        self.edge_src: Dict[str, np.ndarray] = {}
+        self.edge_dst: Dict[str, np.ndarray] = {}
+        self._out: Dict[str, CsrAdjacency] = {}
+        self._in: Dict[str, CsrAdjacency] = {}
+        self._merged: Dict[Tuple[Tuple[str, ...], bool], CsrAdjacency] = {}
+
+        n_skipped = 0
+        for category in syntax.BPMNDI_EDGE_CATEGORIES:
+            kept, src, dst = [], [], []
+            for a in edge_anns.get(category, []):
+                s = self._node_idx.get(id(a.get(ARROW_PREV_REL)), -1) if ARROW_PREV_REL in a else -1
+                d = self._node_idx.get(id(a.get(ARROW_NEXT_REL)), -1) if ARROW_NEXT_REL in a else -1
+                if s == -1 or d == -1:
+                    # e.g. associations that point to another edge or unlinked (id string) relations
+                    n_skipped += 1
+                    continue
+                kept.append(a)
+                src.append(s)
+                dst.append(d)
+            self.edge_anns[category] = kept
+            self.edge_src[category] = np.array(src, dtype=np.int64)
+            self.edge_dst[category] = np.array(dst, dtype=np.int64)
+            self._out[category] = _to_csr(self.edge_src[category], self.edge_dst[category], self.n_nodes)
+            self._in[category] = _to_csr(self.edge_dst[category], self.edge_src[category], self.n_nodes)
+
+        if n_skipped > 0:
+            _logger.debug("BpmnGraph: skipped %d edges that do not connect two shapes", n_skipped)
+        self.n_skipped_edges = n_skipped
+
+    @classmethod
+    def from_anns(cls, anns: List[Annotation]) -> "BpmnGraph":
+        """
+        :param anns: annotations as returned by BpmnParser.parse_bpmn_anns (i.e. with linked arrow relations)
+        """
+        edge_categories = set(syntax.BPMNDI_EDGE_CATEGORIES)
+        node_anns = [a for a in anns if a.category not in edge_categories and a.category != syntax.LABEL]
+        edge_anns = {c: [] for c in syntax.BPMNDI_EDGE_CATEGORIES}
+        for a in anns:
+            if a.category in edge_categories:
+                edge_anns[a.category].append(a)
+        return cls(node_anns, edge_anns)
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.nodes)
+
+    def n_edges(self, categories: Categories = None) -> int:
+        return sum(len(self.edge_src[c]) for c in _to_categories(categories))
+
+    def node_index(self, ann: Annotation) -> int:
+        return self._node_idx[id(ann)]
+
+    def adjacency(self, category: str, reverse: bool = False) -> CsrAdjacency:
+        """
+        :param category: edge category
+        :param reverse: return the adjacency of incoming instead of outgoing edges
+        """
+        return self._in[category] if reverse else self._out[category]
+
+    def out_degree(self, categories: Categories = None) -> np.ndarray:
+        import numpy as np
+
+        return sum((np.diff(self._out[c].indptr) for c in _to_categories(categories)),
+                   np.zeros(self.n_nodes, dtype=np.int64))
+
+    def in_degree(self, categories: Categories = None) -> np.ndarray:
+        import numpy as np
+
+        return sum((np.diff(self._in[c].indptr) for c in _to_categories(categories)),
+                   np.zeros(self.n_nodes, dtype=np.int64))
+
+    def degree_stats(self, categories: Categories = None) -> Dict[str, float]:
+        """
+        :return: summary statistics of the node degrees, e.g. to check that a process has a single source and sink
+        """
+        in_deg, out_deg = self.in_degree(categories), self.out_degree(categories)
+        connected = (in_deg + out_deg) > 0
+        return {
+            "n_nodes": self.n_nodes,
+            "n_edges": self.n_edges(categories),
+            "max_in_degree": int(in_deg.max(initial=0)),
+            "max_out_degree": int(out_deg.max(initial=0)),
+            "mean_degree": float((in_deg + out_deg).mean()) if self.n_nodes > 0 else 0.0,
+            "n_isolated": int((~connected).sum()),
+            "n_sources": int(((in_deg == 0) & connected).sum()),
+            "n_sinks": int(((out_deg == 0) & connected).sum()),
+        }
+
+    def bfs(self, sources: Union[int, Sequence[int]], categories: Categories = syntax.SEQUENCE_FLOW,
+            directed: bool = True) -> np.ndarray:
+        """
+        Frontier-based breadth first search, where each frontier is expanded with array operations.
+        :param sources: start node index or indices
+        :param categories: edge categories to traverse (all edge categories if None)
+        :param directed: only follow edges from source to target
+        :return: hop distance for each node, -1 for unreachable nodes
+        """
+        import numpy as np
+
+        adj = self._merged_adjacency(categories, directed)
+        dist = np.full(self.n_nodes, -1, dtype=np.int64)
+        frontier = np.unique(np.atleast_1d(np.asarray(sources, dtype=np.int64)))
+        dist[frontier] = 0
+        level = 0
+        while len(frontier) > 0:
+            level += 1
+            neighbors = _gather_neighbors(adj, frontier)
+            neighbors = np.unique(neighbors[dist[neighbors] == -1])
+            dist[neighbors] = level
+            frontier = neighbors
+        return dist
+
+    def reachable(self, sources: Union[int, Sequence[int]], categories: Categories = syntax.SEQUENCE_FLOW,
+                  directed: bool = True) -> np.ndarray:
+        """
+        :return: boolean mask of nodes reachable from sources
+        """
+        return self.bfs(sources, categories, directed) >= 0
+
+    def connected_components(self, categories: Categories = None) -> Tuple[int, np.ndarray]:
+        """
+        Weakly connected components using min-label propagation with pointer jumping.
+        :return: number of components and the component label of each node
+        """
+        import numpy as np
+
+        src = np.concatenate([self.edge_src[c] for c in _to_categories(categories)])
+        dst = np.concatenate([self.edge_dst[c] for c in _to_categories(categories)])
+
+        labels = np.arange(self.n_nodes, dtype=np.int64)
+        while True:
+            prev = labels.copy()
+            np.minimum.at(labels, dst, labels[src])
+            np.minimum.at(labels, src, labels[dst])
+            labels = labels[labels]
+            if np.array_equal(labels, prev):
+                break
+
+        uniq, labels = np.unique(labels, return_inverse=True)
+        return len(uniq), labels
+
+    def _merged_adjacency(self, categories: Categories, directed: bool) -> CsrAdjacency:
+        import numpy as np
+
+        categories = _to_categories(categories)
+        key = (categories, directed)
+        if key not in self._merged:
+            src = np.concatenate([self.edge_src[c] for c in categories])
+            dst = np.concatenate([self.edge_dst[c] for c in categories])
+            if not directed:
+                src, dst = np.concatenate([src, dst]), np.concatenate([dst, src])
+            self._merged[key] = _to_csr(src, dst, self.n_nodes)
+        return self._merged[key]
+
+    def __repr__(self):
+        n_edges = {c: len(v) for c, v in self.edge_src.items()}
+        return f"BpmnGraph(n_nodes={self.n_nodes}, n_edges={n_edges})"
+
+
+def _to_categories(categories: Categories) -> Tuple[str, ...]:
+    if categories is None:
+        return tuple(syntax.BPMNDI_EDGE_CATEGORIES)
+    if isinstance(categories, str):
+        return (categories,)
+    categories = tuple(categories)
+    for c in categories:
+        assert c in syntax.BPMNDI_EDGE_CATEGORIES, f"{c} is not an edge category"
+    return categories
+
+
+def _to_csr(src: np.ndarray, dst: np.ndarray, n_nodes: int) -> CsrAdjacency:
+    import numpy as np
+
+    order = np.argsort(src, kind="stable")
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n_nodes), out=indptr[1:])
+    return CsrAdjacency(indptr, dst[order], order)
+
+
+def _gather_neighbors(adj: CsrAdjacency, nodes: np.ndarray) -> np.ndarray:
+    import numpy as np
+
+    starts = adj.indptr[nodes]
+    counts = adj.indptr[nodes + 1] - starts
+    total = counts.sum()
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    # position of each neighbor in adj.indices, i.e. the concatenation of all ranges [start, start + count)
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)
+    return adj.indices[offsets]
@@ -0,0 +1,287 @@
+from __future__ import annotations
+
+import logging
+from collections import defaultdict
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional, Set, Tuple, Union
+
+from lxml import etree
+# noinspection PyProtectedMember
+from lxml.etree import _Element as Element
+
+from pybpmn import syntax
+from pybpmn.constants import ARROW_RELATIONS, NS_MAP, NS_MODEL, TEXT_BELONGS_TO_REL
+from pybpmn.parser import (
+    _COLLABORATION_TAG,
+    _PROCESS_TAG,
+    BpmnParser,
+    InvalidBpmnException,
+    _check_no_choreography,
+    _create_id_to_obj_mapping,
+    _edge_to_anns,
+    _find_plane,
+    _lane_refs,
+    _parse_edge_attribs,
+    _PlaneGeometry,
+    _read_xml,
+    _shape_to_anns,
+    _source_name,
+    get_category,
+    get_ns,
+    get_tag_without_ns,
+)
+
+if TYPE_CHECKING:
+    from yamlu.img import Annotation
+
+_logger = logging.getLogger(__name__)
+
+
+class _Entry(NamedTuple):
+    # serialized DI element and shallow model element, see _signature
+    signature: Tuple
+    # None if the element is excluded
+    category: Optional[str]
+    # the annotation of the element followed by its label annotation (if any), empty if excluded
+    anns: List[Annotation]
+
+
+class ParseSession:
+    """
+    Parses successive versions of the same BPMN document, e.g. the autosaves of an annotation tool.
+    The first update parses the whole document, later updates diff the BPMNDI elements (and their model elements)
+    by id against the previous version: only annotations of new or changed elements are created,
+    annotations of unchanged elements are reused and only the arrow_prev/arrow_next/pool/lane/text_belongs_to
+    relations that point to rebuilt or removed elements are relinked.
+    The XML is still parsed and indexed as a whole, but that is cheap compared to creating the annotations.
+
+    The returned annotations equal the result of BpmnParser.parse_bpmn_anns on the same document.
+    Unchanged annotations are the same objects across updates, so callers must not modify them.
+    """
+
+    def __init__(self, parser: BpmnParser = None):
+        self.parser = BpmnParser() if parser is None else parser
+        self.annotations: List[Annotation] = []
+        # ids of the model elements that were added, changed or removed by the last update
+        self.changed_ids: Set[str] = set()
+        self.reset()
+
+    def reset(self):
+        """forgets the previous document, i.e. the next update parses the whole document"""
+        self._has_pools: Optional[bool] = None
+        self._entries: Dict[str, _Entry] = {}
+        # model id -> (non-label) annotation of all included elements
+        self._id_to_ann: Dict[str, Annotation] = {}
+        self._excluded_ids: Set[str] = set()
+        # edge id -> relation -> id of the referenced element, and the inverse: id -> ids of referencing edges
+        self._edge_refs: Dict[str, Dict[str, str]] = {}
+        self._referrers: Dict[str, Set[str]] = defaultdict(set)
+        # shape id -> id of the process that the shape belongs to (before linking the pool)
+        self._pool_refs: Dict[str, str] = {}
+        self._pool_ids: Set[str] = set()
+        # flow node id -> lane id
+        self._lane_of: Dict[str, str] = {}
+
+    def update(self, bpmn_path: Union[Path, bytes]) -> List[Annotation]:
+        """
+        :param bpmn_path: path to the new version of the BPMN XML file or its content
+        :return: the annotations of the first diagram of the file, see BpmnParser.parse_bpmn_anns
+        """
+        try:
+            return self._update(bpmn_path)
+        except Exception:
+            # the annotations might be partially relinked, so do not diff against them
+            self.reset()
+            self.annotations = []
+            raise
+
+    def _update(self, bpmn_path: Union[Path, bytes]) -> List[Annotation]:
+        parser = self.parser
+        root = _read_xml(bpmn_path)
+        source = _source_name(bpmn_path)
+        _check_no_choreography(root)
+
+        plane = _find_plane(root)
+        containers = root.findall("collaboration", NS_MAP) + root.findall("process", NS_MAP)
+        has_pools = any(c.tag == _COLLABORATION_TAG for c in containers)
+        if has_pools != self._has_pools:
+            # the pool fields of all shapes change
+            self.reset()
+            self._has_pools = has_pools
+
+        id_to_obj = {}
+        for container in containers:
+            id_to_obj.update(_create_id_to_obj_mapping(container))
+
+        order = []
+        changed = []
+        for element in plane.findall("bpmndi:BPMNShape", NS_MAP) + plane.findall("bpmndi:BPMNEdge", NS_MAP):
+            model_id = element.get("bpmnElement")
+            if model_id not in id_to_obj:
+                raise InvalidBpmnException("Missing model element", f"{source}: {model_id}")
+            model_element = id_to_obj[model_id]
+            if get_ns(model_element) != NS_MODEL:
+                _logger.warning("%s: skipping %s element with custom namespace", source, model_element.tag)
+                continue
+            order.append(model_id)
+            signature = _signature(element, model_element)
+            entry = self._entries.get(model_id, None)
+            if entry is None or entry.signature != signature:
+                changed.append((model_id, element, model_element, signature))
+
+        removed = self._entries.keys() - set(order)
+        self.changed_ids = removed | {model_id for model_id, *_ in changed}
+        pools_changed = False
+        for model_id in self.changed_ids:
+            pools_changed |= self._remove(model_id)
+
+        rebuilt = self._rebuild(changed)
+        pools_changed |= len(self._pool_ids & rebuilt) > 0
+        _logger.debug("%s: rebuilt %d elements, removed %d elements", source, len(rebuilt), len(removed))
+
+        self._relink_edges(rebuilt)
+        for model_id in rebuilt:
+            self._link_label(self._entries[model_id].anns)
+        if parser.link_pools:
+            self._relink_pools(self._pool_refs.keys() if pools_changed else rebuilt & self._pool_refs.keys())
+        if parser.link_lanes:
+            self._relink_lanes([c for c in containers if c.tag == _PROCESS_TAG], rebuilt)
+
+        anns = []
+        associations = []
+        for model_id in order:
+            entry = self._entries[model_id]
+            if entry.category == syntax.ASSOCIATION:
+                associations += entry.anns
+            else:
+                anns += entry.anns
+        self.annotations = anns + associations
+        return self.annotations
+
+    def _remove(self, model_id: str) -> bool:
+        """:return: True if the removed element was a pool"""
+        entry = self._entries.pop(model_id, None)
+        self._id_to_ann.pop(model_id, None)
+        self._excluded_ids.discard(model_id)
+        self._pool_ids.discard(model_id)
+        self._pool_refs.pop(model_id, None)
+        for target_id in self._edge_refs.pop(model_id, {}).values():
+            self._referrers[target_id].discard(model_id)
+        return entry is not None and entry.category == syntax.POOL
+
+    def _rebuild(self, changed: List[Tuple[str, Element, Element, Tuple]]) -> Set[str]:
+        """
+        Creates the annotations of the changed elements like BpmnParser._parse_plane
+        :return: ids of the elements that annotations were created for
+        """
+        parser = self.parser
+        shapes, edges, associations = [], [], []
+        for model_id, element, model_element, signature in changed:
+            category = None
+            if not parser._is_excluded_tag(get_tag_without_ns(model_element)):
+                category = get_category(element, model_element)
+            if category is None or not parser.is_included_category(category):
+                self._excluded_ids.add(model_id)
+                self._entries[model_id] = _Entry(signature, None, [])
+            elif category in syntax.BPMNDI_SHAPE_CATEGORIES:
+                shapes.append((model_id, element, model_element, signature, category))
+            elif category == syntax.ASSOCIATION:
+                associations.append((model_id, element, model_element, signature, category))
+            else:
+                edges.append((model_id, element, model_element, signature, category))
+
+        edges += associations
+        geometry = _PlaneGeometry(None, [s[1] for s in shapes], [e[1] for e in edges])
+        for i, (model_id, _, model_element, signature, category) in enumerate(shapes):
+            anns = _shape_to_anns(i, model_element, category, geometry, has_pools=self._has_pools,
+                                  has_label=parser._has_label(category))
+            self._add(model_id, _Entry(signature, category, anns))
+            if "pool" in anns[0]:
+                self._pool_refs[model_id] = anns[0].pool
+            if category == syntax.POOL:
+                self._pool_ids.add(model_id)
+
+        # associations are last, as they can reference other edges
+        for i, (model_id, _, model_element, signature, category) in enumerate(edges, start=len(shapes)):
+            anns = _edge_to_anns(i, model_element, category, geometry, self._id_to_ann, self._excluded_ids,
+                                 has_label=parser._has_label(category))
+            self._add(model_id, _Entry(signature, category, anns))
+            attrib = _parse_edge_attribs(model_element)
+            refs = {rel: attrib[rel] for rel in ARROW_RELATIONS if rel in attrib}
+            self._edge_refs[model_id] = refs
+            for target_id in refs.values():
+                self._referrers[target_id].add(model_id)
+
+        return {s[0] for s in shapes} | {e[0] for e in edges}
+
+    def _add(self, model_id: str, entry: _Entry):
+        self._entries[model_id] = entry
+        self._id_to_ann[model_id] = entry.anns[0]
+
+    def _relink_edges(self, rebuilt: Set[str]):
+        """relinks the unchanged edges that reference changed or removed elements"""
+        for target_id in self.changed_ids:
+            for edge_id in self._referrers.get(target_id, ()):
+                if edge_id in rebuilt:
+                    continue
+                edge_ann = self._id_to_ann[edge_id]
+                for rel, ref_id in self._edge_refs[edge_id].items():
+                    if ref_id != target_id:
+                        continue
+                    if ref_id in self._excluded_ids:
+                        if rel in edge_ann:
+                            delattr(edge_ann, rel)
+                        continue
+                    ann = self._id_to_ann.get(ref_id, None)
+                    if ann is None and edge_ann.category == syntax.ASSOCIATION:
+                        raise InvalidBpmnException("Association has another association as src or target", ref_id)
+                    edge_ann.set(rel, ann)
+
+    def _link_label(self, anns: List[Annotation]):
+        if len(anns) < 2:
+            return
+        symb_ann, lbl_ann = anns
+        lbl_ann.set(TEXT_BELONGS_TO_REL, symb_ann)
+        if self.parser.link_text_rel_two_way:
+            symb_ann.set(TEXT_BELONGS_TO_REL, lbl_ann)
+
+    def _relink_pools(self, shape_ids):
+        # collapsed pools do not have a "processRef" and can be omitted
+        pool_anns = (self._id_to_ann[pool_id] for pool_id in self._pool_ids)
+        process_id_to_ann = {a.processRef: a for a in pool_anns if "processRef" in a}
+        for shape_id in shape_ids:
+            self._id_to_ann[shape_id].pool = process_id_to_ann.get(self._pool_refs[shape_id], None)
+
+    def _relink_lanes(self, processes: List[Element], rebuilt: Set[str]):
+        # NOTE: like BpmnParser._link_lanes, this only considers top-level lanes
+        lane_of = dict(_lane_refs(processes, self._id_to_ann.keys(), self._excluded_ids))
+
+        for node_id, lane_id in lane_of.items():
+            if node_id in rebuilt or lane_id in rebuilt or self._lane_of.get(node_id, None) != lane_id:
+                self._id_to_ann[node_id].lane = self._id_to_ann[lane_id]
+        for node_id in self._lane_of.keys() - lane_of.keys():
+            node_ann = self._id_to_ann.get(node_id, None)
+            if node_ann is not None and node_id not in rebuilt and "lane" in node_ann:
+                del node_ann.lane
+        self._lane_of = lane_of
+
+    def __repr__(self):
+        return f"ParseSession({len(self._entries)} elements, {len(self.changed_ids)} changed in the last update)"
+
+
+def _signature(element: Element, model_element: Element) -> Tuple:
+    """
+    Everything the annotations of an element are created from: the DI element (bounds, waypoints, label bounds),
+    the attributes and direct children of the model element (e.g. event definitions, incoming/outgoing refs, text)
+    and its parents (the process that determines the pool of a shape, the task of a data association).
+    """
+    parent = model_element.getparent()
+    grandparent = parent.getparent()
+    return (
+        etree.tostring(element, with_tail=False),
+        parent.get("id"),
+        None if grandparent is None else grandparent.get("id"),
+        model_element.tag,
+        tuple(model_element.attrib.items()),
+        tuple((child.tag, tuple(child.attrib.items()), child.text) for child in model_element),
+    )
@@ -0,0 +1,319 @@
+import json
+import logging
+import random
+import sqlite3
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from joblib import Parallel, delayed
+from lxml import etree
+
+from pybpmn import syntax
+from pybpmn.parser import BpmnParser, InvalidBpmnException
+
+_logger = logging.getLogger(__name__)
+
+_SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    valid INTEGER NOT NULL,
+    n_anns INTEGER NOT NULL,
+    width REAL,
+    height REAL
+);
+CREATE TABLE IF NOT EXISTS category_counts (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    category TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (file_id, category)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS category_counts_category ON category_counts(category, count);
+CREATE TABLE IF NOT EXISTS errors (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    error_type TEXT NOT NULL,
+    details TEXT
+);
+CREATE INDEX IF NOT EXISTS errors_file_id ON errors(file_id);
+CREATE INDEX IF NOT EXISTS errors_error_type ON errors(error_type);
+CREATE TABLE IF NOT EXISTS labels (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    category TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS labels_file_id ON labels(file_id);
+-- external content FTS table over labels.text, kept in sync by the triggers
+CREATE VIRTUAL TABLE IF NOT EXISTS labels_fts USING fts5(text, content='labels', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS labels_insert AFTER INSERT ON labels BEGIN
+    INSERT INTO labels_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS labels_delete AFTER DELETE ON labels BEGIN
+    INSERT INTO labels_fts (labels_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+"""
+
+
+class _FileRecord(NamedTuple):
+    path: str
+    mtime_ns: int
+    size: int
+    n_anns: int
+    # extent of the diagram, None if the file is invalid
+    width: Optional[float]
+    height: Optional[float]
+    category_counts: Dict[str, int]
+    # (category of the element, name) of each element with a name
+    labels: List[Tuple[str, str]]
+    # (error_type, details) of each violation, empty if the file is valid
+    errors: List[Tuple[str, Optional[str]]]
+
+
+class CorpusIndex:
+    """
+    Local SQLite index of a BPMN corpus to select subsets without re-parsing the corpus, e.g.
+    index.query(categories={"timerBoundaryEvent": 1, "pool": 2}) or index.query(error_type="Missing model element").
+    Stores per file: metadata, the number of annotations per category, the names of all elements
+    (full-text searchable with FTS5) and the error types of invalid files (all violations, see BpmnParser.validate).
+
+    update only re-parses files whose size or modification time changed since they were indexed.
+    Query results are sorted paths, their stems can be written to the filename_split.csv of a
+    ComputerGeneratedDataset with ComputerGeneratedDataset.write_filename_split.
+    """
+
+    def __init__(self, db_path: Union[Path, str], **parser_kwargs):
+        """
+        :param db_path: SQLite database file, created if it does not exist
+        :param parser_kwargs: BpmnParser arguments, all files are re-indexed if they differ from the existing index
+        """
+        self.db_path = Path(db_path)
+        self.parser_kwargs = parser_kwargs
+        self.conn = sqlite3.connect(str(self.db_path))
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.executescript(_SCHEMA)
+        self._check_meta()
+
+    def _check_meta(self):
+        meta = dict(self.conn.execute("SELECT key, value FROM meta"))
+        settings = {"schema_version": str(_SCHEMA_VERSION), "parser_kwargs": _dump_kwargs(self.parser_kwargs)}
+        if len(meta) > 0 and meta != settings:
+            _logger.info("%s: index was created with different settings, clearing it", self.db_path)
+            with self.conn:
+                self.conn.execute("DELETE FROM files")
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", settings.items())
+
+    def update(self, bpmn_paths: Iterable[Union[Path, str]], n_jobs: int = 1, remove_missing: bool = True,
+               batch_size: int = 256) -> int:
+        """
+        Indexes new and changed files.
+        :param bpmn_paths: all files of the corpus, e.g. yamlu.glob(root, "**/*.bpmn")
+        :param n_jobs: number of parallel parsing processes
+        :param remove_missing: remove indexed files that are not in bpmn_paths (or do not exist anymore)
+        :param batch_size: number of files that are parsed per task and inserted per transaction
+        :return: number of (re-)indexed files
+        """
+        indexed = {path: (mtime_ns, size) for path, mtime_ns, size in
+                   self.conn.execute("SELECT path, mtime_ns, size FROM files")}
+
+        paths = sorted({str(Path(p).resolve()) for p in bpmn_paths})
+        todo = []
+        # e.g. deleted between globbing and updating
+        deleted = set()
+        for path in paths:
+            try:
+                stat = Path(path).stat()
+            except FileNotFoundError:
+                deleted.add(path)
+                continue
+            if indexed.get(path, None) != (stat.st_mtime_ns, stat.st_size):
+                todo.append(path)
+
+        with self.conn:
+            self._delete(deleted & indexed.keys())
+        if remove_missing:
+            missing = indexed.keys() - set(paths)
+            with self.conn:
+                self._delete(missing)
+            if len(missing) > 0:
+                _logger.info("%s: removed %d missing files", self.db_path, len(missing))
+
+        _logger.info("%s: indexing %d of %d files", self.db_path, len(todo), len(paths))
+        batches = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+        parallel = Parallel(n_jobs=n_jobs, return_as="generator")
+        n_indexed = 0
+        for batch, records in zip(batches, parallel(delayed(_index_files)(b, self.parser_kwargs) for b in batches)):
+            with self.conn:
+                # files that were deleted while they were waiting to be indexed
+                self._delete(path for path, r in zip(batch, records) if r is None)
+                self._insert([r for r in records if r is not None])
+            n_indexed += sum(r is not None for r in records)
+        return n_indexed
+
+    def _delete(self, paths: Iterable[str]):
+        # category counts, errors and labels are deleted by the foreign keys
+        self.conn.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in paths])
+
+    def _insert(self, records: List[_FileRecord]):
+        self._delete(r.path for r in records)
+        for r in records:
+            cursor = self.conn.execute(
+                "INSERT INTO files (path, mtime_ns, size, valid, n_anns, width, height) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (r.path, r.mtime_ns, r.size, len(r.errors) == 0, r.n_anns, r.width, r.height)
+            )
+            file_id = cursor.lastrowid
+            self.conn.executemany("INSERT INTO category_counts VALUES (?, ?, ?)",
+                                  [(file_id, c, n) for c, n in r.category_counts.items()])
+            self.conn.executemany("INSERT INTO labels (file_id, category, text) VALUES (?, ?, ?)",
+                                  [(file_id, c, text) for c, text in r.labels])
+            self.conn.executemany("INSERT INTO errors VALUES (?, ?, ?)",
+                                  [(file_id, error_type, details) for error_type, details in r.errors])
+
+    def query(self, categories: Dict[str, int] = None, error_type: str = None, text: str = None,
+              valid: Optional[bool] = None) -> List[Path]:
+        """
+        All conditions have to hold.
+        :param categories: category -> minimum number of annotations, e.g. {"timerBoundaryEvent": 1, "pool": 2}
+        :param error_type: files with at least one violation of this type, see InvalidBpmnException.error_type
+        :param text: FTS5 query over the element names, e.g. 'claim AND "not ok"'
+        :param valid: only files that can (True) or cannot (False) be parsed
+        :return: sorted paths of the matching files
+        """
+        conditions = []
+        params = []
+        for category, min_count in ({} if categories is None else categories).items():
+            conditions.append("id IN (SELECT file_id FROM category_counts WHERE category = ? AND count >= ?)")
+            params += [category, min_count]
+        if error_type is not None:
+            conditions.append("id IN (SELECT file_id FROM errors WHERE error_type = ?)")
+            params.append(error_type)
+        if text is not None:
+            conditions.append("id IN (SELECT l.file_id FROM labels_fts JOIN labels l ON l.id = labels_fts.rowid "
+                              "WHERE labels_fts MATCH ?)")
+            params.append(text)
+        if valid is not None:
+            conditions.append("valid = ?")
+            params.append(valid)
+
+        sql = "SELECT path FROM files"
+        if len(conditions) > 0:
+            sql += " WHERE " + " AND ".join(conditions)
+        return [Path(path) for path, in self.conn.execute(sql + " ORDER BY path", params)]
+
+    def stratified_sample(self, fraction: float, strata_categories: Sequence[str] = None, seed: int = 0,
+                          paths: Iterable[Union[Path, str]] = None) -> List[Path]:
+        """
+        Samples valid files such that each category mix is represented proportionally,
+        where the category mix of a file is the set of strata_categories that occur in it.
+        :param fraction: e.g. 0.05 for a 5% sample
+        :param strata_categories: categories that define the strata, default: the shape categories
+        :param paths: restrict the sample to these files, e.g. the result of query
+        :return: sorted paths of the sample
+        """
+        assert 0 <= fraction <= 1, f"fraction has to be in [0, 1]: {fraction}"
+        strata_categories = set(syntax.BPMNDI_SHAPE_CATEGORIES if strata_categories is None else strata_categories)
+        allowed = None if paths is None else {str(Path(p).resolve()) for p in paths}
+
+        path_to_stratum = {}
+        for path, category in self.conn.execute(
+                "SELECT f.path, c.category FROM files f LEFT JOIN category_counts c ON c.file_id = f.id "
+                "WHERE f.valid = 1"):
+            if allowed is not None and path not in allowed:
+                continue
+            stratum = path_to_stratum.setdefault(path, set())
+            if category in strata_categories:
+                stratum.add(category)
+
+        stratum_to_paths = defaultdict(list)
+        for path, stratum in sorted(path_to_stratum.items()):
+            stratum_to_paths[tuple(sorted(stratum))].append(path)
+        strata = sorted(stratum_to_paths)
+
+        # largest remainder rounding, such that the sample size is round(fraction * n)
+        exact = [fraction * len(stratum_to_paths[s]) for s in strata]
+        sizes = [int(e) for e in exact]
+        n_remaining = round(fraction * len(path_to_stratum)) - sum(sizes)
+        for i in sorted(range(len(strata)), key=lambda i: sizes[i] - exact[i])[:n_remaining]:
+            sizes[i] += 1
+
+        rand = random.Random(seed)
+        sample = []
+        for stratum, size in zip(strata, sizes):
+            sample += rand.sample(stratum_to_paths[stratum], size)
+        return sorted(Path(p) for p in sample)
+
+    def error_counts(self) -> Dict[str, int]:
+        """:return: number of files per error type"""
+        return dict(self.conn.execute(
+            "SELECT error_type, COUNT(DISTINCT file_id) FROM errors GROUP BY error_type ORDER BY error_type"))
+
+    def category_counts(self, path: Union[Path, str]) -> Dict[str, int]:
+        return dict(self.conn.execute(
+            "SELECT c.category, c.count FROM category_counts c JOIN files f ON c.file_id = f.id WHERE f.path = ?",
+            (str(Path(path).resolve()),)))
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return f"CorpusIndex({self.db_path}, {len(self)} files)"
+
+
+def _index_files(paths: List[str], parser_kwargs: Dict) -> List[Optional[_FileRecord]]:
+    parser = BpmnParser(**parser_kwargs)
+    return [_index_file(parser, path) for path in paths]
+
+
+def _index_file(parser: BpmnParser, path: str) -> Optional[_FileRecord]:
+    """:return: None if the file does not exist (anymore)"""
+    try:
+        stat = Path(path).stat()
+        anns = parser.parse_bpmn_anns(Path(path))
+    except InvalidBpmnException as e:
+        errors = [(e.error_type, e.details)]
+        # validate does not stop at the first violation
+        try:
+            errors += [(v.error_type, v.details) for v in parser.validate(Path(path))
+                       if (v.error_type, v.details) not in errors]
+        except Exception as validate_error:
+            _logger.warning("%s: validate failed: %s", path, validate_error)
+        return _FileRecord(path, stat.st_mtime_ns, stat.st_size, 0, None, None, {}, [], errors)
+    except etree.XMLSyntaxError as e:
+        return _FileRecord(path, stat.st_mtime_ns, stat.st_size, 0, None, None, {}, [], [("XML syntax error", str(e))])
+    except Exception as e:
+        if not Path(path).exists():
+            # lxml raises an OSError for missing files
+            return None
+        # e.g. an AssertionError for an unknown category, a single malformed file must not abort the update
+        _logger.warning("%s: unexpected %s: %s", path, type(e).__name__, e)
+        return _FileRecord(path, stat.st_mtime_ns, stat.st_size, 0, None, None, {}, [], [(type(e).__name__, str(e))])
+
+    category_counts = Counter(a.category for a in anns)
+    # labels have the name of their element, which is indexed with the category of the element
+    labels = [(a.category, a.name) for a in anns if a.category != syntax.LABEL and "name" in a and a.name]
+    width = max((a.bb.r for a in anns), default=0.0)
+    height = max((a.bb.b for a in anns), default=0.0)
+    return _FileRecord(path, stat.st_mtime_ns, stat.st_size, len(anns), width, height, dict(category_counts), labels,
+                       [])
+
+
+def _dump_kwargs(kwargs: Dict) -> str:
+    # sets (e.g. excluded_categories) are not JSON serializable
+    return json.dumps(kwargs, sort_keys=True,
+                      default=lambda v: sorted(v) if isinstance(v, (set, frozenset)) else repr(v))
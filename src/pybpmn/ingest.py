@@ -0,0 +1,108 @@
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+from lxml import etree
+from yamlu.img import Annotation
+
+from pybpmn.metrics import Metrics
+from pybpmn.parser import BpmnParser, InvalidBpmnException
+
+_logger = logging.getLogger(__name__)
+
+_thread_state = threading.local()
+
+
+class IngestResult(NamedTuple):
+    path: Path
+    # None if the file could not be parsed
+    anns: Optional[List[Annotation]]
+    error: Optional[Exception]
+
+
+def thread_xml_parser() -> etree.XMLParser:
+    """
+    :return: the XMLParser of the current thread, lxml parsers must not be used by multiple threads at the same time
+    """
+    xml_parser = getattr(_thread_state, "xml_parser", None)
+    if xml_parser is None:
+        # the parser does not look up elements by xml:id, so the id table of libxml2 is not needed
+        xml_parser = etree.XMLParser(collect_ids=False)
+        _thread_state.xml_parser = xml_parser
+    return xml_parser
+
+
+def ingest(
+        bpmn_paths: Iterable[Path],
+        parser: Optional[BpmnParser] = None,
+        n_threads: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        ordered: bool = True,
+        metrics: Optional[Metrics] = None,
+) -> Iterator[IngestResult]:
+    """
+    Parses the annotations of many bpmn files with a thread pool in the current process.
+    File reads, XML parsing and XPath evaluation run in libxml2, which releases the GIL, so threads scale without the
+    pickling and memory duplication of a process pool (and without the GIL on free-threaded builds).
+    All threads share the parser, which is only read, and the module-level category tables of pybpmn.parser.
+    lxml parsers and XPath objects serialize concurrent calls, so each thread has its own XMLParser
+    (see thread_xml_parser) and XPath evaluators (see pybpmn.parser._plane_xpaths).
+    :param parser: configured BpmnParser, defaults to BpmnParser()
+    :param n_threads: defaults to the number of CPUs
+    :param max_pending: maximum number of files that are parsed ahead of the consumer, defaults to 4 * n_threads
+    :param ordered: False to yield the results as soon as they are done
+    :param metrics: if given, the parse metrics of all threads are recorded into it
+    :return: a result for each file, errors (e.g. InvalidBpmnExceptions) are returned instead of raised
+    """
+    parser = BpmnParser() if parser is None else parser
+    n_threads = os.cpu_count() if n_threads is None else n_threads
+    max_pending = 4 * n_threads if max_pending is None else max_pending
+    paths = iter(bpmn_paths)
+
+    with ThreadPoolExecutor(n_threads, thread_name_prefix="pybpmn-ingest") as pool:
+        pending = deque(pool.submit(_parse, parser, p, metrics) for p in islice(paths, max_pending))
+        try:
+            while len(pending) > 0:
+                if ordered:
+                    future = pending.popleft()
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    future = next(f for f in pending if f in done)
+                    pending.remove(future)
+                next_path = next(paths, None)
+                if next_path is not None:
+                    pending.append(pool.submit(_parse, parser, next_path, metrics))
+                yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _parse(parser: BpmnParser, bpmn_path: Path, metrics: Optional[Metrics]) -> IngestResult:
+    xml_parser = thread_xml_parser()
+    try:
+        if metrics is None:
+            anns = parser.parse_bpmn_anns(bpmn_path, xml_parser)
+        else:
+            with metrics.activate(), metrics.timer("parse_ms"):
+                anns = parser.parse_bpmn_anns(bpmn_path, xml_parser)
+    except (InvalidBpmnException, etree.XMLSyntaxError) as e:
+        _logger.debug("%s: %s", bpmn_path, e)
+        if metrics is not None:
+            error_type = e.error_type if isinstance(e, InvalidBpmnException) else "XML syntax error"
+            metrics.inc("invalid_bpmn_total", error_type=error_type)
+        return IngestResult(bpmn_path, None, e)
+    except Exception as e:
+        # e.g. an AssertionError for an unknown category, a single file must not end the ingestion
+        _logger.warning("%s: unexpected %s: %s", bpmn_path, type(e).__name__, e)
+        if metrics is not None:
+            metrics.inc("invalid_bpmn_total", error_type=type(e).__name__)
+        return IngestResult(bpmn_path, None, e)
+    if metrics is not None:
+        metrics.inc("files_total")
+    return IngestResult(bpmn_path, anns, None)
@@ -0,0 +1,292 @@
+import bisect
+import json
+import logging
+import math
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+_logger = logging.getLogger(__name__)
+
+# upper bounds of the histogram buckets in ms
+DEFAULT_MS_BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+# metric name and sorted (label, value) pairs
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+_active: ContextVar[Optional["Metrics"]] = ContextVar("pybpmn_metrics", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        # counts[i] is the number of values <= buckets[i] (and > buckets[i - 1]), the last count is for +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """:return: upper bound of the bucket that contains the q-quantile, None if there are no values"""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms of a parsing or export run, e.g. files, bytes read/written,
+    InvalidBpmnExceptions by error_type and stage latencies in ms.
+    Code in this package records into the metrics that are activated in the current context (see activate),
+    without an active Metrics object recording is a no-op.
+    Values can be sent to pluggable sinks with flush, e.g. a PrometheusTextfileSink or JsonLinesSink.
+
+    Pickled Metrics (e.g. as part of a joblib task) do not carry their values or sinks: worker processes record
+    into their own Metrics and send a snapshot back that is merged in the main process.
+    """
+
+    def __init__(self, sinks: List["MetricsSink"] = None, buckets: Sequence[float] = DEFAULT_MS_BUCKETS,
+                 prefix: str = "pybpmn_"):
+        """
+        :param buckets: upper bounds of the histogram buckets
+        :param prefix: prefix of the metric names when written to a sink
+        """
+        self.sinks = [] if sinks is None else sinks
+        self.buckets = tuple(buckets)
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.counters: Dict[_Key, float] = {}
+        self.gauges: Dict[_Key, float] = {}
+        self.histograms: Dict[_Key, Histogram] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self.gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key, None)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """observes the wall time of the block in ms, also if it raises an exception"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000, **labels)
+
+    @contextmanager
+    def activate(self) -> Iterator["Metrics"]:
+        """records the metrics of the pybpmn code that is called in the block (in the current thread) into self"""
+        token = _active.set(self)
+        try:
+            yield self
+        finally:
+            _active.reset(token)
+
+    def snapshot(self) -> Dict:
+        """:return: picklable copy of the values that can be merged into other Metrics"""
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "histograms": {k: (h.counts.copy(), h.sum, h.count) for k, h in self.histograms.items()},
+            }
+
+    def merge(self, snapshot: Dict):
+        """adds the counters and histograms of a snapshot (with the same buckets), gauges are overwritten"""
+        with self._lock:
+            for key, value in snapshot["counters"].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            self.gauges.update(snapshot["gauges"])
+            for key, (counts, total, count) in snapshot["histograms"].items():
+                histogram = self.histograms.get(key, None)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(self.buckets)
+                assert len(counts) == len(histogram.counts), f"{key}: snapshot has different buckets"
+                histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                histogram.sum += total
+                histogram.count += count
+
+    def flush(self):
+        """writes the current values to all sinks"""
+        for sink in self.sinks:
+            sink.write(self)
+
+    def to_dict(self) -> Dict:
+        """
+        :return: JSON serializable values with prometheus-style keys, e.g. pybpmn_invalid_bpmn_total{error_type=..}
+        """
+        histograms = {}
+        for key, h in sorted(self.histograms.items()):
+            histograms[self._format_key(key)] = {
+                "count": h.count,
+                "sum": h.sum,
+                "p50": h.quantile(0.5),
+                "p95": h.quantile(0.95),
+                "buckets": dict(zip([str(b) for b in h.buckets] + ["+Inf"], h.counts)),
+            }
+        return {
+            "counters": {self._format_key(k): v for k, v in sorted(self.counters.items())},
+            "gauges": {self._format_key(k): v for k, v in sorted(self.gauges.items())},
+            "histograms": histograms,
+        }
+
+    def to_prometheus_text(self) -> str:
+        """
+        :return: the values in the prometheus text exposition format, e.g. for the node exporter textfile collector
+        """
+        lines = []
+        for metric_type, values in [("counter", self.counters), ("gauge", self.gauges)]:
+            for name, keys in _group_by_name(values):
+                lines.append(f"# TYPE {self.prefix}{name} {metric_type}")
+                lines += [f"{self._format_key(k)} {_format_value(values[k])}" for k in keys]
+
+        for name, keys in _group_by_name(self.histograms):
+            lines.append(f"# TYPE {self.prefix}{name} histogram")
+            for _, labels in keys:
+                h = self.histograms[(name, labels)]
+                cumulative = 0
+                for bound, count in zip([_format_value(b) for b in h.buckets] + ["+Inf"], h.counts):
+                    cumulative += count
+                    lines.append(f"{self.prefix}{name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{self.prefix}{name}_sum{_format_labels(labels)} {_format_value(h.sum)}")
+                lines.append(f"{self.prefix}{name}_count{_format_labels(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def _format_key(self, key: _Key) -> str:
+        name, labels = key
+        return f"{self.prefix}{name}{_format_labels(labels)}"
+
+    def __getstate__(self):
+        return {"buckets": self.buckets, "prefix": self.prefix}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __repr__(self):
+        return (f"Metrics({len(self.counters)} counters, {len(self.gauges)} gauges, "
+                f"{len(self.histograms)} histograms, sinks={self.sinks})")
+
+
+class MetricsSink(ABC):
+    @abstractmethod
+    def write(self, metrics: Metrics):
+        pass
+
+
+class PrometheusTextfileSink(MetricsSink):
+    """
+    Overwrites a *.prom file with the current values, e.g. for the textfile collector of the prometheus node exporter.
+    The file is replaced atomically, so that the collector never reads a partially written file.
+    """
+
+    def __init__(self, path: Union[Path, str]):
+        self.path = Path(path)
+
+    def write(self, metrics: Metrics):
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(metrics.to_prometheus_text())
+        os.replace(tmp_path, self.path)
+
+    def __repr__(self):
+        return f"PrometheusTextfileSink({self.path})"
+
+
+class JsonLinesSink(MetricsSink):
+    """Appends the current values as one JSON object (with a unix timestamp) per flush"""
+
+    def __init__(self, path: Union[Path, str]):
+        self.path = Path(path)
+
+    def write(self, metrics: Metrics):
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        with self.path.open("a") as f:
+            f.write(json.dumps({"time": time.time(), **metrics.to_dict()}) + "\n")
+
+    def __repr__(self):
+        return f"JsonLinesSink({self.path})"
+
+
+def create_sink(path: Union[Path, str]) -> MetricsSink:
+    """:return: a PrometheusTextfileSink for *.prom files, a JsonLinesSink otherwise"""
+    path = Path(path)
+    return PrometheusTextfileSink(path) if path.suffix == ".prom" else JsonLinesSink(path)
+
+
+def active_metrics() -> Optional[Metrics]:
+    return _active.get()
+
+
+def inc(name: str, value: float = 1, **labels):
+    """increments a counter of the active metrics, if any"""
+    metrics = _active.get()
+    if metrics is not None:
+        metrics.inc(name, value, **labels)
+
+
+@contextmanager
+def timer(name: str, **labels) -> Iterator[None]:
+    """observes the wall time of the block in ms in the active metrics, if any"""
+    metrics = _active.get()
+    if metrics is None:
+        yield
+        return
+    with metrics.timer(name, **labels):
+        yield
+
+
+def _key(name: str, labels: Dict[str, object]) -> _Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _group_by_name(values: Dict[_Key, object]) -> List[Tuple[str, List[_Key]]]:
+    name_to_keys = {}
+    for key in sorted(values):
+        name_to_keys.setdefault(key[0], []).append(key)
+    return list(name_to_keys.items())
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if len(labels) == 0:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return str(int(value)) if value.is_integer() else repr(value)
@@ -1,23 +1,55 @@
+from __future__ import annotations
+
+import io
 import logging
+import math
+import threading
 from pathlib import Path
-from typing import Dict, List, Optional, Set
+from typing import TYPE_CHECKING, Collection, Dict, Iterator, List, Optional, Set, Tuple, Union
 
-import numpy as np
-import yamlu
-from PIL import Image
 from lxml import etree
 # noinspection PyProtectedMember
 from lxml.etree import _Element as Element
-from yamlu.img import AnnotatedImage, Annotation, BoundingBox
 
-from pybpmn import syntax
+from pybpmn import metrics, syntax
 from pybpmn.constants import *
-from pybpmn.util import bounds_to_bb, to_int_or_float, parse_annotation_background_width, capitalize_fc
+from pybpmn.util import bounds_to_xywh, parse_annotation_background_width, capitalize_fc, waypoints_to_xy
+
+if TYPE_CHECKING:
+    import numpy as np
+    from PIL import Image
+    from yamlu.img import AnnotatedImage, Annotation, BoundingBox
+
+# numpy, PIL and yamlu (which imports matplotlib) are only imported on the code paths that need them,
+# e.g. BpmnParser.validate does not import any of them
 
 _logger = logging.getLogger(__name__)
 
 BPMN_ATTRIB_TO_RELATION = {"sourceRef": ARROW_PREV_REL, "targetRef": ARROW_NEXT_REL}
 
+_CATEGORY_MAPPINGS = {
+    # events
+    "intermediateThrowEvent": syntax.INTERMEDIATE_EVENT,
+    "timerIntermediateCatchEvent": syntax.TIMER_INTERMEDIATE_EVENT,
+    # collaboration
+    "participant": syntax.POOL,
+    # data association
+    "dataInputAssociation": syntax.DATA_ASSOCIATION,
+    "dataOutputAssociation": syntax.DATA_ASSOCIATION,
+    # data elements (remove 'Reference' suffix)
+    "dataObjectReference": syntax.DATA_OBJECT,
+    "dataStoreReference": syntax.DATA_STORE,
+}
+_ALL_CATEGORIES = set(syntax.ALL_CATEGORIES)
+# qualified tags of the event definition child elements, e.g. {NS_MODEL}timerEventDefinition
+_EVENT_DEFINITION_TAGS = [(t, f"{{{NS_MODEL}}}{t}EventDefinition") for t in syntax.EVENT_DEFINITIONS]
+
+_EXIF_ORIENTATION = 0x0112
+_COLLABORATION_TAG = f"{{{NS_MODEL}}}collaboration"
+_PROCESS_TAG = f"{{{NS_MODEL}}}process"
+_CONTAINER_TAGS = {_COLLABORATION_TAG, _PROCESS_TAG}
+_BPMN_SHAPE_TAG = f"{{{NS_MAP['bpmndi']}}}BPMNShape"
+
 
 def parse_bpmn_anns(bpmn_path: Path):
     return BpmnParser().parse_bpmn_anns(bpmn_path)
@@ -33,6 +65,10 @@ class InvalidBpmnException(Exception):
         self.error_type = error_type
         self.details = details
 
+    def __reduce__(self):
+        # keep error_type and details when the exception is sent from a worker process
+        return self.__class__, (self.error_type, self.details)
+
 
 class BpmnParser:
     def __init__(
@@ -41,94 +77,178 @@ class BpmnParser:
             img_max_size_ref: int = 1000,
             excluded_categories: Set[str] = None,
             excluded_label_categories: Set[str] = None,
+            included_categories: Set[str] = None,
             link_text_rel_two_way: bool = False,
             link_pools: bool = True,
             link_lanes: bool = True,
-            scale_to_ann_width: bool = True
+            scale_to_ann_width: bool = True,
+            target_max_size: Optional[int] = None,
     ):
         """
         :param arrow_min_wh: pad edge bounding boxes so that their w and h is at least arrow_min_wh
                              when the image is scaled to img_max_size_ref
         :param img_max_size_ref: reference image size to consider for arrow_min_wh
+        :param excluded_categories: categories for which no annotations should be parsed
         :param excluded_label_categories: categories for which label annotations should not be parsed
+        :param included_categories: if given, only annotations of these categories are parsed
+                                    (syntax.LABEL has to be included for label annotations)
+        :param target_max_size: if given, parse_bpmn_img downscales images such that their larger side is at most
+                                target_max_size. JPEGs are directly decoded at a reduced resolution (PIL draft mode).
+                                Annotations are scaled accordingly.
         """
         self.arrow_min_wh = arrow_min_wh
         self.img_max_size_ref = img_max_size_ref
         self.excluded_categories = {} if excluded_categories is None else excluded_categories
         self.excluded_label_categories = {} if excluded_label_categories is None else excluded_label_categories
+        self.included_categories = included_categories
         self.link_text_rel_two_way = link_text_rel_two_way
         self.link_pools = link_pools
         self.link_lanes = link_lanes
         self.scale_to_ann_width = scale_to_ann_width
+        self.target_max_size = target_max_size
 
-    def _is_included_ann(self, a: Annotation) -> bool:
-        if a.category in self.excluded_categories:
+    def is_included_category(self, category: str) -> bool:
+        if category in self.excluded_categories:
             return False
-        if a.category == "label" and a.get(TEXT_BELONGS_TO_REL).category in self.excluded_label_categories:
+        return self.included_categories is None or category in self.included_categories
+
+    def _is_excluded_tag(self, tag: str) -> bool:
+        """
+        :return: True if the model element tag only maps to excluded categories, i.e. before resolving the category
+        """
+        if tag.endswith("Event") or tag == "subProcess":
+            # category depends on the event definitions or the DI element
             return False
-        return True
+        return not self.is_included_category(_CATEGORY_MAPPINGS.get(tag, tag))
+
+    def _has_label(self, category: str) -> bool:
+        return category not in self.excluded_label_categories and self.is_included_category(syntax.LABEL)
 
     # noinspection PyPropertyAccess
-    def parse_bpmn_img(self, bpmn_path: Path, img_path: Path) -> AnnotatedImage:
+    def parse_bpmn_img(self, bpmn_path: Union[Path, bytes], img_path: Union[Path, bytes],
+                       filename: Optional[str] = None) -> AnnotatedImage:
         """
-        :param bpmn_path: path to the BPMN XML file
-        :param img_path: path to the corresponding BPMN image
+        :param bpmn_path: path to the BPMN XML file or its content
+        :param img_path: path to the corresponding BPMN image or its encoded content
+        :param filename: filename of the AnnotatedImage, required if img_path is bytes
         """
+        from yamlu.img import AnnotatedImage
 
+        if metrics.active_metrics() is not None:
+            metrics.inc("bytes_read_total", _n_bytes(bpmn_path) + _n_bytes(img_path))
         try:
-            anns = self.parse_bpmn_anns(bpmn_path)
+            with metrics.timer("parse_ms"):
+                anns = self.parse_bpmn_anns(bpmn_path)
         except Exception as e:
-            _logger.error("Error while parsing: %s", bpmn_path)
+            _logger.error("Error while parsing: %s", _source_name(bpmn_path))
+            if isinstance(e, InvalidBpmnException):
+                metrics.inc("invalid_bpmn_total", error_type=e.error_type)
             raise e
 
-        img = yamlu.read_img(img_path)
+        with metrics.timer("decode_ms"):
+            img, img_scale = self._read_img(img_path)
 
         arrow_min_wh = self.arrow_min_wh
         if self.scale_to_ann_width:
+            # the annotation width refers to the image, therefore this already takes a reduced resolution into account
             self.scale_anns_to_img_width_(anns, bpmn_path, img)
             arrow_min_wh = self.arrow_min_wh * max(img.size) / self.img_max_size_ref
+        elif img_scale != 1.0:
+            _scale_anns_(anns, img_scale)
+            arrow_min_wh = self.arrow_min_wh * img_scale
 
         edge_anns = [a for a in anns if a.category in syntax.BPMNDI_EDGE_CATEGORIES]
         self.resize_arrows_to_min_wh(edge_anns, arrow_min_wh)
 
-        anns = [a for a in anns if self._is_included_ann(a)]
-
+        if filename is None:
+            assert not isinstance(img_path, bytes), "filename is required for images passed as bytes"
+            filename = img_path.name
         return AnnotatedImage(
-            img_path.name,
+            filename,
             width=img.width,
             height=img.height,
             annotations=anns,
             img=img,
         )
 
-    def parse_bpmn_anns(self, bpmn_path: Path) -> List[Annotation]:
-        document = etree.parse(str(bpmn_path))
-        root = document.getroot()
+    def _read_img(self, img_path: Union[Path, bytes]) -> Tuple[Image.Image, float]:
+        """
+        :return: the image, downscaled to target_max_size if set, and its scale w.r.t. the full resolution image
+        """
+        import yamlu
+        from PIL import Image, ImageOps
+
+        if isinstance(img_path, bytes):
+            img_path = io.BytesIO(img_path)
+
+        if self.target_max_size is None:
+            return yamlu.read_img(img_path), 1.0
+
+        img = Image.open(img_path)
+        full_max_size = max(img.size)
+        if full_max_size > self.target_max_size:
+            # JPEG only: decode with a power of 2 DCT scaling such that the image is not smaller than requested
+            s = self.target_max_size / full_max_size
+            img.draft(img.mode, (math.ceil(img.width * s), math.ceil(img.height * s)))
+        if img.getexif().get(_EXIF_ORIENTATION, 1) != 1:
+            # exif_transpose copies the image even if it does not need to be transposed
+            img = ImageOps.exif_transpose(img)
+
+        if max(img.size) > self.target_max_size:
+            s = self.target_max_size / max(img.size)
+            img = img.resize((round(img.width * s), round(img.height * s)), Image.BILINEAR)
+        return img, max(img.size) / full_max_size
+
+    def parse_bpmn_anns(self, bpmn_path: Union[Path, bytes],
+                        xml_parser: Optional[etree.XMLParser] = None) -> List[Annotation]:
+        """
+        Parses the first diagram of the file, see iter_diagrams for files with multiple diagrams.
+        Annotations of excluded categories (and labels of excluded label categories) are not created at all,
+        relations of the created annotations to excluded annotations are not set.
+        Excluded elements are skipped before their geometry is extracted, the geometry of the remaining elements is
+        then read element by element instead of in bulk.
+        Edges have waypoints as (n, 2) float64 array (also for integer coordinates, which were int64 before).
+        :param bpmn_path: path to the BPMN XML file or its content
+        :param xml_parser: lxml parser to use instead of the default parser, e.g. one per thread (see pybpmn.ingest)
+        """
+        root = _read_xml(bpmn_path, xml_parser)
+        _check_no_choreography(root)
 
-        id_to_obj = {}
+        plane = _find_plane(root)
+        containers = root.findall("collaboration", NS_MAP) + root.findall("process", NS_MAP)
+        return self._parse_plane(plane, containers, _source_name(bpmn_path))
 
-        choreographies = root.findall("choreography", NS_MAP)
-        if len(choreographies) > 0:
-            # slight abuse of the exception class as this is not per se invalid BPMN
-            raise InvalidBpmnException("BPMN Choreography diagrams are not implemented.")
+    def iter_diagrams(self, bpmn_path: Union[Path, bytes]) -> Iterator["BpmnDiagram"]:
+        """
+        Enumerates the diagrams of a BPMN file, e.g. of exports that bundle many diagrams in one file.
+        The diagrams are only parsed on demand with BpmnDiagram.parse_anns,
+        which only maps the collaboration/processes that are referenced by the diagram plane.
+        :param bpmn_path: path to the BPMN XML file or its content
+        """
+        root = _read_xml(bpmn_path)
+        _check_no_choreography(root)
 
-        collaborations = root.findall("collaboration", NS_MAP)
-        for collaboration in collaborations:
-            id_to_obj.update(_create_id_to_obj_mapping(collaboration))
+        # only top-level elements, nested elements are mapped lazily when a diagram is parsed
+        id_to_container = {el.get("id"): el for el in root if el.tag in _CONTAINER_TAGS}
+        for diagram in root.iterfind("bpmndi:BPMNDiagram", NS_MAP):
+            yield BpmnDiagram(self, diagram, id_to_container, _source_name(bpmn_path))
 
-        for process in root.findall("process", NS_MAP):
-            id_to_obj.update(_create_id_to_obj_mapping(process))
+    def _parse_plane(self, plane: Element, containers: List[Element], bpmn_path) -> List[Annotation]:
+        """
+        :param containers: top-level collaboration and process elements that contain the model elements of the plane
+        """
+        collaborations = [c for c in containers if c.tag == _COLLABORATION_TAG]
+        id_to_obj = {}
+        for container in containers:
+            id_to_obj.update(_create_id_to_obj_mapping(container))
 
-        diagram = root.find("bpmndi:BPMNDiagram", NS_MAP)
-        plane = diagram[0]
         shapes = plane.findall("bpmndi:BPMNShape", NS_MAP)
         edges = plane.findall("bpmndi:BPMNEdge", NS_MAP)
-        elements = shapes + edges
 
-        associations = []
-        anns = []
-        id_to_ann = {}
-        for element in elements:
+        # excluded elements are skipped before their geometry is extracted
+        excluded_ids = set()
+        kept_shapes, kept_edges = [], []
+        for element in shapes + edges:
             model_id = element.get("bpmnElement")
             if model_id not in id_to_obj:
                 raise InvalidBpmnException("Missing model element", f"{bpmn_path}: {model_id}")
@@ -136,33 +256,117 @@ class BpmnParser:
             if get_ns(model_element) != NS_MODEL:
                 _logger.warning("%s: skipping %s element with custom namespace", bpmn_path, model_element.tag)
                 continue
+            if self._is_excluded_tag(get_tag_without_ns(model_element)):
+                excluded_ids.add(model_id)
+                continue
             category = get_category(element, model_element)
+            if not self.is_included_category(category):
+                excluded_ids.add(model_id)
+                continue
+            kept = kept_shapes if element.tag == _BPMN_SHAPE_TAG else kept_edges
+            kept.append((element, model_element, category))
+
+        # the plane can only be read in bulk if it contains exactly the kept elements
+        all_kept = len(kept_shapes) == len(shapes) and len(kept_edges) == len(edges)
+        geometry = _PlaneGeometry(plane if all_kept else None, [e for e, _, _ in kept_shapes],
+                                  [e for e, _, _ in kept_edges])
 
+        associations = []
+        anns = []
+        id_to_ann = {}
+        for i, (_, model_element, category) in enumerate(kept_shapes + kept_edges):
             # only edge type that can have another edge as src or target
             # therefore has to be separated and moved to the end
             if category == syntax.ASSOCIATION:
-                associations.append(element)
+                associations.append((i, model_element))
                 continue
             if category in syntax.BPMNDI_SHAPE_CATEGORIES:
-                element_anns = _shape_to_anns(element, model_element, has_pools=len(collaborations) > 0)
+                element_anns = _shape_to_anns(i, model_element, category, geometry, has_pools=len(collaborations) > 0,
+                                              has_label=self._has_label(category))
             else:
-                element_anns = _edge_to_anns(element, model_element, id_to_ann)
+                element_anns = _edge_to_anns(i, model_element, category, geometry, id_to_ann, excluded_ids,
+                                             has_label=self._has_label(category))
             anns += element_anns
             for ann in element_anns:
                 if ann.category != syntax.LABEL:
                     id_to_ann[ann.id] = ann
 
-        for association in associations:
-            model_element = id_to_obj[association.get("bpmnElement")]
-            anns += _edge_to_anns(association, model_element, id_to_ann)
+        for i, model_element in associations:
+            anns += _edge_to_anns(i, model_element, syntax.ASSOCIATION, geometry, id_to_ann, excluded_ids,
+                                  has_label=self._has_label(syntax.ASSOCIATION))
 
         self._link_text_rel_anns(anns)
         if self.link_pools:
             self._link_pools(anns)
         if self.link_lanes:
-            self._link_lanes(anns, root)
+            self._link_lanes(anns, [c for c in containers if c.tag == _PROCESS_TAG], excluded_ids)
         return anns
 
+    def validate(self, bpmn_path: Union[Path, bytes]) -> List[InvalidBpmnException]:
+        """
+        Runs the same checks as parse_bpmn_anns without creating annotations, e.g. to cheaply prefilter a corpus.
+        In contrast to parse_bpmn_anns, this does not stop at the first violation.
+        :param bpmn_path: path to the BPMN XML file or its content
+        :return: all violations found, an empty list if the file can be parsed
+        """
+        root = _read_xml(bpmn_path)
+        bpmn_path = _source_name(bpmn_path)
+        errors = []
+
+        try:
+            _check_no_choreography(root)
+        except InvalidBpmnException as e:
+            errors.append(e)
+
+        id_to_obj = _create_model_id_to_obj_mapping(root, errors)
+
+        try:
+            plane = _find_plane(root)
+        except InvalidBpmnException as e:
+            return errors + [e]
+        elements = plane.findall("bpmndi:BPMNShape", NS_MAP) + plane.findall("bpmndi:BPMNEdge", NS_MAP)
+
+        # ids of the elements that parse_bpmn_anns would create a (non-label) annotation for
+        ann_ids = set()
+        excluded_ids = set()
+        associations = []
+        for element in elements:
+            model_id = element.get("bpmnElement")
+            if model_id not in id_to_obj:
+                errors.append(InvalidBpmnException("Missing model element", f"{bpmn_path}: {model_id}"))
+                continue
+            model_element = id_to_obj[model_id]
+            if get_ns(model_element) != NS_MODEL:
+                continue
+            if self._is_excluded_tag(get_tag_without_ns(model_element)):
+                excluded_ids.add(model_id)
+                continue
+            try:
+                category = get_category(element, model_element)
+            except InvalidBpmnException as e:
+                errors.append(e)
+                continue
+            if not self.is_included_category(category):
+                excluded_ids.add(model_id)
+                continue
+
+            if category == syntax.ASSOCIATION:
+                associations.append((element, model_element))
+                continue
+            if category in syntax.BPMNDI_SHAPE_CATEGORIES:
+                errors += _validate_shape(element, model_element, category)
+            else:
+                errors += _validate_edge(element, model_element, category, ann_ids=None)
+            ann_ids.add(model_element.get("id"))
+
+        for association, model_element in associations:
+            errors += _validate_edge(association, model_element, syntax.ASSOCIATION, ann_ids | excluded_ids)
+
+        if self.link_lanes:
+            _lane_refs(root.findall("process", NS_MAP), ann_ids, excluded_ids, errors)
+
+        return errors
+
     def _link_text_rel_anns(self, anns):
         id_to_ann = {a.id: a for a in anns if a.category != "label"}
 
@@ -182,22 +386,12 @@ class BpmnParser:
                 pool_ann = process_id_to_ann.get(a.get("pool"), None)
                 a.set("pool", pool_ann)
 
-    def _link_lanes(self, anns, root):
-        # NOTE: This only selects top-level lanes and no nested lanes
-        flow_nodes = root.findall("process/laneSet/lane/flowNodeRef", NS_MAP)
-        if len(flow_nodes) == 0:
-            return
-
+    def _link_lanes(self, anns, processes: List[Element], excluded_ids: Set[str]):
         id_to_ann = {a.id: a for a in anns if a.category != "label"}
-        for flow_node in flow_nodes:
-            # e.g. <flowNodeRef>Event_00v8k43</flowNodeRef>
-            node_ann = id_to_ann.get(flow_node.text, None)
-            if node_ann is None:
-                raise InvalidBpmnException("Invalid Lane flowNodeRef id", flow_node.text)
-            lane_ann = id_to_ann[flow_node.getparent().get("id")]
-            node_ann.lane = lane_ann
+        for node_id, lane_id in _lane_refs(processes, id_to_ann.keys(), excluded_ids):
+            id_to_ann[node_id].lane = id_to_ann[lane_id]
 
-    def scale_anns_to_img_width_(self, anns: List[Annotation], bpmn_path: Path, img: Image.Image):
+    def scale_anns_to_img_width_(self, anns: List[Annotation], bpmn_path: Union[Path, bytes], img: Image.Image):
         img_w_annotation = parse_annotation_background_width(bpmn_path)
         scale = img.width / img_w_annotation
 
@@ -207,7 +401,7 @@ class BpmnParser:
             if not a.bb.is_within_img(img.width, img.height):
                 _logger.debug(
                     "%s: clipping bb %s to img (%d,%d)",
-                    bpmn_path.name,
+                    _source_name(bpmn_path),
                     a.bb,
                     img.width,
                     img.height,
@@ -229,6 +423,139 @@ class BpmnParser:
             )
 
 
+class BpmnDiagram:
+    """
+    A diagram of a BPMN file that is parsed on demand, see BpmnParser.iter_diagrams
+    """
+
+    def __init__(self, parser: BpmnParser, diagram: Element, id_to_container: Dict[str, Element], bpmn_path):
+        """
+        :param id_to_container: top-level collaboration and process elements of the file by id
+        """
+        self.parser = parser
+        self.diagram = diagram
+        # None for a diagram without plane, which is only an error once the diagram is parsed
+        self.plane: Optional[Element] = diagram.find("bpmndi:BPMNPlane", NS_MAP)
+        self.id_to_container = id_to_container
+        self.bpmn_path = bpmn_path
+
+    @property
+    def id(self) -> Optional[str]:
+        return self.diagram.get("id")
+
+    @property
+    def name(self) -> Optional[str]:
+        return self.diagram.get("name")
+
+    @property
+    def bpmn_element(self) -> Optional[str]:
+        """id of the collaboration, process or sub process that is shown in the diagram"""
+        return self.plane.get("bpmnElement") if self.plane is not None else None
+
+    def containers(self) -> List[Element]:
+        """
+        :return: collaboration and processes whose model elements can be referenced by the plane
+        """
+        container = self.id_to_container.get(self.bpmn_element, None)
+        if container is None:
+            # e.g. a drill-down plane of a sub process, whose model element is nested in some process
+            return list(self.id_to_container.values())
+        if container.tag == _PROCESS_TAG:
+            return [container]
+        process_ids = [p.get("processRef") for p in container.iterfind("participant", NS_MAP)]
+        return [container] + [self.id_to_container[pid] for pid in process_ids if pid in self.id_to_container]
+
+    def parse_anns(self) -> List[Annotation]:
+        if self.plane is None:
+            raise InvalidBpmnException("Missing BPMNPlane", f"{self.bpmn_path}: diagram {self.id}")
+        try:
+            return self.parser._parse_plane(self.plane, self.containers(), self.bpmn_path)
+        except InvalidBpmnException as e:
+            if e.error_type != "Missing model element":
+                raise e
+            # the plane references model elements outside of its collaboration/process, e.g. in a message flow
+            _logger.debug("%s: %s, parsing diagram %s with all model elements", self.bpmn_path, e, self.id)
+            return self.parser._parse_plane(self.plane, list(self.id_to_container.values()), self.bpmn_path)
+
+    def __repr__(self):
+        return f"BpmnDiagram(id={self.id!r}, name={self.name!r}, bpmn_element={self.bpmn_element!r})"
+
+
+def _scale_anns_(anns: List[Annotation], scale: float):
+    for a in anns:
+        a.bb = a.bb.scale(scale)
+        for k in ["waypoints", *ARROW_KEYPOINT_FIELDS]:
+            if k in a:
+                a.set(k, a.get(k) * scale)
+
+
+def _read_xml(bpmn_path: Union[Path, bytes], xml_parser: Optional[etree.XMLParser] = None) -> Element:
+    if isinstance(bpmn_path, bytes):
+        return etree.fromstring(bpmn_path, xml_parser)
+    return etree.parse(str(bpmn_path), xml_parser).getroot()
+
+
+def _n_bytes(path: Union[Path, bytes]) -> int:
+    return len(path) if isinstance(path, bytes) else Path(path).stat().st_size
+
+
+def _source_name(bpmn_path: Union[Path, bytes]):
+    return "<bytes>" if isinstance(bpmn_path, bytes) else bpmn_path
+
+
+def _check_no_choreography(root: Element):
+    choreographies = root.findall("choreography", NS_MAP)
+    if len(choreographies) > 0:
+        # slight abuse of the exception class as this is not per se invalid BPMN
+        raise InvalidBpmnException("BPMN Choreography diagrams are not implemented.")
+
+
+def _find_plane(root: Element) -> Element:
+    """:return: the plane of the first diagram"""
+    plane = root.find("bpmndi:BPMNDiagram/bpmndi:BPMNPlane", NS_MAP)
+    if plane is None:
+        raise InvalidBpmnException("Missing BPMNPlane")
+    return plane
+
+
+def _lane_refs(processes: List[Element], ann_ids: Collection[str], excluded_ids: Set[str],
+               errors: List[InvalidBpmnException] = None) -> List[Tuple[str, str]]:
+    """
+    NOTE: This only selects top-level lanes and no nested lanes
+    :param ann_ids: ids of the (non-label) annotations
+    :param errors: if given, invalid references are appended to errors instead of raising an InvalidBpmnException
+    :return: (flow node id, lane id) of each flowNodeRef of a lane, except for excluded flow nodes and lanes
+    """
+    refs = []
+    for process in processes:
+        for flow_node in process.iterfind("laneSet/lane/flowNodeRef", NS_MAP):
+            # e.g. <flowNodeRef>Event_00v8k43</flowNodeRef>
+            node_id = flow_node.text
+            lane_id = flow_node.getparent().get("id")
+            if node_id in excluded_ids or lane_id in excluded_ids:
+                continue
+            if node_id not in ann_ids:
+                e = InvalidBpmnException("Invalid Lane flowNodeRef id", node_id)
+            elif lane_id not in ann_ids:
+                e = InvalidBpmnException("Lane without shape", lane_id)
+            else:
+                refs.append((node_id, lane_id))
+                continue
+            if errors is None:
+                raise e
+            errors.append(e)
+    return refs
+
+
+def _create_model_id_to_obj_mapping(root: Element, errors: List[InvalidBpmnException] = None):
+    id_to_obj = {}
+    for collaboration in root.findall("collaboration", NS_MAP):
+        id_to_obj.update(_create_id_to_obj_mapping(collaboration, errors))
+    for process in root.findall("process", NS_MAP):
+        id_to_obj.update(_create_id_to_obj_mapping(process, errors))
+    return id_to_obj
+
+
 def get_ns(element: Element):
     tag_str = element.tag
     i = tag_str.find("}")
@@ -252,8 +579,8 @@ def get_category(bpmndi_element: Element, model_element: Element):
     if category.endswith("Event"):
         # types are definition childrens: terminateEventDefinition, messageEventDefinition, timerEventDefinition
         # NOTE parallelMultipleEvent has multiple definitions e.g. timer + message
-        event_types = [t for t in syntax.EVENT_DEFINITIONS if
-                       model_element.find(f"{t}EventDefinition", NS_MAP) is not None]
+        child_tags = {child.tag for child in model_element}
+        event_types = [t for t, tag in _EVENT_DEFINITION_TAGS if tag in child_tags]
         if len(event_types) == 1:
             # startEvent -> messageStartEvent, endEvent -> terminateEndEvent, boundaryEvent -> timerBoundaryEvent...
             category = event_types[0] + capitalize_fc(category)
@@ -264,20 +591,7 @@ def get_category(bpmndi_element: Element, model_element: Element):
                 raise InvalidBpmnException(f"Invalid {category} with multiple event definitions", ",".join(event_types))
             category = syntax.PARALLEL_MULTIPLE_PREFIX + capitalize_fc(category)
 
-    category_mappings = {
-        # events
-        "intermediateThrowEvent": syntax.INTERMEDIATE_EVENT,
-        "timerIntermediateCatchEvent": syntax.TIMER_INTERMEDIATE_EVENT,
-        # collaboration
-        "participant": syntax.POOL,
-        # data association
-        "dataInputAssociation": syntax.DATA_ASSOCIATION,
-        "dataOutputAssociation": syntax.DATA_ASSOCIATION,
-        # data elements (remove 'Reference' suffix)
-        "dataObjectReference": syntax.DATA_OBJECT,
-        "dataStoreReference": syntax.DATA_STORE,
-    }
-    category = category_mappings.get(category, category)
+    category = _CATEGORY_MAPPINGS.get(category, category)
 
     if category == "subProcess":
         # <bpmndi:BPMNShape id="Activity_1cnm0ru_di" bpmnElement="Activity_1cnm0ru" isExpanded="true">
@@ -288,13 +602,16 @@ def get_category(bpmndi_element: Element, model_element: Element):
 
     # if category not in syntax.ALL_CATEGORIES:
     #    _logger.warning(f"Unknown category: {category}")
-    msg = f"{get_tag_without_ns(model_element)} {model_element.attrib} unknown category: {category}"
-    assert category in syntax.ALL_CATEGORIES, msg
+    assert category in _ALL_CATEGORIES, \
+        f"{get_tag_without_ns(model_element)} {model_element.attrib} unknown category: {category}"
 
     return category
 
 
-def _create_id_to_obj_mapping(element):
+def _create_id_to_obj_mapping(element, errors: List[InvalidBpmnException] = None):
+    """
+    :param errors: if given, duplicate ids are appended to errors instead of raising an InvalidBpmnException
+    """
     id_to_obj = {}
     to_visit = [element]
     while len(to_visit) != 0:
@@ -324,15 +641,20 @@ def _create_id_to_obj_mapping(element):
             if existing_tag == child_tag and child_tag in {"dataObjectReference", "dataStoreReference", "dataState"}:
                 # sometimes data elements are listed multiple times
                 continue
-            raise InvalidBpmnException("Duplicate model element id", f"{eid} (existing={existing_tag}, new={child_tag}")
+            e = InvalidBpmnException("Duplicate model element id", f"{eid} (existing={existing_tag}, new={child_tag}")
+            if errors is None:
+                raise e
+            errors.append(e)
 
     return id_to_obj
 
 
-def _edge_to_anns(edge: Element, model_element: Element, id_to_ann: Dict[str, Annotation]):
+def _edge_to_anns(i: int, model_element: Element, category: str, geometry: "_PlaneGeometry",
+                  id_to_ann: Dict[str, Annotation], excluded_ids: Set[str], has_label: bool):
     """
     Parses edges (see syntax.BPMNDI_EDGE_CATEGORIES)
-    :param edge the BPMNDI edge element
+    :param i: index of the BPMNDI edge element in the plane geometry
+    :param excluded_ids: ids of elements that are excluded, relations to them are not set
     :param model_element the corresponding model element
     (this is relevant for arrows where the waypoints don't include the width/height of the arrow head)
 
@@ -345,15 +667,10 @@ def _edge_to_anns(edge: Element, model_element: Element, id_to_ann: Dict[str, An
      </bpmndi:BPMNEdge>
      Examples model_element: see parse_edge_attribs()
     """
-    category = get_category(edge, model_element)
-
-    waypoints = np.array(
-        [[to_int_or_float(wp.get("x")), to_int_or_float(wp.get("y"))] for wp in
-         edge.findall("omgdi:waypoint", NS_MAP)]
-    )
+    waypoints = geometry.edge_waypoints(i)
     if len(waypoints) == 0:
         raise InvalidBpmnException(f"{category} without waypoints")
-    bb = BoundingBox.from_points(waypoints, allow_neg_coord=True)
+    bb = geometry.edge_bb(i)
 
     attrib = _parse_edge_attribs(model_element)
     # create Annotation links instead of linking through id
@@ -361,28 +678,73 @@ def _edge_to_anns(edge: Element, model_element: Element, id_to_ann: Dict[str, An
         if rel not in attrib:
             continue
         sid = attrib[rel]
+        if sid in excluded_ids:
+            del attrib[rel]
+            continue
         ann = id_to_ann.get(sid, None)
         if ann is None and category == syntax.ASSOCIATION:
             # TODO implement that associations can be connected to other associations
             raise InvalidBpmnException("Association has another association as src or target", sid)
         attrib[rel] = ann
+    from yamlu.img import Annotation
     anns = [Annotation(category, bb, waypoints=waypoints, **attrib)]
 
-    lbl_ann = _create_label_ann_if_exists(edge, model_element)
+    lbl_ann = _create_label_ann_if_exists(i, model_element, geometry) if has_label else None
     if lbl_ann is not None:
         anns.append(lbl_ann)
 
     return anns
 
 
-def _shape_to_anns(shape: Element, model_element: Element, has_pools: bool) -> List[Annotation]:
-    category = get_category(shape, model_element)
-
+def _validate_edge(edge: Element, model_element: Element, category: str,
+                   ann_ids: Optional[Set[str]]) -> List[InvalidBpmnException]:
+    """
+    Checks of _edge_to_anns without creating annotations
+    :param ann_ids: ids of the other annotations (and excluded elements),
+        required to check that associations do not point to associations
+    """
+    errors = []
+    if edge.find("omgdi:waypoint", NS_MAP) is None:
+        errors.append(InvalidBpmnException(f"{category} without waypoints"))
+    try:
+        attrib = _parse_edge_attribs(model_element)
+    except InvalidBpmnException as e:
+        errors.append(e)
+        return errors
+
+    if category == syntax.ASSOCIATION:
+        for rel in ARROW_RELATIONS:
+            if rel in attrib and attrib[rel] not in ann_ids:
+                errors.append(InvalidBpmnException("Association has another association as src or target",
+                                                   attrib[rel]))
+    return errors
+
+
+def _validate_shape(shape: Element, model_element: Element, category: str) -> List[InvalidBpmnException]:
+    """Checks of _shape_to_anns without creating annotations"""
+    if _shape_bounds(shape) is None:
+        return [InvalidBpmnException(f"{category} without bounds", model_element.get("id"))]
+    return []
+
+
+def _shape_bounds(shape: Element) -> Optional[Element]:
+    """:return: the omgdc:Bounds element of the shape, None if it is missing or incomplete"""
     bounds = shape.find("omgdc:Bounds", NS_MAP)
+    if bounds is None or any(bounds.get(k) is None for k in ["x", "y", "width", "height"]):
+        return None
+    return bounds
+
+
+def _shape_to_anns(i: int, model_element: Element, category: str, geometry: "_PlaneGeometry",
+                   has_pools: bool, has_label: bool) -> List[Annotation]:
+    bb = geometry.shape_bb(i)
+    if bb is None:
+        raise InvalidBpmnException(f"{category} without bounds", model_element.get("id"))
 
+    from yamlu.img import Annotation
     shape_ann = Annotation(
         category=category,
-        bb=bounds_to_bb(bounds),
+        bb=bb,
         **model_element.attrib
     )
     if has_pools and category != syntax.POOL:
@@ -402,7 +764,7 @@ def _shape_to_anns(shape: Element, model_element: Element, has_pools: bool) -> L
             shape_ann.name = text_el.text
 
     anns = [shape_ann]
-    lbl_ann = _create_label_ann_if_exists(shape, model_element)
+    lbl_ann = _create_label_ann_if_exists(i, model_element, geometry) if has_label else None
     if lbl_ann is not None:
         anns.append(lbl_ann)
 
@@ -443,31 +805,174 @@ def _parse_edge_attribs(model_element):
     elif tag == "dataInputAssociation":
         # overwrite Property targetRef
         # TODO what is this property for?
-        attrib[ARROW_PREV_REL] = model_element.find("sourceRef", NS_MAP).text
+        attrib[ARROW_PREV_REL] = _child_text(model_element, "sourceRef")
         attrib[ARROW_NEXT_REL] = model_element.getparent().get("id")
     elif tag == "dataOutputAssociation":
         attrib[ARROW_PREV_REL] = model_element.getparent().get("id")
-        attrib[ARROW_NEXT_REL] = model_element.find("targetRef", NS_MAP).text
+        attrib[ARROW_NEXT_REL] = _child_text(model_element, "targetRef")
     else:
         raise ValueError(f"Unknown edge tag: {tag}")
 
     return attrib
 
 
-def _create_label_ann_if_exists(shape_or_edge, model_element) -> Optional[Annotation]:
-    label = shape_or_edge.find("bpmndi:BPMNLabel", NS_MAP)
-    if label is None:
-        return None
+def _child_text(model_element: Element, tag: str) -> str:
+    child = model_element.find(tag, NS_MAP)
+    if child is None:
+        raise InvalidBpmnException(f"{get_tag_without_ns(model_element)} has no {tag}", model_element.get("id"))
+    return child.text
+
 
+def _create_label_ann_if_exists(i: int, model_element: Element, geometry: "_PlaneGeometry") -> Optional[Annotation]:
     text = model_element.get("name")
     if text is None or text.strip() == "":
         return None
 
     # BPMN Spec. p. 382: "The bounds of the BPMNLabel are optional"
-    bounds = label.find("omgdc:Bounds", NS_MAP)
-    if bounds is None:
+    bb = geometry.label_bb(i)
+    if bb is None:
         return None
 
-    a = Annotation(category="label", bb=bounds_to_bb(bounds), name=text)
+    from yamlu.img import Annotation
+    a = Annotation(category="label", bb=bb, name=text)
     a.set(TEXT_BELONGS_TO_REL, model_element.get("id"))
     return a
+
+
+class _PlaneGeometry:
+    """
+    Bounds and waypoints of all shapes and edges of a plane, extracted column-wise with precompiled XPath
+    expressions into contiguous float arrays, instead of converting each coordinate separately.
+    Element i refers to (shapes + edges)[i].
+    Falls back to reading the elements one by one if the columns cannot be aligned (e.g. a shape without bounds).
+    """
+
+    def __init__(self, plane: Optional[Element], shapes: List[Element], edges: List[Element]):
+        """
+        :param plane: the plane that contains exactly the given shapes and edges,
+                      None to read the elements one by one (e.g. for a subset of the elements of a plane)
+        """
+        import numpy as np
+
+        self.n_shapes = len(shapes)
+        elements = shapes + edges
+        xpaths = _plane_xpaths()
+
+        shape_xywh = _bulk_attribs(plane, xpaths.shape_bounds, len(shapes)) if plane is not None else None
+        if shape_xywh is not None:
+            self._shape_xywh = shape_xywh.tolist()
+        else:
+            # shapes without bounds get None, which is only an error if an annotation is created for the shape
+            bounds = [_shape_bounds(shape) for shape in shapes]
+            xywh = iter(bounds_to_xywh([b for b in bounds if b is not None]).tolist())
+            self._shape_xywh = [next(xywh) if b is not None else None for b in bounds]
+
+        self.waypoint_offsets = np.zeros(len(edges) + 1, dtype=np.int64)
+        np.cumsum([int(xpaths.count_waypoints(edge)) for edge in edges], out=self.waypoint_offsets[1:])
+        waypoints = None
+        if plane is not None and len(xpaths.incomplete_waypoints(plane)) == 0:
+            waypoints = _bulk_attribs(plane, xpaths.waypoints, self.waypoint_offsets[-1])
+        if waypoints is None:
+            waypoints = waypoints_to_xy([wp for edge in edges for wp in edge.findall("omgdi:waypoint", NS_MAP)])
+        self.waypoints = waypoints
+
+        # edge bounding boxes as in BoundingBox.from_points, i.e. +1 to convert from pixel to coordinate-based
+        self._edge_ltrb = np.zeros((len(edges), 4))
+        has_wps = np.diff(self.waypoint_offsets) > 0
+        if has_wps.any():
+            starts = self.waypoint_offsets[:-1][has_wps]
+            self._edge_ltrb[has_wps, :2] = np.minimum.reduceat(waypoints, starts, axis=0)
+            self._edge_ltrb[has_wps, 2:] = np.maximum.reduceat(waypoints, starts, axis=0) + 1
+        self._edge_ltrb = self._edge_ltrb.tolist()
+
+        # labels: only the first BPMNLabel of an element and its first Bounds are considered
+        self._label_xywh = {}
+        owners = xpaths.label_owner(plane) if plane is not None else []
+        label_xywh = _bulk_attribs(plane, xpaths.label_bounds, len(owners)) if plane is not None else None
+        if label_xywh is not None and len(set(owners)) == len(owners):
+            owner_to_idx = {el.get("bpmnElement"): i for i, el in enumerate(elements)}
+            self._label_xywh = {owner_to_idx[o]: xywh for o, xywh in zip(owners, label_xywh.tolist())}
+        else:
+            for i, el in enumerate(elements):
+                label = el.find("bpmndi:BPMNLabel", NS_MAP)
+                bounds = label.find("omgdc:Bounds", NS_MAP) if label is not None else None
+                if bounds is not None:
+                    self._label_xywh[i] = bounds_to_xywh([bounds])[0].tolist()
+
+    def shape_bb(self, i: int) -> Optional[BoundingBox]:
+        """:return: None if the shape has no bounds"""
+        from yamlu.img import BoundingBox
+        if i >= self.n_shapes or self._shape_xywh[i] is None:
+            return None
+        return BoundingBox.from_xywh(*self._shape_xywh[i], allow_neg_coord=True)
+
+    def edge_waypoints(self, i: int) -> np.ndarray:
+        """:return: (n, 2) float64 view into the waypoints array of the plane"""
+        j = i - self.n_shapes
+        if j < 0:
+            return self.waypoints[:0]
+        return self.waypoints[self.waypoint_offsets[j]:self.waypoint_offsets[j + 1]]
+
+    def edge_bb(self, i: int) -> BoundingBox:
+        from yamlu.img import BoundingBox
+        return BoundingBox.from_ltrb(self._edge_ltrb[i - self.n_shapes], allow_neg_coord=True)
+
+    def label_bb(self, i: int) -> Optional[BoundingBox]:
+        from yamlu.img import BoundingBox
+        xywh = self._label_xywh.get(i, None)
+        if xywh is None:
+            return None
+        return BoundingBox.from_xywh(*xywh, allow_neg_coord=True)
+
+
+def _bulk_attribs(plane: Element, xpaths: List[etree.XPath], n: int) -> Optional[np.ndarray]:
+    """
+    :return: (n, len(xpaths)) array of the attribute values selected by each XPath,
+        or None if any of the columns does not have n values
+    """
+    import numpy as np
+
+    cols = [xpath(plane) for xpath in xpaths]
+    if any(len(col) != n for col in cols):
+        return None
+    return np.ascontiguousarray(np.array(cols, dtype=np.float64).reshape(len(xpaths), n).T)
+
+
+_XPATH_NS = {k: v for k, v in NS_MAP.items() if k is not None}
+
+
+def _xpath(path: str) -> etree.XPath:
+    # smart_strings=False returns plain strings without a reference to their parent element, which is much faster
+    return etree.XPath(path, namespaces=_XPATH_NS, smart_strings=False)
+
+
+class _PlaneXPaths:
+    """
+    Compiled XPath expressions of _PlaneGeometry.
+    lxml serializes the calls of an XPath object with a lock, so each thread has its own (see _plane_xpaths).
+    """
+
+    def __init__(self):
+        # [1] selects at most one element, so that the columns are aligned if each has as many values as elements
+        self.shape_bounds = [_xpath(f"bpmndi:BPMNShape/omgdc:Bounds[1]/@{k}") for k in ["x", "y", "width", "height"]]
+        self.label_owner = _xpath(
+            "*[self::bpmndi:BPMNShape or self::bpmndi:BPMNEdge][bpmndi:BPMNLabel[1]/omgdc:Bounds]/@bpmnElement"
+        )
+        self.label_bounds = [
+            _xpath(f"*[self::bpmndi:BPMNShape or self::bpmndi:BPMNEdge]/bpmndi:BPMNLabel[1]/omgdc:Bounds[1]/@{k}")
+            for k in ["x", "y", "width", "height"]
+        ]
+        self.waypoints = [_xpath(f"bpmndi:BPMNEdge/omgdi:waypoint/@{k}") for k in ["x", "y"]]
+        self.incomplete_waypoints = _xpath("bpmndi:BPMNEdge/omgdi:waypoint[not(@x) or not(@y)]")
+        self.count_waypoints = _xpath("count(omgdi:waypoint)")
+
+
+_thread_state = threading.local()
+
+
+def _plane_xpaths() -> _PlaneXPaths:
+    xpaths = getattr(_thread_state, "plane_xpaths", None)
+    if xpaths is None:
+        xpaths = _PlaneXPaths()
+        _thread_state.plane_xpaths = xpaths
+    return xpaths
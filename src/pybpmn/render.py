@@ -0,0 +1,159 @@
+import colorsys
+import io
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from joblib import Parallel, delayed
+from PIL import Image, ImageDraw
+from yamlu.img import AnnotatedImage, Annotation
+
+from pybpmn import syntax
+from pybpmn.augment import DiagramGeometry
+from pybpmn.constants import ARROW_PREV_REL, ARROW_RELATIONS, RELATIONS
+from pybpmn.dataset import HDBPMN_CATEGORY_GROUPS
+from pybpmn.targets import polyline_pixels
+
+_logger = logging.getLogger(__name__)
+
+Color = Tuple[int, int, int]
+
+_DEFAULT_COLOR: Color = (128, 128, 128)
+_LINK_COLOR: Color = (255, 0, 255)
+_TAIL_COLOR: Color = (0, 170, 0)
+_HEAD_COLOR: Color = (230, 0, 0)
+
+
+def category_palette(category_groups: Dict[str, List[str]] = HDBPMN_CATEGORY_GROUPS) -> Dict[str, Color]:
+    """
+    Each category group gets its own hue, the categories of a group differ in brightness.
+    Categories that are not in category_groups get the hue of their group in syntax.CATEGORY_GROUPS.
+    """
+    group_hues = {group: i / len(category_groups) for i, group in enumerate(category_groups)}
+    palette = {}
+    for group, categories in category_groups.items():
+        for i, category in enumerate(categories):
+            value = 0.95 - 0.45 * i / max(len(categories) - 1, 1)
+            palette[category] = _hsv_to_rgb(group_hues[group], 0.85, value)
+    for group, categories in syntax.CATEGORY_GROUPS.items():
+        for category in categories:
+            if category not in palette and group in group_hues:
+                palette[category] = _hsv_to_rgb(group_hues[group], 0.5, 0.6)
+    return palette
+
+
+def _hsv_to_rgb(h: float, s: float, v: float) -> Color:
+    return tuple(round(c * 255) for c in colorsys.hsv_to_rgb(h, s, v))
+
+
+_PALETTE = category_palette()
+
+
+def render_ann_img(
+        ai: AnnotatedImage,
+        max_size: Optional[int] = None,
+        line_width: int = 2,
+        marker_size: int = 7,
+        draw_links: bool = True,
+        draw_text: bool = False,
+        palette: Optional[Dict[str, Color]] = None,
+) -> Image.Image:
+    """
+    Draws the boxes, edge waypoints, head/tail keypoints and relation links (arrow_prev/arrow_next to the box of the
+    related element, text_belongs_to between label and element) of all annotations onto a copy of the image.
+    All shapes are rasterized at once into one array of pixels, which are colored with a single array assignment.
+    :param max_size: downscale the image (before drawing) such that its larger side is at most max_size
+    :param draw_text: draw the category name of each annotation, which requires one draw call per annotation
+    :param palette: category -> RGB color, defaults to category_palette()
+    """
+    assert ai.img is not None, f"{ai.filename}: image is required"
+    palette = _PALETTE if palette is None else palette
+    img = ai.img.convert("RGB")
+    scale = 1.0
+    if max_size is not None and max(img.size) > max_size:
+        scale = max_size / max(img.size)
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.BILINEAR)
+
+    anns = ai.annotations
+    n = len(anns)
+    geometry = DiagramGeometry.from_anns(anns)
+    # colors of the polylines: one per annotation, the link color and the keypoint colors
+    color_table = np.array([palette.get(a.category, _DEFAULT_COLOR) for a in anns]
+                           + [_LINK_COLOR, _TAIL_COLOR, _HEAD_COLOR], dtype=np.uint8).reshape(-1, 3)
+    link_color, tail_color = n, n + 1
+
+    # box outlines as closed polylines (l, t), (r, t), (r, b), (l, b), (l, t)
+    t, l, b, r = geometry.boxes.T
+    box_pts = np.stack([np.stack([l, t], 1), np.stack([r, t], 1), np.stack([r, b], 1), np.stack([l, b], 1),
+                        np.stack([l, t], 1)], 1).reshape(-1, 2)
+    box_colors = np.repeat(np.arange(n), 5)
+    wp_colors = np.repeat(np.arange(n), np.diff(geometry.waypoint_offsets))
+    link_pts = _link_points(anns) if draw_links else np.zeros((0, 2))
+
+    # polylines ids have to differ between consecutive polylines: boxes, edges and links are numbered separately
+    points = np.concatenate([box_pts, geometry.waypoints, link_pts])
+    polyline_ids = np.concatenate([box_colors, n + wp_colors, 2 * n + np.repeat(np.arange(len(link_pts) // 2), 2)])
+    polyline_colors = np.concatenate([np.arange(n), np.arange(n), np.full(len(link_pts) // 2, link_color)])
+    xy, ids = polyline_pixels(points, polyline_ids, stride=1 / scale, line_width=line_width)
+    colors = polyline_colors[ids]
+
+    # keypoints as filled squares, drawn last
+    kps = geometry.keypoints * scale
+    has_kp = ~np.isnan(kps).any(axis=2)
+    kp_xy = np.rint(kps[has_kp]).astype(np.int64)
+    kp_colors = tail_color + np.nonzero(has_kp)[1]
+    offsets = np.arange(marker_size) - (marker_size - 1) // 2
+    offsets = np.stack(np.meshgrid(offsets, offsets), axis=-1).reshape(-1, 2)
+    xy = np.concatenate([xy, (kp_xy[:, None] + offsets).reshape(-1, 2)])
+    colors = np.concatenate([colors, np.repeat(kp_colors, len(offsets))])
+
+    arr = np.array(img)
+    h, w = arr.shape[:2]
+    inside = (xy[:, 0] >= 0) & (xy[:, 0] < w) & (xy[:, 1] >= 0) & (xy[:, 1] < h)
+    arr[xy[inside, 1], xy[inside, 0]] = color_table[colors[inside]]
+    img = Image.fromarray(arr)
+
+    if draw_text:
+        draw = ImageDraw.Draw(img)
+        for a, color in zip(anns, color_table.tolist()):
+            if a.category != syntax.LABEL:
+                draw.text((a.bb.l * scale, a.bb.t * scale - 11), a.category, fill=tuple(color))
+    return img
+
+
+def encode_ann_img(ai: AnnotatedImage, jpg_quality: int = 75, **render_kwargs) -> bytes:
+    """:return: JPEG encoded render_ann_img"""
+    buf = io.BytesIO()
+    render_ann_img(ai, **render_kwargs).save(buf, format="JPEG", quality=jpg_quality)
+    return buf.getvalue()
+
+
+def save_ann_img(ai: AnnotatedImage, directory: Path, suffix: str = "_bb", jpg_quality: int = 75,
+                 **render_kwargs) -> Path:
+    """Replacement of AnnotatedImage.save_with_anns, with the same filename"""
+    directory.mkdir(exist_ok=True, parents=True)
+    img_path = directory / f"{ai.img_id}{suffix}.jpg"
+    img_path.write_bytes(encode_ann_img(ai, jpg_quality, **render_kwargs))
+    return img_path
+
+
+def save_ann_imgs(ais: Sequence[AnnotatedImage], directory: Path, n_jobs: int = 1, **kwargs) -> List[Path]:
+    """save_ann_img for many images, in n_jobs worker processes"""
+    return Parallel(n_jobs=n_jobs)(delayed(save_ann_img)(ai, directory, **kwargs) for ai in ais)
+
+
+def _link_points(anns: List[Annotation]) -> np.ndarray:
+    """:return: (2 * k, 2) start and end point of each relation link"""
+    pts = []
+    for a in anns:
+        for rel in RELATIONS:
+            other = a.get(rel) if rel in a else None
+            if not isinstance(other, Annotation):
+                continue
+            if rel in ARROW_RELATIONS and "tail" in a:
+                start = a.tail if rel == ARROW_PREV_REL else a.head
+            else:
+                start = a.bb.center
+            pts += [start, other.bb.center]
+    return np.array(pts, dtype=np.float64).reshape(-1, 2)
@@ -0,0 +1,361 @@
+import csv
+import json
+import logging
+import re
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+from yamlu.img import Annotation, BoundingBox
+
+from pybpmn import serialize, syntax
+from pybpmn.constants import ARROW_NEXT_REL, ARROW_PREV_REL
+from pybpmn.parser import BpmnParser, InvalidBpmnException
+from pybpmn.util import capitalize_fc
+
+_logger = logging.getLogger(__name__)
+
+# the model JSON of a row can be larger than the default field size limit of 128KB
+_CSV_FIELD_SIZE_LIMIT = min(sys.maxsize, 2 ** 31 - 1)
+
+BPMN2_NAMESPACE = "http://b3mn.org/stencilset/bpmn2.0#"
+_NAMESPACE_COL = "Namespace"
+_MODEL_ID_COL = "Model ID"
+_NAME_COL = "Name"
+_MODEL_JSON_COL = "Model JSON"
+
+# e.g. tasktype "Business Rule" -> businessRuleTask
+_TASK_TYPES = {capitalize_fc(t): t for t in syntax.TASK_TYPES}
+
+_STENCIL_TO_CATEGORY = {
+    "Pool": syntax.POOL,
+    "CollapsedPool": syntax.POOL,
+    "Lane": syntax.LANE,
+    "Subprocess": syntax.SUBPROCESS_EXPANDED,
+    "EventSubprocess": syntax.SUBPROCESS_EXPANDED,
+    "CollapsedSubprocess": syntax.SUBPROCESS_COLLAPSED,
+    "CollapsedEventSubprocess": syntax.SUBPROCESS_COLLAPSED,
+    "CallActivity": syntax.CALL_ACTIVITY,
+    "CollapsedCallActivity": syntax.CALL_ACTIVITY,
+    "Exclusive_Databased_Gateway": syntax.EXCLUSIVE_GATEWAY,
+    "ParallelGateway": syntax.PARALLEL_GATEWAY,
+    "InclusiveGateway": syntax.INCLUSIVE_GATEWAY,
+    "EventbasedGateway": syntax.EVENT_BASED_GATEWAY,
+    "ComplexGateway": syntax.COMPLEX_GATEWAY,
+    "DataObject": syntax.DATA_OBJECT,
+    "DataStore": syntax.DATA_STORE,
+    "TextAnnotation": syntax.TEXT_ANNOTATION,
+    "Group": "group",
+    "SequenceFlow": syntax.SEQUENCE_FLOW,
+    "MessageFlow": syntax.MESSAGE_FLOW,
+    "Association_Undirected": syntax.ASSOCIATION,
+    "Association_Unidirectional": syntax.ASSOCIATION,
+    "Association_Bidirectional": syntax.ASSOCIATION,
+}
+# e.g. StartTimerEvent, IntermediateMessageEventCatching, EndNoneEvent, IntermediateEvent
+_EVENT_STENCIL_RE = re.compile(r"^(Start|Intermediate|End)(\w*?)Event(Catching|Throwing)?$")
+_EVENT_TYPES = {"": "", "None": "", "Compensation": "compensate", "ParallelMultiple": syntax.PARALLEL_MULTIPLE_PREFIX}
+_EDGE_CATEGORIES = set(syntax.BPMNDI_EDGE_CATEGORIES)
+_DATA_CATEGORIES = {syntax.DATA_OBJECT, syntax.DATA_STORE}
+_ACTIVITY_CATEGORIES = set(syntax.ACTIVITY_CATEGORIES)
+
+
+class SapSamModel(NamedTuple):
+    model_id: str
+    name: Optional[str]
+    # None if the model could not be converted
+    anns: Optional[List[Annotation]]
+    error: Optional[InvalidBpmnException]
+
+
+class SapSamReader:
+    """
+    Reads the BPMN 2.0 models of the SAP Signavio Academic Models (SAP-SAM) CSV files,
+    without converting them to BPMN XML files first.
+    The Signavio JSON shapes are mapped to the same annotations as BpmnParser.parse_bpmn_anns:
+    categories of pybpmn.syntax, id and name fields, waypoints and arrow_prev/arrow_next of edges
+    and (depending on the parser) pool and lane relations.
+    Signavio JSON does not contain label bounds, therefore no label annotations are created.
+    NOTE: Signavio JSON has no process elements, so with link_pools=False the pool field holds the resourceId
+    of the enclosing pool shape, whereas BpmnParser stores the id of the enclosing process.
+    """
+
+    def __init__(self, parser: Optional[BpmnParser] = None):
+        """
+        :param parser: its category filters and link_pools/link_lanes settings are used
+        """
+        self.parser = BpmnParser() if parser is None else parser
+
+    def iter_csv(self, csv_paths: Iterable[Path], n_jobs: int = 1, chunk_size: int = 64,
+                 max_pending_chunks: Optional[int] = None) -> Iterator[SapSamModel]:
+        """
+        Streams the BPMN 2.0 models of the CSV files row by row, in order.
+        With n_jobs > 1, chunks of rows are converted in worker processes. At most max_pending_chunks chunks
+        (default: 2 * n_jobs) are read ahead, so that memory is bounded independently of the size of the files.
+        """
+        chunks = _iter_chunks(_iter_rows(csv_paths), chunk_size)
+        if n_jobs <= 1:
+            for chunk in chunks:
+                yield from self._parse_rows(chunk)
+            return
+
+        max_pending_chunks = 2 * n_jobs if max_pending_chunks is None else max_pending_chunks
+        with ProcessPoolExecutor(n_jobs) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.submit(_parse_serialized, self, chunk))
+                if len(pending) >= max_pending_chunks:
+                    yield from _deserialize(pending.popleft().result())
+            while len(pending) > 0:
+                yield from _deserialize(pending.popleft().result())
+
+    def parse_model_json(self, model_json: Union[str, bytes, Dict]) -> List[Annotation]:
+        """
+        :param model_json: Signavio JSON of a BPMN 2.0 model, e.g. of the Model JSON column
+        """
+        model = json.loads(model_json) if isinstance(model_json, (str, bytes)) else model_json
+        shapes = list(_iter_shapes(model))
+        source_ids = {}
+        boundary_event_ids = set()
+        for shape, _, _, _ in shapes:
+            for out in shape.get("outgoing", []):
+                source_ids[out["resourceId"]] = shape["resourceId"]
+        for shape, _, _, _ in shapes:
+            if _category(shape, is_boundary_event=False) not in _ACTIVITY_CATEGORIES:
+                continue
+            # events that are docked to an activity are referenced by its outgoing
+            boundary_event_ids.update(out["resourceId"] for out in shape.get("outgoing", []))
+        has_pools = any(_stencil(s) in {"Pool", "CollapsedPool"} for s, _, _, _ in shapes)
+
+        anns = []
+        id_to_ann = {}
+        id_to_abs_ltrb = {}
+        edges = []
+        for shape, offset, pool_id, lane_id in shapes:
+            sid = shape["resourceId"]
+            category = _category(shape, sid in boundary_event_ids)
+            if category not in _EDGE_CATEGORIES and "bounds" in shape:
+                # also for shapes of unknown stencils, which can be the source or target of edges
+                id_to_abs_ltrb[sid] = _abs_ltrb(shape["bounds"], offset)
+            if category is None:
+                _logger.debug("skipping shape with unknown stencil %s", _stencil(shape))
+                continue
+            if not self.parser.is_included_category(category):
+                continue
+            if category in _EDGE_CATEGORIES:
+                edges.append((shape, category, offset))
+                continue
+
+            if sid not in id_to_abs_ltrb:
+                raise InvalidBpmnException(f"{category} without bounds", sid)
+            fields = {"id": sid}
+            name = _name(shape, category)
+            if name is not None:
+                fields["name"] = name
+            a = Annotation(category, BoundingBox.from_ltrb(id_to_abs_ltrb[sid], allow_neg_coord=True), **fields)
+            if has_pools and category != syntax.POOL:
+                a.pool = pool_id
+            if lane_id is not None and category != syntax.LANE and self.parser.link_lanes:
+                a.lane = lane_id
+            anns.append(a)
+            id_to_ann[sid] = a
+
+        # associations can not have associations as src or target (see BpmnParser), so all edges can be created after
+        # the shapes
+        for shape, category, offset in edges:
+            sid = shape["resourceId"]
+            source_id = source_ids.get(sid, None)
+            target_id = shape.get("target", {}).get("resourceId", None)
+            if category == syntax.ASSOCIATION and (_category_of(id_to_ann, source_id) in _DATA_CATEGORIES
+                                                   or _category_of(id_to_ann, target_id) in _DATA_CATEGORIES):
+                category = syntax.DATA_ASSOCIATION
+                if not self.parser.is_included_category(category):
+                    continue
+            waypoints = _waypoints(shape, offset, id_to_abs_ltrb.get(source_id, None),
+                                   id_to_abs_ltrb.get(target_id, None))
+            if len(waypoints) == 0:
+                raise InvalidBpmnException(f"{category} without waypoints", sid)
+            bb = BoundingBox.from_ltrb([*waypoints.min(axis=0), *(waypoints.max(axis=0) + 1)], allow_neg_coord=True)
+
+            fields = {"id": sid}
+            name = _name(shape, category)
+            if name is not None:
+                fields["name"] = name
+            for rel, ref in [(ARROW_PREV_REL, source_id), (ARROW_NEXT_REL, target_id)]:
+                if ref in id_to_ann:
+                    fields[rel] = ref
+            anns.append(Annotation(category, bb, waypoints=waypoints, **fields))
+
+        # create Annotation links instead of linking through id
+        for a in anns:
+            for rel in [ARROW_PREV_REL, ARROW_NEXT_REL]:
+                if rel in a:
+                    a.set(rel, id_to_ann[a.get(rel)])
+            if "lane" in a:
+                # the lane can be of an excluded category
+                if a.lane in id_to_ann:
+                    a.lane = id_to_ann[a.lane]
+                else:
+                    del a.lane
+            if "pool" in a and self.parser.link_pools:
+                a.pool = id_to_ann.get(a.pool, None)
+        return anns
+
+    def _parse_rows(self, rows: List[Dict[str, str]]) -> List[SapSamModel]:
+        models = []
+        for row in rows:
+            model_id, name = row[_MODEL_ID_COL], row.get(_NAME_COL, None)
+            try:
+                models.append(SapSamModel(model_id, name, self.parse_model_json(row[_MODEL_JSON_COL]), None))
+            except InvalidBpmnException as e:
+                _logger.debug("%s: %s", model_id, e)
+                models.append(SapSamModel(model_id, name, None, e))
+            except (json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+                # malformed JSON or shapes without required keys, e.g. resourceId or bounds
+                _logger.debug("%s: invalid model JSON: %r", model_id, e)
+                error = InvalidBpmnException("Invalid model JSON", f"{type(e).__name__}: {e}")
+                models.append(SapSamModel(model_id, name, None, error))
+        return models
+
+
+def _iter_rows(csv_paths: Iterable[Path]) -> Iterator[Dict[str, str]]:
+    for csv_path in csv_paths:
+        with open(csv_path, newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            while True:
+                # the field size limit is process-global, so it is only raised while a row is read
+                prev_limit = csv.field_size_limit(_CSV_FIELD_SIZE_LIMIT)
+                try:
+                    row = next(reader, None)
+                finally:
+                    csv.field_size_limit(prev_limit)
+                if row is None:
+                    break
+                if row.get(_NAMESPACE_COL, BPMN2_NAMESPACE) == BPMN2_NAMESPACE:
+                    yield row
+
+
+def _iter_chunks(rows: Iterator[Dict[str, str]], chunk_size: int) -> Iterator[List[Dict[str, str]]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def _parse_serialized(reader: SapSamReader, rows: List[Dict[str, str]]) -> List[Tuple]:
+    # the annotations are sent back with pybpmn.serialize, which is smaller and faster than pickling them
+    return [(m.model_id, m.name, None if m.anns is None else serialize.dumps(m.anns), m.error)
+            for m in reader._parse_rows(rows)]
+
+
+def _deserialize(models: List[Tuple]) -> Iterator[SapSamModel]:
+    for model_id, name, anns_data, error in models:
+        yield SapSamModel(model_id, name, None if anns_data is None else serialize.loads(anns_data), error)
+
+
+def _iter_shapes(shape: Dict, offset=(0.0, 0.0), pool_id: Optional[str] = None, lane_id: Optional[str] = None):
+    """
+    :return: (shape, absolute offset of its parent, id of the enclosing pool, id of the outermost enclosing lane)
+             of all nested child shapes
+    """
+    for child in shape.get("childShapes", []):
+        yield child, offset, pool_id, lane_id
+        stencil = _stencil(child)
+        child_pool_id = child["resourceId"] if stencil in {"Pool", "CollapsedPool"} else pool_id
+        # NOTE: like BpmnParser._link_lanes, shapes in nested lanes are linked to the top-level lane
+        child_lane_id = child["resourceId"] if stencil == "Lane" and lane_id is None else lane_id
+        ul = child.get("bounds", {}).get("upperLeft", {"x": 0, "y": 0})
+        yield from _iter_shapes(child, (offset[0] + ul["x"], offset[1] + ul["y"]), child_pool_id, child_lane_id)
+
+
+def _stencil(shape: Dict) -> str:
+    return shape.get("stencil", {}).get("id", "")
+
+
+def _category(shape: Dict, is_boundary_event: bool) -> Optional[str]:
+    stencil = _stencil(shape)
+    if stencil == "Task":
+        task_type = shape.get("properties", {}).get("tasktype", "None").replace(" ", "")
+        return syntax.TASK if task_type not in _TASK_TYPES else _TASK_TYPES[task_type] + "Task"
+    if stencil in _STENCIL_TO_CATEGORY:
+        return _STENCIL_TO_CATEGORY[stencil]
+
+    m = _EVENT_STENCIL_RE.match(stencil)
+    if m is None:
+        return None
+    position, event_type, direction = m.groups()
+    event_type = _EVENT_TYPES.get(event_type, event_type[:1].lower() + event_type[1:])
+    if position == "Intermediate":
+        if is_boundary_event:
+            position = "Boundary"
+        elif direction == "Throwing" or (direction is None and event_type == ""):
+            position = "IntermediateThrow"
+        else:
+            position = "IntermediateCatch"
+    category = (position[0].lower() + position[1:] if event_type == "" else event_type + position) + "Event"
+    # see BpmnParser: intermediateThrowEvent -> intermediateEvent, timerIntermediateCatchEvent -> timerIntermediateEvent
+    category = {"intermediateThrowEvent": syntax.INTERMEDIATE_EVENT,
+                "timerIntermediateCatchEvent": syntax.TIMER_INTERMEDIATE_EVENT}.get(category, category)
+    return category if category in syntax.EVENT_CATEGORIES else None
+
+
+def _category_of(id_to_ann: Dict[str, Annotation], sid: Optional[str]) -> Optional[str]:
+    a = id_to_ann.get(sid, None)
+    return None if a is None else a.category
+
+
+def _name(shape: Dict, category: str) -> Optional[str]:
+    props = shape.get("properties", {})
+    name = props.get("text" if category == syntax.TEXT_ANNOTATION else "name", None)
+    return name if name else None
+
+
+def _abs_ltrb(bounds: Dict, offset) -> List[float]:
+    ul, lr = bounds["upperLeft"], bounds["lowerRight"]
+    return [offset[0] + ul["x"], offset[1] + ul["y"], offset[0] + lr["x"], offset[1] + lr["y"]]
+
+
+def _waypoints(shape: Dict, offset, source_ltrb: Optional[List[float]],
+               target_ltrb: Optional[List[float]]) -> np.ndarray:
+    """
+    The first and last docker of a Signavio edge are relative to the upper left corner of its source and target,
+    the other dockers are relative to the parent of the edge.
+    The first and last waypoint are moved to the border of the source and target bounds, like in BPMN XML exports.
+    """
+    dockers = [(d["x"], d["y"]) for d in shape.get("dockers", [])]
+    waypoints = np.array(dockers, dtype=np.float64).reshape(-1, 2)
+    if len(waypoints) == 0:
+        return waypoints
+    waypoints[1:-1] += offset
+    for i, ltrb in [(0, source_ltrb), (-1, target_ltrb)]:
+        if ltrb is None:
+            if len(waypoints) > 1:
+                waypoints[i] += offset
+            continue
+        waypoints[i] += ltrb[:2]
+    if len(waypoints) > 1:
+        if source_ltrb is not None:
+            waypoints[0] = _box_exit(waypoints[0], waypoints[1], source_ltrb)
+        if target_ltrb is not None:
+            waypoints[-1] = _box_exit(waypoints[-1], waypoints[-2], target_ltrb)
+    return waypoints
+
+
+def _box_exit(inner: np.ndarray, outer: np.ndarray, ltrb: List[float]) -> np.ndarray:
+    """:return: the point where the segment from inner to outer leaves the box, inner if outer is in the box"""
+    d = outer - inner
+    ts = []
+    for axis in range(2):
+        if d[axis] > 0:
+            ts.append((ltrb[2 + axis] - inner[axis]) / d[axis])
+        elif d[axis] < 0:
+            ts.append((ltrb[axis] - inner[axis]) / d[axis])
+    t = min(ts, default=0.0)
+    return inner + d * t if 0 <= t <= 1 else inner
@@ -0,0 +1,242 @@
+import json
+import pickle
+import struct
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from yamlu.img import Annotation, BoundingBox
+
+_MAGIC = b"PBPA"
+_VERSION = 1
+# magic, version, length of the JSON header
+_PREFIX = struct.Struct("<4sBI")
+# buffers are aligned for zero-copy np.frombuffer views
+_ALIGN = 8
+
+# relation value that is set, but None (e.g. the pool of a shape in a process without participant)
+_NONE_IDX = -2
+_UNSET_IDX = -1
+
+# per-annotation flags
+_ALLOW_NEG_COORD = 1
+_HAS_WAYPOINTS = 2
+# tail/head keypoint is the first/last waypoint (see BpmnParser.scale_anns_to_img_width_)
+_TAIL_FROM_WAYPOINTS = 4
+_HEAD_FROM_WAYPOINTS = 8
+
+
+class DiagramColumns(NamedTuple):
+    """columnar view of serialized annotations, arrays can be read-only views into the serialized bytes"""
+    # category name of each annotation
+    categories: List[str]
+    # (n, 4) boxes as (t, l, b, r)
+    boxes: np.ndarray
+    # waypoints of annotation i are waypoints[waypoint_offsets[i]:waypoint_offsets[i + 1]]
+    waypoint_offsets: np.ndarray
+    waypoints: np.ndarray
+    # relation field -> (n,) index of the related annotation, -1 if not set, -2 if set to None
+    relations: Dict[str, np.ndarray]
+    # string field -> value for each annotation, None if not set
+    strings: Dict[str, List[Optional[str]]]
+
+    def __len__(self):
+        return len(self.categories)
+
+
+def dumps(anns: List[Annotation]) -> bytes:
+    """
+    Compact binary serialization of the annotations of a diagram, e.g. to send parse results between processes.
+    Relations between annotations (arrow_prev/arrow_next, text_belongs_to, pool, lane) are encoded as indices,
+    boxes and waypoints as packed float arrays and string fields (id, name, BPMN attributes) as one
+    NUL-separated UTF-8 buffer per field. Fields of other types are pickled as a fallback.
+    :param anns: relations to annotations that are not in anns are not supported
+    """
+    n = len(anns)
+    ann_to_idx = {id(a): i for i, a in enumerate(anns)}
+
+    cat_to_code: Dict[str, int] = {}
+    category_codes = []
+    boxes = []
+    flags = np.zeros(n, dtype=np.uint8)
+    n_waypoints = np.zeros(n, dtype=np.int64)
+    waypoints = []
+    relations: Dict[str, np.ndarray] = {}
+    strings: Dict[str, List[Optional[str]]] = {}
+    other_fields: List[Tuple[int, str, object]] = []
+
+    for i, a in enumerate(anns):
+        category_codes.append(cat_to_code.setdefault(a.category, len(cat_to_code)))
+        bb = a.bb
+        boxes.append((bb.t, bb.l, bb.b, bb.r))
+        if bb.allow_neg_coord:
+            flags[i] = _ALLOW_NEG_COORD
+
+        fields = a.extra_fields
+        wps = fields.get("waypoints", None)
+        endpoints = None
+        if wps is not None:
+            wps = np.asarray(wps, dtype=np.float64).reshape(-1, 2)
+            n_waypoints[i] = len(wps)
+            waypoints.append(wps)
+            flags[i] |= _HAS_WAYPOINTS
+            if len(wps) > 0:
+                endpoints = {"tail": wps[0].tolist(), "head": wps[-1].tolist()}
+        for k, v in fields.items():
+            t = type(v)
+            if t is str:
+                if k not in strings:
+                    strings[k] = [None] * n
+                strings[k][i] = v
+            elif isinstance(v, Annotation) or (v is None and k in relations):
+                if k not in relations:
+                    relations[k] = np.full(n, _UNSET_IDX, dtype=np.int32)
+                relations[k][i] = _NONE_IDX if v is None else ann_to_idx[id(v)]
+            elif k == "waypoints" and wps is not None:
+                continue
+            elif endpoints is not None and k in endpoints and t is np.ndarray and v.tolist() == endpoints[k]:
+                flags[i] |= _TAIL_FROM_WAYPOINTS if k == "tail" else _HEAD_FROM_WAYPOINTS
+            else:
+                other_fields.append((i, k, v))
+
+    # None values of relations that were only seen after the None value
+    other_fields = _move_none_relations(other_fields, relations)
+
+    offsets = np.concatenate([[0], np.cumsum(n_waypoints)])
+    buffers = {
+        "category_codes": np.array(category_codes, dtype=np.uint8 if len(cat_to_code) <= 256 else np.int32),
+        "boxes": _pack_floats(np.array(boxes, dtype=np.float64).reshape(n, 4)),
+        "waypoint_offsets": offsets.astype(np.int32 if offsets[-1] < 2 ** 31 else np.int64),
+        "waypoints": _pack_floats(np.concatenate(waypoints) if len(waypoints) > 0 else np.zeros((0, 2))),
+        "flags": flags,
+    }
+    for k, idxs in relations.items():
+        buffers[f"rel:{k}"] = idxs
+    for k, values in strings.items():
+        buffers[f"mask:{k}"] = np.array([v is not None for v in values], dtype=np.uint8)
+        buffers[f"str:{k}"] = "\0".join(v for v in values if v is not None).encode("utf-8")
+    if len(other_fields) > 0:
+        buffers["pickled"] = pickle.dumps(other_fields, protocol=pickle.HIGHEST_PROTOCOL)
+
+    header = {"n": n, "categories": list(cat_to_code), "relations": list(relations), "strings": list(strings),
+              "buffers": []}
+    chunks = []
+    offset = 0
+    for name, buf in buffers.items():
+        if isinstance(buf, np.ndarray):
+            meta = {"name": name, "dtype": buf.dtype.str, "shape": list(buf.shape)}
+            buf = buf.tobytes()
+        else:
+            meta = {"name": name}
+        pad = -offset % _ALIGN
+        chunks.append(b"\0" * pad)
+        offset += pad
+        meta.update(offset=offset, size=len(buf))
+        header["buffers"].append(meta)
+        chunks.append(buf)
+        offset += len(buf)
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    # the buffer offsets are relative to the (aligned) end of the header
+    header_end = _PREFIX.size + len(header_bytes)
+    header_pad = b" " * (-header_end % _ALIGN)
+    return b"".join([_PREFIX.pack(_MAGIC, _VERSION, len(header_bytes) + len(header_pad)), header_bytes, header_pad,
+                     *chunks])
+
+
+def loads_columns(data: bytes) -> DiagramColumns:
+    """:return: columnar view of the annotations serialized with dumps, without creating Annotation objects"""
+    return _columns(*_read(data))
+
+
+def _columns(header: Dict, buffers: Dict[str, np.ndarray]) -> DiagramColumns:
+    n = header["n"]
+    categories = header["categories"]
+
+    strings = {}
+    for k in header["strings"]:
+        values = iter(bytes(buffers[f"str:{k}"]).decode("utf-8").split("\0"))
+        strings[k] = [next(values) if present else None for present in buffers[f"mask:{k}"].tolist()]
+
+    return DiagramColumns(
+        categories=[categories[c] for c in buffers["category_codes"].tolist()],
+        boxes=buffers["boxes"].reshape(n, 4).astype(np.float64, copy=False),
+        waypoint_offsets=buffers["waypoint_offsets"],
+        waypoints=buffers["waypoints"].reshape(-1, 2).astype(np.float64, copy=False),
+        relations={k: buffers[f"rel:{k}"] for k in header["relations"]},
+        strings=strings,
+    )
+
+
+def loads(data: bytes) -> List[Annotation]:
+    """:return: the annotations serialized with dumps, with relations linking the returned annotations"""
+    header, buffers = _read(data)
+    cols = _columns(header, buffers)
+
+    boxes = cols.boxes.tolist()
+    flags = buffers["flags"].tolist()
+    bbs = [BoundingBox(*box, allow_neg_coord=bool(f & _ALLOW_NEG_COORD)) for box, f in zip(boxes, flags)]
+    fields = [{} for _ in flags]
+    for k, values in cols.strings.items():
+        for fs, v in zip(fields, values):
+            if v is not None:
+                fs[k] = v
+
+    # one writable copy, the waypoints of each annotation are views into it
+    waypoints = np.array(cols.waypoints)
+    offsets = cols.waypoint_offsets.tolist()
+    for i, f in enumerate(flags):
+        if f & _HAS_WAYPOINTS:
+            wps = waypoints[offsets[i]:offsets[i + 1]]
+            fields[i]["waypoints"] = wps
+            if f & _TAIL_FROM_WAYPOINTS:
+                fields[i]["tail"] = wps[0]
+            if f & _HEAD_FROM_WAYPOINTS:
+                fields[i]["head"] = wps[-1]
+
+    anns = [Annotation(c, bb, **fs) for c, bb, fs in zip(cols.categories, bbs, fields)]
+    for k, idxs in cols.relations.items():
+        is_set = idxs != _UNSET_IDX
+        for i, j in zip(np.flatnonzero(is_set).tolist(), idxs[is_set].tolist()):
+            anns[i].set(k, None if j == _NONE_IDX else anns[j])
+
+    if "pickled" in buffers:
+        for i, k, v in pickle.loads(buffers["pickled"]):
+            anns[i].set(k, v)
+    return anns
+
+
+def _pack_floats(arr: np.ndarray) -> np.ndarray:
+    """:return: arr as float32 if that does not lose precision (e.g. integer coordinates), else as float64"""
+    arr32 = arr.astype(np.float32)
+    return arr32 if np.array_equal(arr32, arr) else arr
+
+
+def _read(data: bytes) -> Tuple[Dict, Dict[str, np.ndarray]]:
+    magic, version, header_len = _PREFIX.unpack_from(data)
+    if magic != _MAGIC:
+        raise ValueError("Not a serialized annotation buffer")
+    if version != _VERSION:
+        raise ValueError(f"Unsupported serialization version: {version}")
+    header = json.loads(bytes(data[_PREFIX.size:_PREFIX.size + header_len]))
+    start = _PREFIX.size + header_len
+
+    buffers = {}
+    for meta in header["buffers"]:
+        offset = start + meta["offset"]
+        if "dtype" in meta:
+            arr = np.frombuffer(data, dtype=np.dtype(meta["dtype"]), count=int(np.prod(meta["shape"])), offset=offset)
+            buffers[meta["name"]] = arr.reshape(meta["shape"])
+        else:
+            buffers[meta["name"]] = memoryview(data)[offset:offset + meta["size"]]
+    return header, buffers
+
+
+def _move_none_relations(other_fields: List[Tuple[int, str, object]],
+                         relations: Dict[str, np.ndarray]) -> List[Tuple[int, str, object]]:
+    remaining = []
+    for i, k, v in other_fields:
+        if v is None and k in relations:
+            relations[k][i] = _NONE_IDX
+        else:
+            remaining.append((i, k, v))
+    return remaining
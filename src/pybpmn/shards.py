@@ -0,0 +1,241 @@
+import bisect
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Union
+
+import numpy as np
+from joblib import Parallel, delayed
+from PIL import Image
+from yamlu.coco import Dataset
+from yamlu.img import AnnotatedImage, Annotation, BoundingBox
+
+_logger = logging.getLogger(__name__)
+
+_META_FILENAME = "meta.json"
+_PIXELS_FILENAME = "pixels.bin"
+# arrays saved as .npy files in each shard directory
+_ARRAY_NAMES = ("img_offsets", "img_shapes", "scales", "ann_offsets", "boxes", "categories", "keypoints", "relations")
+
+
+class ShardSample(NamedTuple):
+    filename: str
+    # (h, w, 3) uint8 view into the memory-mapped pixels of the shard
+    img: np.ndarray
+    # (n, 4) float32 boxes as (t, l, b, r) in coordinates of the resized image
+    boxes: np.ndarray
+    # (n,) int16 coco category ids
+    categories: np.ndarray
+    # (n, len(keypoint_fields), 2) float32 keypoints as (x, y), nan if the annotation has no such keypoint
+    keypoints: np.ndarray
+    # (n, len(relation_fields)) int32 index of the related annotation in the same image, -1 if not set
+    relations: np.ndarray
+    # factor that the image and annotations were scaled with
+    scale: float
+
+
+def compile_split(
+        ds: Dataset,
+        split: str,
+        shards_root: Union[Path, str],
+        target_max_size: int = 1333,
+        shard_size: int = 256,
+        n_jobs: int = 1,
+) -> Path:
+    """
+    Parses all images of a split once and writes them into shards that can be read with ShardReader,
+    so that training epochs do not have to parse the BPMN XML and decode the images again.
+    Each shard directory contains the resized RGB pixels of its images in one flat binary file
+    and the annotations of all images as contiguous arrays with per-image offsets.
+    :param ds: e.g. a BpmnDataset
+    :param target_max_size: images are downscaled such that their larger side is at most target_max_size
+    :param shard_size: number of images per shard
+    :param n_jobs: number of shards that are compiled in parallel
+    :return: the directory of the compiled split
+    """
+    split_root = Path(shards_root) / split
+    split_root.mkdir(exist_ok=True, parents=True)
+
+    n_imgs = ds.split_n_imgs[split]
+    shard_idxs = [list(range(start, min(start + shard_size, n_imgs))) for start in range(0, n_imgs, shard_size)]
+    shard_names = [f"shard_{i:05d}" for i in range(len(shard_idxs))]
+    _logger.info("%s: compiling %d images of split=%s into %d shards", ds.name, n_imgs, split, len(shard_names))
+
+    parallel = Parallel(n_jobs=n_jobs)
+    parallel(delayed(_compile_shard)(ds, split, idxs, split_root / name, target_max_size)
+             for idxs, name in zip(shard_idxs, shard_names))
+
+    meta = {
+        "split": split,
+        "target_max_size": target_max_size,
+        "categories": ds.coco_categories,
+        "keypoint_fields": list(ds.keypoint_fields),
+        "relation_fields": list(ds.relation_fields),
+        "shards": [{"name": name, "n_imgs": len(idxs)} for idxs, name in zip(shard_idxs, shard_names)],
+    }
+    (split_root / _META_FILENAME).write_text(json.dumps(meta, indent=2))
+    return split_root
+
+
+def _compile_shard(ds: Dataset, split: str, idxs: List[int], shard_path: Path, target_max_size: int):
+    shard_path.mkdir(exist_ok=True, parents=True)
+
+    filenames = []
+    arrays = {k: [] for k in ["img_shapes", "scales", "boxes", "categories", "keypoints", "relations"]}
+    img_offsets = [0]
+    ann_offsets = [0]
+    # images are streamed to disk, only the (small) annotation arrays of the shard are kept in memory
+    with (shard_path / _PIXELS_FILENAME).open("wb") as f:
+        for idx in idxs:
+            ai = ds.get_split_ann_img(split, idx)
+            img, scale = _resize_img(ai.img, target_max_size)
+            pixels = np.asarray(img, dtype=np.uint8)
+            f.write(pixels.tobytes())
+
+            filenames.append(ai.filename)
+            img_offsets.append(img_offsets[-1] + pixels.size)
+            ann_offsets.append(ann_offsets[-1] + len(ai.annotations))
+            arrays["img_shapes"].append(pixels.shape)
+            arrays["scales"].append(scale)
+            for k, v in _anns_to_arrays(ai.annotations, ds, scale).items():
+                arrays[k].append(v)
+
+    np.save(shard_path / "img_offsets.npy", np.array(img_offsets, dtype=np.int64))
+    np.save(shard_path / "ann_offsets.npy", np.array(ann_offsets, dtype=np.int64))
+    np.save(shard_path / "img_shapes.npy", np.array(arrays["img_shapes"], dtype=np.int32).reshape(-1, 3))
+    np.save(shard_path / "scales.npy", np.array(arrays["scales"], dtype=np.float64))
+    n_kps, n_rels = len(ds.keypoint_fields), len(ds.relation_fields)
+    np.save(shard_path / "boxes.npy", _concat(arrays["boxes"], (0, 4), np.float32))
+    np.save(shard_path / "categories.npy", _concat(arrays["categories"], (0,), np.int16))
+    np.save(shard_path / "keypoints.npy", _concat(arrays["keypoints"], (0, n_kps, 2), np.float32))
+    np.save(shard_path / "relations.npy", _concat(arrays["relations"], (0, n_rels), np.int32))
+    (shard_path / _META_FILENAME).write_text(json.dumps({"filenames": filenames}))
+
+
+def _resize_img(img: Image.Image, target_max_size: int):
+    img = img.convert("RGB")
+    scale = min(1.0, target_max_size / max(img.size))
+    if scale < 1.0:
+        img = img.resize((round(img.width * scale), round(img.height * scale)), Image.BILINEAR)
+    return img, scale
+
+
+def _anns_to_arrays(anns: List[Annotation], ds: Dataset, scale: float) -> Dict[str, np.ndarray]:
+    ann_to_idx = {id(a): i for i, a in enumerate(anns)}
+
+    keypoints = np.full((len(anns), len(ds.keypoint_fields), 2), np.nan, dtype=np.float32)
+    relations = np.full((len(anns), len(ds.relation_fields)), -1, dtype=np.int32)
+    for i, a in enumerate(anns):
+        for j, field in enumerate(ds.keypoint_fields):
+            if field in a and a.get(field) is not None:
+                keypoints[i, j] = np.asarray(a.get(field)) * scale
+        for j, field in enumerate(ds.relation_fields):
+            related = a.get(field) if field in a else None
+            if isinstance(related, Annotation):
+                # the related annotation might have been excluded from the image
+                relations[i, j] = ann_to_idx.get(id(related), -1)
+
+    return {
+        "boxes": np.array([a.bb.tlbr for a in anns], dtype=np.float32).reshape(-1, 4) * scale,
+        "categories": np.array([ds.cat_name_to_id[a.category] for a in anns], dtype=np.int16),
+        "keypoints": keypoints,
+        "relations": relations,
+    }
+
+
+def _concat(arrays: List[np.ndarray], empty_shape, dtype) -> np.ndarray:
+    if len(arrays) == 0:
+        return np.zeros(empty_shape, dtype=dtype)
+    return np.concatenate(arrays).astype(dtype, copy=False)
+
+
+class ShardReader:
+    """
+    Random access to a split compiled with compile_split.
+    Shards are memory-mapped read-only on first access, so that many dataloader worker processes share the
+    same pages of the page cache. The reader can be pickled to worker processes before or after accessing it,
+    each process opens its own memory maps.
+    """
+
+    def __init__(self, split_root: Union[Path, str]):
+        self.split_root = Path(split_root)
+        meta = json.loads((self.split_root / _META_FILENAME).read_text())
+        self.split: str = meta["split"]
+        self.categories: List[Dict] = meta["categories"]
+        self.cat_id_to_name = {c["id"]: c["name"] for c in self.categories}
+        self.keypoint_fields: List[str] = meta["keypoint_fields"]
+        self.relation_fields: List[str] = meta["relation_fields"]
+
+        self.shard_names = [s["name"] for s in meta["shards"]]
+        # index of the first image of each shard
+        self._shard_starts = np.cumsum([0] + [s["n_imgs"] for s in meta["shards"]]).tolist()
+        self._shards: Dict[int, Dict[str, np.ndarray]] = {}
+        self._filenames: Dict[int, List[str]] = {}
+
+    def __len__(self):
+        return self._shard_starts[-1]
+
+    def __getitem__(self, idx: int) -> ShardSample:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"{idx} out of range for {len(self)} images")
+        shard_idx = bisect.bisect_right(self._shard_starts, idx) - 1
+        shard = self._shard(shard_idx)
+        i = idx - self._shard_starts[shard_idx]
+
+        img = shard["pixels"][shard["img_offsets"][i]:shard["img_offsets"][i + 1]].reshape(shard["img_shapes"][i])
+        ann_slice = slice(shard["ann_offsets"][i], shard["ann_offsets"][i + 1])
+        return ShardSample(
+            filename=self._filenames[shard_idx][i],
+            img=img,
+            boxes=shard["boxes"][ann_slice],
+            categories=shard["categories"][ann_slice],
+            keypoints=shard["keypoints"][ann_slice],
+            relations=shard["relations"][ann_slice],
+            scale=float(shard["scales"][i]),
+        )
+
+    def _shard(self, shard_idx: int) -> Dict[str, np.ndarray]:
+        shard = self._shards.get(shard_idx, None)
+        if shard is None:
+            shard_path = self.split_root / self.shard_names[shard_idx]
+            shard = {k: np.load(shard_path / f"{k}.npy", mmap_mode="r") for k in _ARRAY_NAMES}
+            pixels_path = shard_path / _PIXELS_FILENAME
+            # np.memmap does not support empty files
+            shard["pixels"] = np.memmap(pixels_path, dtype=np.uint8, mode="r") if pixels_path.stat().st_size > 0 \
+                else np.zeros(0, dtype=np.uint8)
+            self._filenames[shard_idx] = json.loads((shard_path / _META_FILENAME).read_text())["filenames"]
+            self._shards[shard_idx] = shard
+        return shard
+
+    def to_annotated_image(self, idx: int) -> AnnotatedImage:
+        """
+        Converts a sample back to a yamlu AnnotatedImage, e.g. for plotting.
+        Only category, bounding box, keypoint and relation fields are restored.
+        """
+        s = self[idx]
+        anns = [
+            Annotation(self.cat_id_to_name[int(cat)], BoundingBox(*box, allow_neg_coord=True))
+            for cat, box in zip(s.categories, s.boxes.tolist())
+        ]
+        for a, kps, rels in zip(anns, s.keypoints, s.relations.tolist()):
+            for field, kp in zip(self.keypoint_fields, kps):
+                if not np.isnan(kp).any():
+                    a.set(field, np.array(kp))
+            for field, j in zip(self.relation_fields, rels):
+                if j != -1:
+                    a.set(field, anns[j])
+
+        img = Image.fromarray(np.array(s.img))
+        return AnnotatedImage(s.filename, width=img.width, height=img.height, annotations=anns, img=img)
+
+    def __getstate__(self):
+        # memory maps are opened lazily in each process
+        state = self.__dict__.copy()
+        state["_shards"] = {}
+        state["_filenames"] = {}
+        return state
+
+    def __repr__(self):
+        return f"ShardReader({self.split_root}, {len(self)} images in {len(self.shard_names)} shards)"
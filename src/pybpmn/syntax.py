@@ -119,6 +119,8 @@ CATEGORY_GROUPS = {
 }
 
 ALL_CATEGORIES = [cat for cats in CATEGORY_GROUPS.values() for cat in cats]
+# stable integer codes for array-based representations (e.g. pybpmn.graph)
+CATEGORY_TO_CODE = {cat: i for i, cat in enumerate(ALL_CATEGORIES)}
 
 EVENT_CATEGORY_TO_NO_POS_TYPE = {
     **{k: "event" for k in UNTYPED_EVENTS},
@@ -0,0 +1,185 @@
+import logging
+import math
+from typing import NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from yamlu.img import AnnotatedImage
+
+from pybpmn.augment import DiagramGeometry
+from pybpmn.constants import ARROW_KEYPOINT_FIELDS
+
+_logger = logging.getLogger(__name__)
+
+
+class DiagramTargets(NamedTuple):
+    # (n_edges, H, W) polyline mask of each annotation with waypoints
+    edge_masks: np.ndarray
+    # (n_edges,) index of the annotation of each mask
+    edge_idxs: np.ndarray
+    # (len(ARROW_KEYPOINT_FIELDS), H, W) gaussian heatmaps of the tail and head keypoints
+    heatmaps: np.ndarray
+
+
+class BatchTargets(NamedTuple):
+    # (n_edges, H, W) polyline masks of the edges of all images, H and W of the largest image
+    edge_masks: np.ndarray
+    # (n_edges,) index of the image and of the annotation within the image of each mask
+    edge_img_idxs: np.ndarray
+    edge_idxs: np.ndarray
+    # (n_imgs, len(ARROW_KEYPOINT_FIELDS), H, W)
+    heatmaps: np.ndarray
+
+    def img_targets(self, img_idx: int, size: Tuple[int, int]) -> DiagramTargets:
+        """:param size: (width, height) of the targets of the image, see target_size"""
+        w, h = size
+        is_img = self.edge_img_idxs == img_idx
+        return DiagramTargets(self.edge_masks[is_img, :h, :w], self.edge_idxs[is_img],
+                              self.heatmaps[img_idx, :, :h, :w])
+
+
+def target_size(width: int, height: int, stride: int) -> Tuple[int, int]:
+    """:return: (width, height) of the targets of an image with the given output stride"""
+    return math.ceil(width / stride), math.ceil(height / stride)
+
+
+def polyline_pixels(waypoints: np.ndarray, polyline_ids: np.ndarray, stride: float = 1,
+                    line_width: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Samples all polylines at once, at least twice per output pixel of each segment.
+    Output pixel (x, y) corresponds to the image coordinates (x * stride, y * stride).
+    :param waypoints: (m, 2) concatenated waypoints (x, y) of all polylines in image coordinates
+    :param polyline_ids: (m,) id of the polyline of each waypoint, consecutive waypoints with the same id are connected
+    :param line_width: width of the lines in output pixels
+    :return: (k, 2) integer pixels (x, y), possibly outside of the output, and (k,) polyline id of each pixel
+    """
+    pts = np.asarray(waypoints, dtype=np.float64).reshape(-1, 2) / stride
+    polyline_ids = np.asarray(polyline_ids)
+
+    # single waypoints are drawn as well
+    is_segment = polyline_ids[:-1] == polyline_ids[1:]
+    p0, p1 = pts[:-1][is_segment], pts[1:][is_segment]
+    n_samples = np.ceil(np.linalg.norm(p1 - p0, axis=1) * 2).astype(np.int64) + 1
+    seg_idxs = np.repeat(np.arange(len(p0)), n_samples)
+    sample_starts = np.repeat(np.cumsum(n_samples) - n_samples, n_samples)
+    t = (np.arange(len(seg_idxs)) - sample_starts) / np.repeat(np.maximum(n_samples - 1, 1), n_samples)
+    samples = p0[seg_idxs] + t[:, None] * (p1 - p0)[seg_idxs]
+
+    xy = np.rint(np.concatenate([pts, samples])).astype(np.int64)
+    ids = np.concatenate([polyline_ids, polyline_ids[:-1][is_segment][seg_idxs]])
+    if line_width > 1:
+        r = np.arange(line_width) - (line_width - 1) // 2
+        offsets = np.stack(np.meshgrid(r, r), axis=-1).reshape(-1, 2)
+        xy = (xy[:, None] + offsets).reshape(-1, 2)
+        ids = np.repeat(ids, len(offsets))
+    return xy, ids
+
+
+def rasterize_polylines(waypoints: np.ndarray, polyline_ids: np.ndarray, out: np.ndarray, stride: int = 1,
+                        line_width: int = 1):
+    """
+    Draws all polylines at once into out, see polyline_pixels.
+    :param polyline_ids: (m,) channel of out of each waypoint
+    :param out: (n, H, W) buffer, e.g. np.zeros((n, H, W), dtype=bool)
+    """
+    if len(waypoints) == 0:
+        return
+    xy, channels = polyline_pixels(waypoints, polyline_ids, stride, line_width)
+    _, h, w = out.shape
+    inside = (xy[:, 0] >= 0) & (xy[:, 0] < w) & (xy[:, 1] >= 0) & (xy[:, 1] < h)
+    out[channels[inside], xy[inside, 1], xy[inside, 0]] = 1
+
+
+def draw_gaussians(points: np.ndarray, channels: np.ndarray, out: np.ndarray, stride: int = 1, sigma: float = 2.0):
+    """
+    Draws a gaussian for each point into out, overlapping gaussians are combined with the maximum (like CenterNet).
+    :param points: (k, 2) points (x, y) in image coordinates
+    :param channels: (k,) or (k, out.ndim - 2) index into the leading axes of out of each point
+    :param out: (..., H, W) float buffer
+    :param sigma: standard deviation in output pixels
+    """
+    if len(points) == 0:
+        return
+    pts = np.asarray(points, dtype=np.float64) / stride
+    h, w = out.shape[-2:]
+    radius = max(1, math.ceil(3 * sigma))
+    r = np.arange(-radius, radius + 1)
+
+    # (k, d, d) window around each point
+    centers = np.rint(pts).astype(np.int64)
+    xs = centers[:, 0, None, None] + r[None, None, :]
+    ys = centers[:, 1, None, None] + r[None, :, None]
+    values = np.exp(-((xs - pts[:, 0, None, None]) ** 2 + (ys - pts[:, 1, None, None]) ** 2) / (2 * sigma ** 2))
+    xs, ys = np.broadcast_arrays(xs, ys)
+
+    channels = np.asarray(channels, dtype=np.int64).reshape(len(pts), -1)
+    channel_offsets = np.ravel_multi_index(tuple(channels.T), out.shape[:-2]) * (h * w)
+    flat_idxs = channel_offsets[:, None, None] + ys * w + xs
+    inside = (xs >= 0) & (xs < w) & (ys >= 0) & (ys < h)
+    np.maximum.at(out.reshape(-1), flat_idxs[inside], values[inside].astype(out.dtype))
+
+
+def batch_targets(
+        ais: Sequence[AnnotatedImage],
+        stride: int = 4,
+        line_width: int = 1,
+        sigma: float = 2.0,
+        out: Optional[BatchTargets] = None,
+) -> BatchTargets:
+    """
+    Rasterizes the edge polylines (from their waypoints) and the tail/head keypoint heatmaps of all images at once.
+    :param out: preallocated buffers that are large enough, e.g. from a previous batch, they are cleared
+    """
+    geometries = [DiagramGeometry.from_anns(ai.annotations) for ai in ais]
+    sizes = [target_size(ai.width, ai.height, stride) for ai in ais]
+    w = max((s[0] for s in sizes), default=0)
+    h = max((s[1] for s in sizes), default=0)
+
+    edge_img_idxs, edge_idxs = [], []
+    for img_idx, g in enumerate(geometries):
+        idxs = np.flatnonzero(np.diff(g.waypoint_offsets) > 0)
+        edge_img_idxs.append(np.full(len(idxs), img_idx, dtype=np.int64))
+        edge_idxs.append(idxs)
+    edge_img_idxs = np.concatenate(edge_img_idxs) if len(ais) > 0 else np.zeros(0, dtype=np.int64)
+    edge_idxs = np.concatenate(edge_idxs) if len(ais) > 0 else np.zeros(0, dtype=np.int64)
+    n_edges = len(edge_idxs)
+
+    n_kps = len(ARROW_KEYPOINT_FIELDS)
+    if out is None:
+        edge_masks = np.zeros((n_edges, h, w), dtype=bool)
+        heatmaps = np.zeros((len(ais), n_kps, h, w), dtype=np.float32)
+    else:
+        edge_masks = _buffer(out.edge_masks, (n_edges, h, w))
+        heatmaps = _buffer(out.heatmaps, (len(ais), n_kps, h, w))
+
+    waypoints = [g.waypoints for g in geometries]
+    wp_counts = np.concatenate([np.diff(g.waypoint_offsets) for g in geometries]) if len(ais) > 0 else []
+    wp_counts = np.asarray(wp_counts, dtype=np.int64)
+    # waypoints of the i-th edge are drawn into channel i
+    polyline_ids = np.repeat(np.arange(n_edges), wp_counts[wp_counts > 0])
+    rasterize_polylines(np.concatenate(waypoints) if n_edges > 0 else np.zeros((0, 2)), polyline_ids, edge_masks,
+                        stride, line_width)
+
+    kps = [g.keypoints.reshape(-1, 2) for g in geometries]
+    kp_channels = [np.stack([np.full(len(g.keypoints) * n_kps, img_idx), np.tile(np.arange(n_kps), len(g.keypoints))],
+                            axis=1) for img_idx, g in enumerate(geometries)]
+    if len(ais) > 0:
+        kps, kp_channels = np.concatenate(kps), np.concatenate(kp_channels)
+        has_kp = ~np.isnan(kps).any(axis=1)
+        draw_gaussians(kps[has_kp], kp_channels[has_kp], heatmaps, stride, sigma)
+
+    return BatchTargets(edge_masks, edge_img_idxs, edge_idxs, heatmaps)
+
+
+def diagram_targets(ai: AnnotatedImage, stride: int = 4, line_width: int = 1, sigma: float = 2.0) -> DiagramTargets:
+    """see batch_targets"""
+    targets = batch_targets([ai], stride, line_width, sigma)
+    return targets.img_targets(0, target_size(ai.width, ai.height, stride))
+
+
+def _buffer(buf: np.ndarray, shape: Tuple[int, ...]) -> np.ndarray:
+    """:return: zeroed view of the first elements of buf with the given shape"""
+    size = int(np.prod(shape))
+    assert buf.size >= size, f"buffer of size {buf.size} too small for {shape}"
+    view = buf.reshape(-1)[:size].reshape(shape)
+    view[...] = 0
+    return view
@@ -0,0 +1,102 @@
+import logging
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Tuple
+
+import numpy as np
+from yamlu.img import AnnotatedImage, Annotation, BoundingBox
+
+from pybpmn.augment import DiagramGeometry, relink_subset_
+from pybpmn.constants import ARROW_KEYPOINT_FIELDS
+
+_logger = logging.getLogger(__name__)
+
+
+class Tile(NamedTuple):
+    # cropped image with the annotations that overlap the tile, in tile coordinates
+    ai: AnnotatedImage
+    # region of the tile in the source image
+    ltrb: Tuple[int, int, int, int]
+    # index of each tile annotation in the annotations of the source image
+    ann_idxs: np.ndarray
+    # fraction of the box of each tile annotation that is within the tile
+    visibility: np.ndarray
+
+
+def tile_grid(width: int, height: int, tile_size: int, overlap: int) -> np.ndarray:
+    """
+    :return: (n, 4) tiles as (l, t, r, b) that cover the image, neighboring tiles overlap by at least overlap pixels.
+             The last tile of each row and column ends at the image border, tiles are smaller than tile_size only if
+             the image is.
+    """
+    assert 0 <= overlap < tile_size, f"overlap={overlap} has to be smaller than tile_size={tile_size}"
+    xs = _tile_starts(width, tile_size, tile_size - overlap)
+    ys = _tile_starts(height, tile_size, tile_size - overlap)
+    ls, ts = np.meshgrid(xs, ys)
+    ls, ts = ls.reshape(-1), ts.reshape(-1)
+    return np.stack([ls, ts, np.minimum(ls + tile_size, width), np.minimum(ts + tile_size, height)], axis=1)
+
+
+def iter_tiles(ai: AnnotatedImage, tile_size: int = 1024, overlap: int = 256,
+               min_visible: float = 0.0) -> Iterator[Tile]:
+    """
+    Lazily crops an AnnotatedImage (e.g. of BpmnParser.parse_bpmn_img) into overlapping tiles (see tile_grid).
+    For each tile, the overlap with all annotations is computed at once and the tile gets the annotations whose
+    box is more than min_visible within the tile. Boxes are clipped to the tile (like BoundingBox.clip_to_image),
+    waypoints and head/tail keypoints are clamped to the tile. Relations are kept if both annotations are in the tile,
+    otherwise they are removed (pool is set to None).
+    :param min_visible: minimum fraction of the box of an annotation that has to be within a tile
+    """
+    tiles = tile_grid(ai.width, ai.height, tile_size, overlap)
+    geometry = DiagramGeometry.from_anns(ai.annotations)
+    offsets = geometry.waypoint_offsets.tolist()
+    stem, suffix = Path(ai.filename).stem, Path(ai.filename).suffix
+
+    for tile in tiles.tolist():
+        l, t, r, b = tile
+        tile_visibility = _visibility(geometry.boxes, tile)
+        w, h = r - l, b - t
+        ann_idxs = np.flatnonzero(tile_visibility > min_visible)
+        boxes = geometry.boxes[ann_idxs] - [t, l, t, l]
+        boxes = np.clip(boxes, 0, [h, w, h, w]).tolist()
+        waypoints = np.clip(geometry.waypoints - [l, t], 0, [w, h])
+        keypoints = np.clip(geometry.keypoints[ann_idxs] - [l, t], 0, [w, h])
+
+        new_anns = {}
+        for i, ann_idx in enumerate(ann_idxs.tolist()):
+            a = ai.annotations[ann_idx]
+            fields = a.extra_fields
+            if "waypoints" in fields:
+                fields["waypoints"] = waypoints[offsets[ann_idx]:offsets[ann_idx + 1]].copy()
+            for j, field in enumerate(ARROW_KEYPOINT_FIELDS):
+                if fields.get(field, None) is not None:
+                    fields[field] = keypoints[i, j].copy()
+            new_anns[id(a)] = Annotation(a.category, BoundingBox(*boxes[i], allow_neg_coord=True), **fields)
+        relink_subset_(new_anns)
+
+        img = ai.img.crop(tile) if ai.img is not None else None
+        tile_ai = AnnotatedImage(f"{stem}_{l}_{t}{suffix}", width=w, height=h, annotations=list(new_anns.values()),
+                                 img=img)
+        yield Tile(tile_ai, (l, t, r, b), ann_idxs, tile_visibility[ann_idxs])
+
+
+def _tile_starts(size: int, tile_size: int, stride: int) -> np.ndarray:
+    if size <= tile_size:
+        return np.zeros(1, dtype=np.int64)
+    starts = np.arange(0, size - tile_size, stride)
+    return np.append(starts, size - tile_size)
+
+
+def _visibility(boxes: np.ndarray, tile: List[int]) -> np.ndarray:
+    """
+    :param boxes: (n, 4) boxes as (t, l, b, r)
+    :param tile: (l, t, r, b)
+    :return: (n,) fraction of each box that is within the tile, for boxes without area 1 if the box is in the tile
+    """
+    t, l, b, r = boxes.T
+    tl, tt, tr, tb = tile
+    inter_w = np.minimum(r, tr) - np.maximum(l, tl)
+    inter_h = np.minimum(b, tb) - np.maximum(t, tt)
+    area = (r - l) * (b - t)
+    inter_area = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(area > 0, inter_area / area, ((inter_w >= 0) & (inter_h >= 0)).astype(np.float64))
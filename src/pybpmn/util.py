@@ -1,11 +1,17 @@
+from __future__ import annotations
+
 import json
 import re
 from pathlib import Path
-from typing import Tuple
+from typing import TYPE_CHECKING, List, Tuple, Union
+
+if TYPE_CHECKING:
+    import numpy as np
+    # noinspection PyProtectedMember
+    from lxml.etree import _Element as Element
+    from yamlu.img import BoundingBox
 
-# noinspection PyProtectedMember
-from lxml.etree import _Element as Element
-from yamlu.img import BoundingBox
+_CAMEL_CASE_SPLIT_RE = re.compile(r'(?=[A-Z])')
 
 
 def capitalize_fc(s: str):
@@ -14,25 +20,45 @@ def capitalize_fc(s: str):
 
 def split_camel_case(name: str) -> str:
     # e.g. "timerStartEvent" -> "Timer Start Event"
-    words = [word.capitalize() for word in re.split(r'(?=[A-Z])', capitalize_fc(name)) if word]
+    words = [word.capitalize() for word in _CAMEL_CASE_SPLIT_RE.split(capitalize_fc(name)) if word]
     return " ".join(words)
 
 
 def bounds_to_bb(bounds: Element) -> BoundingBox:
+    from yamlu.img import BoundingBox
     xywh = {k: to_int_or_float(bounds.get(k)) for k in ["x", "y", "width", "height"]}
     bb = BoundingBox.from_xywh(**xywh, allow_neg_coord=True)
     return bb
 
 
+def bounds_to_xywh(bounds: List[Element]) -> np.ndarray:
+    """:return: (n, 4) float array with x, y, width, height of each omgdc:Bounds element"""
+    import numpy as np
+    xywh = [[b.get(k) for k in ["x", "y", "width", "height"]] for b in bounds]
+    return np.array(xywh, dtype=np.float64).reshape(-1, 4)
+
+
+def waypoints_to_xy(waypoints: List[Element]) -> np.ndarray:
+    """:return: (n, 2) float array with x, y of each omgdi:waypoint element"""
+    import numpy as np
+    return np.array([[wp.get("x"), wp.get("y")] for wp in waypoints], dtype=np.float64).reshape(-1, 2)
+
+
 def to_int_or_float(s):
     v = float(s)
     return int(v) if v.is_integer() else v
 
 
-def parse_annotation_background_width(bpmn_path: Path):
-    """Get the width the image was resized to when annotating in the BPMN Annotator tool"""
-    assert bpmn_path.suffix == ".bpmn", f"{bpmn_path}"
-    img_meta_line = bpmn_path.read_text().split("\n")[1]
+def parse_annotation_background_width(bpmn_path: Union[Path, bytes]):
+    """
+    Get the width the image was resized to when annotating in the BPMN Annotator tool
+    :param bpmn_path: path to the BPMN XML file or its content
+    """
+    if isinstance(bpmn_path, bytes):
+        img_meta_line = bpmn_path.split(b"\n", 2)[1].decode()
+    else:
+        assert bpmn_path.suffix == ".bpmn", f"{bpmn_path}"
+        img_meta_line = bpmn_path.read_text().split("\n")[1]
     assert img_meta_line.startswith(
         "<!--"
     ), f"{bpmn_path} has no meta line, line 1: {img_meta_line}"
@@ -1,11 +1,12 @@
-import functools
+import hashlib
+import json
 import logging
 import math
 import os
 import subprocess
 import tempfile
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 import numpy as np
 import yamlu
@@ -17,7 +18,7 @@ from yamlu import img_ops
 from yamlu.img import BoundingBox
 
 from pybpmn.constants import NS_MAP
-from pybpmn.util import bounds_to_bb, to_int_or_float, parse_annotation_background_width
+from pybpmn.util import bounds_to_xywh, parse_annotation_background_width, waypoints_to_xy
 
 _logger = logging.getLogger(__name__)
 
@@ -60,11 +61,64 @@ def bpmn_to_image(bpmn_path: Path, png_path: Path, shift_to_origin=False):
     return img
 
 
+class RenderCache:
+    """
+    Content-addressed cache of bpmn_to_image renderings, keyed by the hash of the BPMN XML and the render options.
+    Rendered images are stored as RGBA PNGs in cache_dir. When the cache exceeds max_bytes,
+    the least recently used images are evicted (file mtimes are updated on each access).
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int = 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(exist_ok=True, parents=True)
+
+    @staticmethod
+    def key(bpmn_content: bytes, **render_kwargs) -> str:
+        h = hashlib.sha256(bpmn_content)
+        h.update(json.dumps(render_kwargs, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def render(self, bpmn_path: Path, shift_to_origin=False) -> Image.Image:
+        """
+        Cached version of bpmn_to_image
+        """
+        png_path = self.cache_dir / f"{self.key(bpmn_path.read_bytes(), shift_to_origin=shift_to_origin)}.png"
+        if png_path.exists():
+            _logger.debug("%s: using cached rendering %s", bpmn_path, png_path.name)
+            os.utime(png_path)
+            with Image.open(png_path) as img:
+                img.load()
+                return img
+
+        with tempfile.TemporaryDirectory(dir=self.cache_dir) as tmpdirname:
+            tmp_png_path = Path(tmpdirname) / f"{bpmn_path.stem}.png"
+            img = bpmn_to_image(bpmn_path, png_path=tmp_png_path, shift_to_origin=shift_to_origin)
+            img.load()
+            # atomic, in case multiple processes render the same diagram
+            os.replace(tmp_png_path, png_path)
+        self.evict()
+        return img
+
+    def evict(self):
+        png_paths = [(p.stat(), p) for p in self.cache_dir.glob("*.png")]
+        total_bytes = sum(stat.st_size for stat, _ in png_paths)
+        for stat, p in sorted(png_paths, key=lambda t: t[0].st_mtime):
+            if total_bytes <= self.max_bytes:
+                break
+            p.unlink(missing_ok=True)
+            total_bytes -= stat.st_size
+
+
 class Visualizer:
-    def __init__(self, img: Image.Image, color="orange", alpha=1.0):
+    def __init__(self, img: Image.Image, color="orange", alpha=1.0, render_cache: Optional[RenderCache] = None):
+        """
+        :param render_cache: if given, BPMN renderings are reused across create_bpmn_overlay_img calls
+        """
         self.img = img
         self.color = color
         self.alpha = alpha
+        self.render_cache = render_cache
 
     @classmethod
     def from_img_path(cls, img_path: Path, **kwargs):
@@ -72,8 +126,11 @@ class Visualizer:
         return cls(img, **kwargs)
 
     def create_bpmn_overlay_img(self, bpmn_path: Path):
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            img_bpmn = bpmn_to_image(bpmn_path, png_path=Path(tmpdirname) / f"{bpmn_path.stem}.png")
+        if self.render_cache is not None:
+            img_bpmn = self.render_cache.render(bpmn_path)
+        else:
+            with tempfile.TemporaryDirectory() as tmpdirname:
+                img_bpmn = bpmn_to_image(bpmn_path, png_path=Path(tmpdirname) / f"{bpmn_path.stem}.png")
         img_w = parse_annotation_background_width(bpmn_path)
         return self.create_overlayed_hw_img(img_bpmn, img_w=img_w)
 
@@ -113,22 +170,15 @@ def _get_approx_bpmn_bounding_box(bpmn_path):
     root = document.getroot()
 
     diagram = root.find("bpmndi:BPMNDiagram", NS_MAP)
-    shape_bounds = diagram.findall(".//bpmndi:BPMNShape/omgdc:Bounds", NS_MAP)
-    shape_bbs = [bounds_to_bb(bound) for bound in shape_bounds]
+    shape_xywh = bounds_to_xywh(diagram.findall(".//bpmndi:BPMNShape/omgdc:Bounds", NS_MAP))
 
-    lbl_bounds = diagram.findall(".//bpmndi:BPMNLabel/omgdc:Bounds", NS_MAP)
-    lbl_bbs = [bounds_to_bb(bound) for bound in lbl_bounds]
-    for lbl_bb in lbl_bbs:
-        # bpmn-js seems to align font vertically to top, and horizontally to center
-        # since font is typically much smaller than handwriting, cut lower part of box as a heuristic
-        lbl_bb.b = lbl_bb.tb_mid
+    lbl_xywh = bounds_to_xywh(diagram.findall(".//bpmndi:BPMNLabel/omgdc:Bounds", NS_MAP))
+    # bpmn-js seems to align font vertically to top, and horizontally to center
+    # since font is typically much smaller than handwriting, cut lower part of box as a heuristic
+    lbl_xywh[:, 3] /= 2
 
-    waypoints = diagram.findall(".//omgdi:waypoint", NS_MAP)
-    pts = np.array([[to_int_or_float(wp.get("x")), to_int_or_float(wp.get("y"))] for wp in waypoints])
-    pts_bbs = [BoundingBox.from_points(pts, allow_neg_coord=True)] if len(pts) > 0 else []
-
-    bb = functools.reduce(lambda bb1, bb2: bb1.union(bb2), [*shape_bbs, *lbl_bbs, *pts_bbs])
-    return bb
+    pts = waypoints_to_xy(diagram.findall(".//omgdi:waypoint", NS_MAP))
+    return _union_bb(np.concatenate([shape_xywh, lbl_xywh]), pts)
 
 
 def get_bpmn_bounding_box(bpmn_path):
@@ -139,13 +189,18 @@ def get_bpmn_bounding_box(bpmn_path):
     document = etree.parse(str(bpmn_path))
 
     bounds, waypoints = get_bpmn_bounds_waypoints(document)
+    return _union_bb(bounds_to_xywh(bounds), waypoints_to_xy(waypoints))
 
-    pts = np.array([[to_int_or_float(wp.get("x")), to_int_or_float(wp.get("y"))] for wp in waypoints])
-    pts_bbs = [BoundingBox.from_points(pts, allow_neg_coord=True)] if len(pts) > 0 else []
 
-    bounds_bbs = [bounds_to_bb(bound) for bound in bounds]
-    bb = functools.reduce(lambda bb1, bb2: bb1.union(bb2), bounds_bbs + pts_bbs)
-    return bb
+def _union_bb(xywh: np.ndarray, pts: np.ndarray) -> BoundingBox:
+    """
+    :return: union of the (n, 4) boxes and the bounding box of the (m, 2) points (see BoundingBox.from_points)
+    """
+    assert len(xywh) + len(pts) > 0, "diagram has neither bounds nor waypoints"
+    lt = np.concatenate([xywh[:, :2], pts]).min(axis=0)
+    rb = np.concatenate([xywh[:, :2] + xywh[:, 2:], pts + 1]).max(axis=0)
+    l, t, r, b = (*lt.tolist(), *rb.tolist())
+    return BoundingBox(t, l, b, r, allow_neg_coord=True)
 
 
 def get_bpmn_bounds_waypoints(document) -> Tuple[List[Element], List[Element]]:
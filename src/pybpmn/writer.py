@@ -0,0 +1,414 @@
+from __future__ import annotations
+
+import functools
+import io
+import json
+import logging
+from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO, Dict, List, Optional, Tuple, Union
+
+from lxml import etree
+
+from pybpmn import syntax
+from pybpmn.constants import (
+    ARROW_NEXT_REL,
+    ARROW_PREV_REL,
+    ARROW_RELATIONS,
+    NS_MAP,
+    NS_MODEL,
+    RELATIONS,
+    TEXT_BELONGS_TO_REL,
+)
+from pybpmn.parser import get_category
+from pybpmn.util import capitalize_fc
+
+if TYPE_CHECKING:
+    from yamlu.img import Annotation
+
+_logger = logging.getLogger(__name__)
+
+_MODEL = f"{{{NS_MODEL}}}"
+_BPMNDI = f"{{{NS_MAP['bpmndi']}}}"
+_OMGDC = f"{{{NS_MAP['omgdc']}}}"
+_OMGDI = f"{{{NS_MAP['omgdi']}}}"
+_EXPORTER = "pybpmn"
+
+# fields that are written as XML structure (or not at all) instead of as attributes of the model element
+_STRUCTURAL_FIELDS = {"id", "pool", "lane", "waypoints", "tail", "head", "bpmn_id", *RELATIONS}
+_EDGE_CATEGORIES = set(syntax.BPMNDI_EDGE_CATEGORIES)
+_ARTIFACT_CATEGORIES = set(syntax.ANNOTATION_SHAPE_CATEGORIES)
+_CONTAINER_CATEGORIES = set(syntax.ACTIVITIES_WITH_CHILD_SHAPES)
+
+_TAG_OVERRIDES = {
+    syntax.POOL: ("participant", ()),
+    syntax.INTERMEDIATE_EVENT: ("intermediateThrowEvent", ()),
+    syntax.TIMER_INTERMEDIATE_EVENT: ("intermediateCatchEvent", ("timer",)),
+    syntax.DATA_OBJECT: ("dataObjectReference", ()),
+    syntax.DATA_STORE: ("dataStoreReference", ()),
+    syntax.SUBPROCESS_COLLAPSED: ("subProcess", ()),
+    syntax.SUBPROCESS_EXPANDED: ("subProcess", ()),
+}
+_EVENT_TAGS = ["startEvent", "endEvent", "intermediateCatchEvent", "intermediateThrowEvent", "boundaryEvent"]
+
+
+def write_bpmn(anns: List[Annotation], out: Union[Path, str, BinaryIO], background_size: Optional[int] = None):
+    """
+    Writes annotations as BPMN 2.0 XML with diagram interchange (the inverse of BpmnParser.parse_bpmn_anns),
+    e.g. to save augmented or synthetic diagrams. The XML is written incrementally with lxml.etree.xmlfile.
+    Parsing the written file returns the same categories, geometry and relations (arrow_prev/arrow_next,
+    text_belongs_to, pool, lane) as anns, if anns were parsed without excluded categories.
+    With excluded categories, edges whose arrow_prev or arrow_next was excluded cannot be written as valid BPMN,
+    they are skipped (with their labels) and a warning is logged.
+
+    Model elements are placed by their relations: shapes into the process of their pool (or into the expanded
+    subprocess that contains them if they have no pool), data associations into the activity that they connect,
+    the names of labelled elements are taken from their label if they have none.
+    Other string fields are written as attributes of the model element, annotations without id get generated ids.
+    :param out: path or binary file object
+    :param background_size: written as meta comment on the second line, see parse_annotation_background_width
+    """
+    plan = _DefinitionsPlan(anns)
+    if isinstance(out, (Path, str)):
+        with open(out, "wb") as f:
+            _write(plan, f, background_size)
+    else:
+        _write(plan, out, background_size)
+
+
+def bpmn_bytes(anns: List[Annotation], background_size: Optional[int] = None) -> bytes:
+    """:return: the BPMN XML of write_bpmn, e.g. to parse it with BpmnParser.parse_bpmn_anns"""
+    f = io.BytesIO()
+    write_bpmn(anns, f, background_size)
+    return f.getvalue()
+
+
+def _write(plan: "_DefinitionsPlan", f: BinaryIO, background_size: Optional[int]):
+    # written directly, as xmlfile does not support text between the declaration and the root element
+    f.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+    if background_size is not None:
+        f.write(f"<!-- {json.dumps({'backgroundSize': background_size})} -->\n".encode())
+    with etree.xmlfile(f, encoding="UTF-8") as xf:
+        plan.write(xf)
+
+
+class _Node:
+    """model element that is written with xmlfile, cheaper to create than an lxml element"""
+    __slots__ = ("tag", "attrib", "children", "text", "parent")
+
+    def __init__(self, tag: str, attrib: Dict[str, str], text: Optional[str] = None):
+        self.tag = tag
+        self.attrib = attrib
+        self.children: List[_Node] = []
+        self.text = text
+        # set if the node is nested in another model element (e.g. a subprocess)
+        self.parent: Optional[_Node] = None
+
+    def append(self, node: "_Node"):
+        node.parent = self
+        self.children.append(node)
+
+    def write(self, xf):
+        with xf.element(self.tag, self.attrib):
+            if self.text is not None:
+                xf.write(self.text)
+            for child in self.children:
+                child.write(xf)
+
+
+class _DefinitionsPlan:
+    """model elements of a diagram, grouped by the collaboration or process that contains them"""
+
+    def __init__(self, anns: List[Annotation]):
+        non_labels = [a for a in anns if a.category != syntax.LABEL]
+        self.anns = _without_dangling_edges(non_labels)
+        skipped_ids = {id(a) for a in non_labels} - {id(a) for a in self.anns}
+        # extra fields of each annotation by id(annotation)
+        self.fields = {id(a): a.extra_fields for a in self.anns}
+        self.used_ids = {fields["id"] for fields in self.fields.values() if type(fields.get("id", None)) is str}
+        # id(annotation) -> model id
+        self.ids = {}
+        for i, a in enumerate(self.anns):
+            model_id = self.fields[id(a)].get("id", None)
+            self.ids[id(a)] = model_id if type(model_id) is str else self._new_id(f"{capitalize_fc(a.category)}_{i}")
+        self.has_pools = any(a.category == syntax.POOL for a in self.anns)
+        self.collaboration_id = self._new_id("Collaboration_1")
+        self.default_process_id: Optional[str] = None
+
+        # owner annotation -> label annotation
+        self.labels = {}
+        for a in anns:
+            if a.category != syntax.LABEL:
+                continue
+            owner = a.get(TEXT_BELONGS_TO_REL) if TEXT_BELONGS_TO_REL in a else None
+            if id(owner) in skipped_ids:
+                # label of a skipped edge
+                continue
+            if owner is None or isinstance(owner, str) or id(owner) not in self.ids:
+                raise ValueError(f"Label without text_belongs_to annotation: {a}")
+            self.labels[id(owner)] = a
+
+        self.collaboration: List[_Node] = []
+        # process id -> top level flow elements and artifacts, lanes
+        self.processes: Dict[str, List[_Node]] = {}
+        self.lanes: Dict[str, List[_Node]] = {}
+        self.nodes: Dict[int, _Node] = {}
+        shapes = [a for a in self.anns if a.category not in _EDGE_CATEGORIES]
+        edges = [a for a in self.anns if a.category in _EDGE_CATEGORIES]
+        # edges are placed relative to the shapes that they connect
+        for a in shapes + edges:
+            if a.category != syntax.DATA_ASSOCIATION:
+                self.nodes[id(a)] = self._create_node(a)
+        self._place_shapes(shapes)
+        for a in edges:
+            if a.category == syntax.DATA_ASSOCIATION:
+                self._place_data_association(a)
+            else:
+                self._place_edge(a, self.nodes[id(a)])
+
+    def _new_id(self, model_id: str) -> str:
+        i = 1
+        candidate = model_id
+        while candidate in self.used_ids:
+            i += 1
+            candidate = f"{model_id}_{i}"
+        self.used_ids.add(candidate)
+        return candidate
+
+    def _attributes(self, a: Annotation) -> Dict[str, str]:
+        attrib = {"id": self.ids[id(a)]}
+        for k, v in self.fields[id(a)].items():
+            if type(v) is str and k not in _STRUCTURAL_FIELDS:
+                attrib[k] = v
+        return attrib
+
+    def _create_node(self, a: Annotation) -> _Node:
+        category = a.category
+        tag, definitions = _category_to_tag(category)
+        attrib = self._attributes(a)
+        if category == syntax.TEXT_ANNOTATION:
+            attrib.pop("name", None)
+        elif "name" not in attrib and id(a) in self.labels:
+            attrib["name"] = self.labels[id(a)].name
+        if category in _EDGE_CATEGORIES:
+            attrib["sourceRef"] = self._ref(a, ARROW_PREV_REL)
+            attrib["targetRef"] = self._ref(a, ARROW_NEXT_REL)
+
+        node = _Node(_MODEL + tag, attrib)
+        for d in definitions:
+            node.append(_Node(f"{_MODEL}{d}EventDefinition", {}))
+        text = self.fields[id(a)].get("name", None)
+        if category == syntax.TEXT_ANNOTATION and text is not None:
+            node.append(_Node(f"{_MODEL}text", {}, text))
+        return node
+
+    def _ref(self, a: Annotation, rel: str) -> str:
+        target = self.fields[id(a)].get(rel, None)
+        if target is None:
+            raise ValueError(f"{a.category} without {rel}: {a}")
+        return target if isinstance(target, str) else self.ids[id(target)]
+
+    def _place_shapes(self, shapes: List[Annotation]):
+        containers = [a for a in shapes if a.category in _CONTAINER_CATEGORIES]
+        for a in shapes:
+            node = self.nodes[id(a)]
+            has_pool = "pool" in self.fields[id(a)]
+            container = _smallest_container(a, containers) if not has_pool and len(containers) > 0 else None
+            if a.category == syntax.POOL:
+                self.collaboration.append(node)
+            elif a.category == syntax.LANE:
+                self.lanes.setdefault(self._process_id(a), []).append(node)
+            elif container is not None:
+                # e.g. a task in an expanded subprocess
+                self.nodes[id(container)].append(node)
+            elif self.has_pools and not has_pool and a.category in _ARTIFACT_CATEGORIES:
+                self.collaboration.append(node)
+            else:
+                self.processes.setdefault(self._process_id(a), []).append(node)
+
+        # NOTE: like BpmnParser._link_lanes, lanes are written as top-level lanes
+        for a in shapes:
+            lane = self.fields[id(a)].get("lane", None)
+            if lane is not None:
+                self.nodes[id(lane)].append(_Node(f"{_MODEL}flowNodeRef", {}, self.ids[id(a)]))
+
+    def _place_edge(self, a: Annotation, node: _Node):
+        if a.category == syntax.MESSAGE_FLOW and self.has_pools:
+            self.collaboration.append(node)
+            return
+        fields = self.fields[id(a)]
+        ends = [fields[rel] for rel in ARROW_RELATIONS if not isinstance(fields[rel], str)]
+        if a.category == syntax.ASSOCIATION:
+            # associations are placed next to the artifact that they connect
+            ends.sort(key=lambda e: e.category not in _ARTIFACT_CATEGORIES)
+        for end in ends:
+            parent = self.nodes[id(end)].parent
+            if parent is not None:
+                # end is nested in a subprocess
+                parent.append(node)
+                return
+            if self.has_pools and "pool" not in end and end.category in _ARTIFACT_CATEGORIES:
+                self.collaboration.append(node)
+                return
+            if end.category not in syntax.COLLABORATION_CATEGORIES:
+                self.processes.setdefault(self._process_id(end), []).append(node)
+                return
+        self.processes.setdefault(self._process_id(a), []).append(node)
+
+    def _place_data_association(self, a: Annotation):
+        fields = self.fields[id(a)]
+        prev, next_ = fields.get(ARROW_PREV_REL, None), fields.get(ARROW_NEXT_REL, None)
+        if prev is None or next_ is None or isinstance(prev, str) or isinstance(next_, str):
+            raise ValueError(f"{a.category} without arrow_prev and arrow_next annotations: {a}")
+        # see _parse_edge_attribs: input associations are children of their target, output of their source
+        if prev.category in syntax.BUSINESS_OBJECT_CATEGORIES:
+            node = _Node(f"{_MODEL}dataInputAssociation", self._attributes(a))
+            node.append(_Node(f"{_MODEL}sourceRef", {}, self.ids[id(prev)]))
+            self.nodes[id(next_)].append(node)
+        else:
+            node = _Node(f"{_MODEL}dataOutputAssociation", self._attributes(a))
+            node.append(_Node(f"{_MODEL}targetRef", {}, self.ids[id(next_)]))
+            self.nodes[id(prev)].append(node)
+        self.nodes[id(a)] = node
+
+    def _process_id(self, a: Optional[Annotation]) -> str:
+        pool = self.fields[id(a)].get("pool", None) if a is not None else None
+        if isinstance(pool, str):
+            return pool
+        if pool is not None and "processRef" in pool:
+            return pool.processRef
+        if self.default_process_id is None:
+            self.default_process_id = self._new_id("Process_1")
+        return self.default_process_id
+
+    def write(self, xf):
+        plane_element = self.collaboration_id if self.has_pools else None
+        with xf.element(f"{_MODEL}definitions", nsmap=NS_MAP, id="Definitions_1",
+                        targetNamespace="http://bpmn.io/schema/bpmn", exporter=_EXPORTER):
+            if self.has_pools:
+                with xf.element(f"{_MODEL}collaboration", id=self.collaboration_id):
+                    for node in self.collaboration:
+                        node.write(xf)
+
+            # processes of pools without elements are written as well, as their pools reference them
+            process_refs = [n.attrib["processRef"] for n in self.collaboration if "processRef" in n.attrib]
+            process_ids = list(dict.fromkeys([*self.processes, *self.lanes, *process_refs]))
+            if len(process_ids) == 0 and not self.has_pools:
+                process_ids = [self._process_id(None)]
+            for process_id in process_ids:
+                plane_element = process_id if plane_element is None else plane_element
+                with xf.element(f"{_MODEL}process", id=process_id, isExecutable="false"):
+                    if process_id in self.lanes:
+                        with xf.element(f"{_MODEL}laneSet", id=f"LaneSet_{process_id}"):
+                            for node in self.lanes[process_id]:
+                                node.write(xf)
+                    for node in self.processes.get(process_id, []):
+                        node.write(xf)
+
+            with xf.element(f"{_BPMNDI}BPMNDiagram", id="BPMNDiagram_1"):
+                with xf.element(f"{_BPMNDI}BPMNPlane", id="BPMNPlane_1", bpmnElement=plane_element):
+                    for a in self.anns:
+                        self._write_di_element(xf, a)
+
+    def _write_di_element(self, xf, a: Annotation):
+        model_id = self.ids[id(a)]
+        label = self.labels.get(id(a), None)
+        category = a.category
+        if category in _EDGE_CATEGORIES:
+            with xf.element(f"{_BPMNDI}BPMNEdge", id=f"{model_id}_di", bpmnElement=model_id):
+                for x, y in self.fields[id(a)]["waypoints"].tolist():
+                    with xf.element(f"{_OMGDI}waypoint", x=_fmt(x), y=_fmt(y)):
+                        pass
+                if label is not None:
+                    _write_label(xf, label)
+            return
+
+        attrib = {"id": f"{model_id}_di", "bpmnElement": model_id}
+        if category == syntax.SUBPROCESS_EXPANDED:
+            attrib["isExpanded"] = "true"
+        elif category == syntax.POOL or category == syntax.LANE:
+            attrib["isHorizontal"] = "true"
+        with xf.element(f"{_BPMNDI}BPMNShape", attrib):
+            _write_bounds(xf, a)
+            if label is not None:
+                _write_label(xf, label)
+
+
+def _write_label(xf, label: Annotation):
+    with xf.element(f"{_BPMNDI}BPMNLabel"):
+        _write_bounds(xf, label)
+
+
+def _write_bounds(xf, a: Annotation):
+    bb = a.bb
+    with xf.element(f"{_OMGDC}Bounds", x=_fmt(bb.l), y=_fmt(bb.t), width=_fmt(bb.r - bb.l), height=_fmt(bb.b - bb.t)):
+        pass
+
+
+def _fmt(v: float) -> str:
+    # repr is the shortest representation that is parsed back to the same float
+    v = float(v)
+    return str(int(v)) if v.is_integer() else repr(v)
+
+
+def _without_dangling_edges(anns: List[Annotation]) -> List[Annotation]:
+    """
+    :return: anns without the edges that miss arrow_prev or arrow_next, e.g. because BpmnParser excluded the
+             element at that end, and without associations to such edges
+    """
+    kept_ids = {id(a) for a in anns}
+    n_kept = -1
+    while n_kept != len(kept_ids):
+        n_kept = len(kept_ids)
+        for a in anns:
+            if a.category not in _EDGE_CATEGORIES or id(a) not in kept_ids:
+                continue
+            ends = [a.get(rel) if rel in a else None for rel in ARROW_RELATIONS]
+            if any(end is None or (not isinstance(end, str) and id(end) not in kept_ids) for end in ends):
+                kept_ids.remove(id(a))
+    if len(kept_ids) < len(anns):
+        _logger.warning("skipping %d edges without arrow_prev or arrow_next annotation", len(anns) - len(kept_ids))
+    return [a for a in anns if id(a) in kept_ids]
+
+
+def _smallest_container(a: Annotation, containers: List[Annotation]) -> Optional[Annotation]:
+    """:return: the smallest expanded subprocess (or transaction) that contains the bounding box of a"""
+    bb = a.bb
+    best = None
+    for c in containers:
+        cbb = c.bb
+        # strictly larger, so that containers with the same bounds are not nested into each other
+        if cbb.area <= bb.area or not (cbb.l <= bb.l and cbb.t <= bb.t and bb.r <= cbb.r and bb.b <= cbb.b):
+            continue
+        if best is None or cbb.area < best.bb.area:
+            best = c
+    return best
+
+
+@functools.lru_cache(maxsize=None)
+def _category_to_tag(category: str) -> Tuple[str, Tuple[str, ...]]:
+    """:return: tag of the model element and event definitions that BpmnParser parses as category"""
+    if category in syntax.MULTIPLE_EVENTS:
+        # events with multiple definitions are parsed as parallel multiple events
+        raise ValueError(f"Category {category} cannot be written as BPMN")
+    tag, definitions = _TAG_OVERRIDES.get(category, (category, ()))
+    for base in _EVENT_TAGS:
+        suffix = capitalize_fc(base)
+        if category not in _TAG_OVERRIDES and category.endswith(suffix) and category != base:
+            prefix = category[:-len(suffix)]
+            if prefix == syntax.PARALLEL_MULTIPLE_PREFIX:
+                tag, definitions = base, ("message", "timer")
+            elif prefix in syntax.EVENT_DEFINITIONS:
+                tag, definitions = base, (prefix,)
+
+    # checked with the parser, e.g. for categories that are not in syntax.ALL_CATEGORIES
+    model_element = etree.Element(_MODEL + tag)
+    for d in definitions:
+        etree.SubElement(model_element, f"{_MODEL}{d}EventDefinition")
+    di_element = etree.Element(f"{_BPMNDI}BPMNShape", isExpanded=str(category == syntax.SUBPROCESS_EXPANDED).lower())
+    try:
+        parsed = get_category(di_element, model_element)
+    except Exception:
+        parsed = None
+    if parsed != category:
+        raise ValueError(f"Category {category} cannot be written as BPMN")
+    return tag, definitions
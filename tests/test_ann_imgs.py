@@ -0,0 +1,26 @@
+import shutil
+from pathlib import Path
+
+from pybpmn.ann_imgs import create_ann_imgs
+
+resource_path = Path(__file__).resolve().parent / "resources"
+
+
+def test_create_ann_imgs(tmp_path):
+    (tmp_path / "annotations").mkdir()
+    (tmp_path / "images").mkdir()
+    shutil.copy(resource_path / "process.bpmn", tmp_path / "annotations")
+    shutil.copy(resource_path / "process.jpg", tmp_path / "images")
+    # a bpmn file that cannot be parsed
+    (tmp_path / "annotations" / "invalid.bpmn").write_text((resource_path / "process.bpmn").read_text().replace(
+        "<bpmndi:BPMNDiagram", '<choreography id="choreography" />\n<bpmndi:BPMNDiagram'))
+    shutil.copy(resource_path / "process.jpg", tmp_path / "images" / "invalid.jpg")
+
+    report = create_ann_imgs(tmp_path, n_jobs=1)
+    assert report.created == ["process"]
+    assert list(report.failures) == ["BPMN Choreography diagrams are not implemented."]
+    assert (tmp_path / "images-annotated" / "process.jpg").exists()
+
+    report = create_ann_imgs(tmp_path, n_jobs=1)
+    assert report.created == []
+    assert report.skipped == ["process"]
@@ -0,0 +1,52 @@
+from pathlib import Path
+
+import numpy as np
+from PIL import ImageOps
+
+from pybpmn import syntax
+from pybpmn.augment import augment, augment_batch, hflip_matrix, random_transform, translation_matrix
+from pybpmn.parser import BpmnParser
+
+resource_path = Path(__file__).resolve().parent / "resources"
+
+
+def _parse():
+    return BpmnParser().parse_bpmn_img(resource_path / "process.bpmn", resource_path / "process.jpg")
+
+
+def test_hflip():
+    ai = _parse()
+    flipped = augment(ai, hflip_matrix(ai.width), (ai.width, ai.height))
+
+    assert np.array_equal(np.asarray(flipped.img), np.asarray(ImageOps.mirror(ai.img)))
+    assert [a.category for a in flipped.annotations] == [a.category for a in ai.annotations]
+    for a, a_flipped in zip(ai.annotations, flipped.annotations):
+        if a.category not in syntax.BPMNDI_EDGE_CATEGORIES:
+            assert np.allclose(a_flipped.bb.tlbr, (a.bb.t, ai.width - a.bb.r, a.bb.b, ai.width - a.bb.l))
+        else:
+            assert np.allclose(a_flipped.tail, (ai.width - a.tail[0], a.tail[1]))
+            assert np.array_equal(a_flipped.head, a_flipped.waypoints[-1])
+
+
+def test_crop_drops_elements_consistently():
+    ai = _parse()
+    w = ai.width // 2
+    cropped = augment(ai, translation_matrix(-w, 0), (w, ai.height))
+
+    anns = cropped.annotations
+    assert 0 < len(anns) < len(ai.annotations)
+    for a in anns:
+        assert 0 <= a.bb.l <= a.bb.r <= w
+        for rel in ["arrow_prev", "arrow_next", "text_belongs_to", "lane", "pool"]:
+            related = a.get(rel) if rel in a else None
+            assert related is None or any(related is b for b in anns), rel
+
+
+def test_augment_batch():
+    ai = _parse()
+    rng = np.random.default_rng(0)
+    transforms = [random_transform(rng, ai.width, ai.height, max_perspective=0.05) for _ in range(3)]
+    ais = augment_batch([ai] * 3, [m for m, _ in transforms], [size for _, size in transforms])
+
+    assert [a.size for a in ais] == [size for _, size in transforms]
+    assert all(img_ai.img.size == size for img_ai, (_, size) in zip(ais, transforms))
@@ -0,0 +1,32 @@
+from pathlib import Path
+
+import numpy as np
+from yamlu.img import Annotation
+
+from pybpmn.compact import BpmnEdge, BpmnElement, CompactDiagram
+from pybpmn.parser import BpmnParser
+
+resource_path = Path(__file__).resolve().parent / "resources"
+
+
+def test_compact_roundtrip():
+    ai = BpmnParser().parse_bpmn_img(resource_path / "process.bpmn", resource_path / "process.jpg")
+    anns = ai.annotations
+
+    diagram = CompactDiagram.from_annotations(anns)
+    assert len(diagram) == len(anns)
+    edge = [el for el in diagram if isinstance(el, BpmnEdge)][0]
+    assert isinstance(edge.arrow_prev, BpmnElement)
+
+    anns_back = diagram.to_annotations()
+    for a, b in zip(anns, anns_back):
+        assert a.category == b.category
+        assert a.bb == b.bb
+        assert set(a.extra_fields) == set(b.extra_fields)
+        for k, v in a.extra_fields.items():
+            if isinstance(v, Annotation):
+                assert anns.index(v) == anns_back.index(b.get(k))
+            elif isinstance(v, np.ndarray):
+                assert np.allclose(v, b.get(k))
+            else:
+                assert v == b.get(k)
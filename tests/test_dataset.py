@@ -0,0 +1,73 @@
+import json
+import shutil
+from pathlib import Path
+
+from pybpmn import dataset
+from pybpmn.dataset import ComputerGeneratedDataset
+from pybpmn.export import BpmnCocoDatasetExport
+
+resource_path = Path(__file__).resolve().parent / "resources"
+
+
+def _create_dataset(tmp_path: Path) -> ComputerGeneratedDataset:
+    root = tmp_path / "bpmn"
+    (root / "data" / "annotations").mkdir(parents=True)
+    (root / "data" / "images").mkdir(parents=True)
+    for i in range(3):
+        shutil.copy(resource_path / "process.bpmn", root / "data" / "annotations" / f"process{i}.bpmn")
+        shutil.copy(resource_path / "process.jpg", root / "data" / "images" / f"process{i}.jpg")
+    ComputerGeneratedDataset.write_filename_split(root, {f"process{i}": "train" for i in range(3)})
+    return ComputerGeneratedDataset(root, tmp_path / "coco")
+
+
+def test_parse_planned(tmp_path):
+    ds = _create_dataset(tmp_path)
+    plan = ds.compile_plan()
+    assert plan.split_bpmn_paths["train"].shape == (3,)
+
+    dataset.init_worker(plan)
+    for idx in range(3):
+        ai = ds.get_split_ann_img("train", idx)
+        ai_planned = dataset.parse_planned("train", idx)
+        assert ai_planned.filename == ai.filename
+        assert ai_planned.categories == ai.categories
+        assert [a.bb for a in ai_planned.annotations] == [a.bb for a in ai.annotations]
+
+
+def test_export_with_worker_plan(tmp_path):
+    ds = _create_dataset(tmp_path)
+    export = BpmnCocoDatasetExport(ds, write_img=False, n_jobs=2)
+    ann_imgs = export.dump_split("train")
+
+    assert [ai.filename for ai in ann_imgs] == [f"process{i}.jpg" for i in range(3)]
+    assert export.metrics.counters[("files_total", (("split", "train"),))] == 3
+    coco = json.loads((tmp_path / "coco" / "train.json").read_text())
+    assert len(coco["annotations"]) == 3 * len(ann_imgs[0].annotations)
+
+
+def test_export_skips_invalid_diagram(tmp_path):
+    ds = _create_dataset(tmp_path)
+    bpmn_path = ds.split_to_bpmn_paths["train"][1]
+    xml = bpmn_path.read_bytes().replace(b"</definitions>", b"<choreography /></definitions>")
+    bpmn_path.write_bytes(xml)
+    error_type = "BPMN Choreography diagrams are not implemented."
+    for n_jobs in [1, 2]:
+        export = BpmnCocoDatasetExport(ds, write_img=False, n_jobs=n_jobs)
+        ann_imgs = export.dump_split("train")
+
+        assert [ai.filename for ai in ann_imgs] == ["process0.jpg", "process2.jpg"]
+        assert f'pybpmn_invalid_bpmn_total{{error_type="{error_type}"}} 1' in export.metrics.to_prometheus_text()
+
+
+def test_iter_split(tmp_path):
+    ds = _create_dataset(tmp_path)
+    expected = [ds.get_split_ann_img("train", idx) for idx in range(3)]
+
+    ais = list(ds.iter_split("train", prefetch=2))
+    assert [ai.filename for ai in ais] == [ai.filename for ai in expected]
+    assert [ai.categories for ai in ais] == [ai.categories for ai in expected]
+    assert [a.bb for a in ais[0].annotations] == [a.bb for a in expected[0].annotations]
+
+    unordered = list(ds.iter_split("train", prefetch=2, workers=2, ordered=False))
+    assert sorted(ai.filename for ai in unordered) == [ai.filename for ai in expected]
+    assert all(ai.img.size == expected[0].img.size for ai in unordered)
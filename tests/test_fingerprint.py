@@ -0,0 +1,33 @@
+from pathlib import Path
+
+from pybpmn.fingerprint import MinHashLSH, assign_group_splits, fingerprint_anns
+from pybpmn.parser import BpmnParser
+
+resource_path = Path(__file__).resolve().parent / "resources"
+
+
+def test_fingerprint_near_duplicates():
+    parser = BpmnParser()
+    fp1 = fingerprint_anns(parser.parse_bpmn_anns(resource_path / "process.bpmn"))
+    fp2 = fingerprint_anns(parser.parse_bpmn_anns(resource_path / "process.bpmn"))
+    fp_other = fingerprint_anns(parser.parse_bpmn_anns(resource_path / "no_default_bpmn_ns.bpmn"))
+
+    assert fp1.structure_key == fp2.structure_key
+    assert fp1.similarity(fp2) == 1.0
+    assert fp1.similarity(fp_other) < 0.5
+
+    lsh = MinHashLSH()
+    lsh.insert("a", fp1)
+    lsh.insert("b", fp2)
+    lsh.insert("c", fp_other)
+    assert set(lsh.near_duplicates(fp1)) == {"a", "b"}
+    clusters = sorted(sorted(c) for c in lsh.clusters())
+    assert clusters == [["a", "b"], ["c"]]
+
+
+def test_assign_group_splits():
+    groups = [[f"{i}_{j}" for j in range(i % 3 + 1)] for i in range(100)]
+    key_to_split = assign_group_splits(groups, {"train": 0.8, "test": 0.2})
+    assert len(key_to_split) == sum(len(g) for g in groups)
+    for g in groups:
+        assert len({key_to_split[k] for k in g}) == 1
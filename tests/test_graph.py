@@ -0,0 +1,37 @@
+from pathlib import Path
+
+import numpy as np
+
+from pybpmn import syntax
+from pybpmn.graph import BpmnGraph
+from pybpmn.parser import BpmnParser
+
+resource_path = Path(__file__).resolve().parent / "resources"
+
+
+def test_graph_from_anns():
+    anns = BpmnParser().parse_bpmn_anns(resource_path / "process.bpmn")
+    g = BpmnGraph.from_anns(anns)
+
+    n_shapes = len([a for a in anns if a.category in syntax.BPMNDI_SHAPE_CATEGORIES])
+    assert g.n_nodes == n_shapes
+    assert g.n_edges(syntax.SEQUENCE_FLOW) == len([a for a in anns if a.category == syntax.SEQUENCE_FLOW])
+    assert g.out_degree(syntax.SEQUENCE_FLOW).sum() == g.n_edges(syntax.SEQUENCE_FLOW)
+
+    start = [i for i, a in enumerate(g.nodes) if a.category == syntax.START_EVENT][0]
+    end = [i for i, a in enumerate(g.nodes) if a.category == syntax.END_EVENT][0]
+    dist = g.bfs(start)
+    assert dist[start] == 0
+    assert dist[end] > 0
+
+
+def test_graph_connected_components():
+    anns = BpmnParser().parse_bpmn_anns(resource_path / "process.bpmn")
+    g = BpmnGraph.from_anns(anns)
+
+    n_components, labels = g.connected_components(syntax.SEQUENCE_FLOW)
+    assert len(labels) == g.n_nodes
+    assert n_components == len(np.unique(labels))
+    # nodes connected by a sequence flow share a component
+    src, dst = g.edge_src[syntax.SEQUENCE_FLOW], g.edge_dst[syntax.SEQUENCE_FLOW]
+    assert np.array_equal(labels[src], labels[dst])
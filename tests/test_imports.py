@@ -0,0 +1,36 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+resource_path = Path(__file__).resolve().parent / "resources"
+
+# modules that take most of the import time (yamlu.img imports matplotlib.pyplot)
+HEAVY_MODULES = {"numpy", "PIL", "yamlu", "matplotlib", "joblib", "IPython"}
+
+
+def _import_times(code: str):
+    """
+    :return: imported modules and total import time in ms when running code in a fresh interpreter
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True)
+    # e.g. "import time:       281 |      40170 | pybpmn.constants", nested imports are indented
+    lines = [line.split("|") for line in proc.stderr.splitlines()[1:] if line.startswith("import time:")]
+    modules = {name.strip() for _, _, name in lines}
+    total_ms = sum(int(cumulative) for _, cumulative, name in lines if not name.startswith("  ")) / 1000
+    return modules, total_ms
+
+
+@pytest.mark.parametrize("code", [
+    "import pybpmn.syntax",
+    "import pybpmn.parser",
+    "import pybpmn.graph",
+    "import pybpmn.fingerprint",
+    f"from pathlib import Path; from pybpmn.parser import BpmnParser; "
+    f"BpmnParser().validate(Path('{resource_path / 'process.bpmn'}'))",
+])
+def test_no_heavy_imports(code):
+    modules, total_ms = _import_times(code)
+    heavy = {m for m in modules if m.split(".")[0] in HEAVY_MODULES}
+    assert len(heavy) == 0, f"{code} imports {sorted(heavy)} (total import time: {total_ms:.0f} ms)"
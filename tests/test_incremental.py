@@ -0,0 +1,40 @@
+from pathlib import Path
+
+from pybpmn.incremental import ParseSession
+from pybpmn.parser import BpmnParser
+
+resource_path = Path(__file__).resolve().parent / "resources"
+
+
+def _assert_same_anns(anns, anns_expected):
+    assert len(anns) == len(anns_expected)
+    for a, b in zip(anns, anns_expected):
+        assert a.category == b.category
+        assert a.bb == b.bb
+        assert set(a.extra_fields) == set(b.extra_fields)
+        for k in ["pool", "lane", "arrow_prev", "arrow_next", "text_belongs_to"]:
+            if k in a and a.get(k) is not None:
+                assert anns.index(a.get(k)) == anns_expected.index(b.get(k))
+
+
+def test_parse_session_update():
+    parser = BpmnParser()
+    session = ParseSession(parser)
+    content = (resource_path / "process.bpmn").read_text()
+    anns_before = session.update(content.encode())
+    _assert_same_anns(anns_before, parser.parse_bpmn_anns(content.encode()))
+
+    # move a task to the other lane and redirect a sequence flow to it
+    content = content.replace("<flowNodeRef>Activity_1gwkhgn</flowNodeRef>", "") \
+        .replace("<flowNodeRef>Activity_1ta7i7w</flowNodeRef>",
+                 "<flowNodeRef>Activity_1ta7i7w</flowNodeRef><flowNodeRef>Activity_1gwkhgn</flowNodeRef>") \
+        .replace('sourceRef="Activity_1d96rim" targetRef="Activity_15zn4oo"',
+                 'sourceRef="Activity_1d96rim" targetRef="Activity_1gwkhgn"')
+    anns = session.update(content.encode())
+    _assert_same_anns(anns, parser.parse_bpmn_anns(content.encode()))
+    assert session.changed_ids == {"Lane_0ingj91", "Lane_14tv1bd", "Flow_1nickfj"}
+
+    # annotations of unchanged elements are reused
+    task = next(a for a in anns if "id" in a and a.id == "Activity_1gwkhgn")
+    assert task in anns_before
+    assert task.lane.name == "claims officer"
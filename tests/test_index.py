@@ -0,0 +1,87 @@
+import shutil
+from pathlib import Path
+
+from pybpmn.index import CorpusIndex, _index_file
+from pybpmn.parser import BpmnParser
+
+resource_path = Path(__file__).resolve().parent / "resources"
+
+
+def _create_corpus(root: Path):
+    root.mkdir()
+    for i in range(4):
+        shutil.copy(resource_path / "process.bpmn", root / f"process{i}.bpmn")
+    shutil.copy(resource_path / "multiple_diagrams.bpmn", root / "multiple_diagrams.bpmn")
+    xml = (resource_path / "process.bpmn").read_bytes()
+    (root / "choreography.bpmn").write_bytes(xml.replace(b"</definitions>", b"<choreography /></definitions>"))
+    (root / "broken.bpmn").write_text("<definitions")
+
+
+def test_query(tmp_path):
+    corpus_root = tmp_path / "corpus"
+    _create_corpus(corpus_root)
+    with CorpusIndex(tmp_path / "index.sqlite") as index:
+        assert index.update(corpus_root.glob("*.bpmn"), n_jobs=2) == 7
+
+        processes = [corpus_root / f"process{i}.bpmn" for i in range(4)]
+        assert index.query(categories={"pool": 2, "lane": 2}) == processes
+        assert index.query(text='"senior claims officer"') == processes
+        assert index.query(valid=False) == [corpus_root / "broken.bpmn", corpus_root / "choreography.bpmn"]
+        assert index.query(error_type="BPMN Choreography diagrams are not implemented.") == [
+            corpus_root / "choreography.bpmn"]
+        assert index.error_counts()["XML syntax error"] == 1
+
+        sample = index.stratified_sample(0.5)
+        assert len(sample) == 2 and set(sample) <= set(processes) | {corpus_root / "multiple_diagrams.bpmn"}
+
+
+def test_incremental_update(tmp_path):
+    corpus_root = tmp_path / "corpus"
+    _create_corpus(corpus_root)
+    db_path = tmp_path / "index.sqlite"
+    with CorpusIndex(db_path) as index:
+        index.update(corpus_root.glob("*.bpmn"))
+
+    with CorpusIndex(db_path) as index:
+        assert index.update(corpus_root.glob("*.bpmn")) == 0
+
+        process_path = corpus_root / "process0.bpmn"
+        process_path.write_text(process_path.read_text().replace("examine claim", "inspect claim"))
+        (corpus_root / "process1.bpmn").unlink()
+        assert index.update(corpus_root.glob("*.bpmn")) == 1
+        assert len(index) == 6
+        assert index.query(text="inspect") == [process_path]
+        assert index.query(text="examine") == [corpus_root / "process2.bpmn", corpus_root / "process3.bpmn"]
+
+    # different parser settings invalidate the index
+    with CorpusIndex(db_path, excluded_categories={"lane"}) as index:
+        assert index.update(corpus_root.glob("*.bpmn")) == 6
+        assert "lane" not in index.category_counts(process_path)
+
+
+def test_unexpected_error(tmp_path):
+    corpus_root = tmp_path / "corpus"
+    corpus_root.mkdir()
+    shutil.copy(resource_path / "process.bpmn", corpus_root / "process.bpmn")
+    xml = (resource_path / "process.bpmn").read_text()
+    xml = xml.replace('<task id="Activity_0drx6ko"', '<customTask id="Activity_0drx6ko"').replace(
+        "</task>", "</customTask>", 1)
+    (corpus_root / "unknown_category.bpmn").write_text(xml)
+    with CorpusIndex(tmp_path / "index.sqlite") as index:
+        assert index.update(corpus_root.glob("*.bpmn")) == 2
+        assert index.query(valid=True) == [corpus_root / "process.bpmn"]
+        assert index.query(error_type="AssertionError") == [corpus_root / "unknown_category.bpmn"]
+
+
+def test_deleted_before_update(tmp_path):
+    corpus_root = tmp_path / "corpus"
+    _create_corpus(corpus_root)
+    with CorpusIndex(tmp_path / "index.sqlite") as index:
+        index.update(corpus_root.glob("*.bpmn"))
+        paths = sorted(corpus_root.glob("*.bpmn"))
+        (corpus_root / "process0.bpmn").unlink()
+        assert index.update(paths, remove_missing=False) == 0
+        assert len(index) == 6
+        assert corpus_root / "process0.bpmn" not in index.query()
+        # deleted after the update has stat-ed it
+        assert _index_file(BpmnParser(), str(corpus_root / "process0.bpmn")) is None
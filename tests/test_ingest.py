@@ -0,0 +1,42 @@
+from pathlib import Path
+
+from pybpmn.ingest import ingest
+from pybpmn.metrics import Metrics
+from pybpmn.parser import BpmnParser
+
+resource_path = Path(__file__).resolve().parent / "resources"
+
+
+def test_ingest(tmp_path):
+    invalid_path = tmp_path / "invalid.bpmn"
+    invalid_path.write_text("<definitions")
+    paths = sorted(resource_path.glob("*.bpmn")) * 3 + [invalid_path]
+    parser = BpmnParser()
+
+    results = list(ingest(paths, parser, n_threads=4, max_pending=2))
+    assert [r.path for r in results] == paths
+    for r in results[:-1]:
+        expected = parser.parse_bpmn_anns(r.path)
+        assert r.error is None
+        assert [(a.category, a.bb.tlbr) for a in r.anns] == [(a.category, a.bb.tlbr) for a in expected]
+    assert results[-1].anns is None and results[-1].error is not None
+
+
+def test_ingest_unordered():
+    paths = sorted(resource_path.glob("*.bpmn")) * 4
+    metrics = Metrics()
+    results = list(ingest(paths, n_threads=3, ordered=False, metrics=metrics))
+    assert sorted(r.path for r in results) == sorted(paths)
+    assert all(r.error is None for r in results)
+    assert metrics.to_dict()["counters"]["pybpmn_files_total"] == len(paths)
+
+
+def test_ingest_unexpected_error(tmp_path):
+    xml = (resource_path / "process.bpmn").read_text()
+    unknown_path = tmp_path / "unknown_category.bpmn"
+    unknown_path.write_text(xml.replace('<task id="Activity_0drx6ko"', '<customTask id="Activity_0drx6ko"').replace(
+        "</task>", "</customTask>", 1))
+    paths = [unknown_path, resource_path / "process.bpmn"]
+    results = list(ingest(paths, n_threads=2))
+    assert isinstance(results[0].error, AssertionError)
+    assert results[1].error is None and len(results[1].anns) > 0
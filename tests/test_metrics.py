@@ -0,0 +1,44 @@
+import json
+import pickle
+from pathlib import Path
+
+import pytest
+
+from pybpmn.metrics import JsonLinesSink, Metrics, PrometheusTextfileSink
+from pybpmn.parser import BpmnParser, InvalidBpmnException
+
+resource_path = Path(__file__).resolve().parent / "resources"
+
+
+def test_parser_records_active_metrics(tmp_path):
+    metrics = Metrics(sinks=[PrometheusTextfileSink(tmp_path / "export.prom"),
+                             JsonLinesSink(tmp_path / "export.jsonl")])
+    bpmn_path, img_path = resource_path / "process.bpmn", resource_path / "process.jpg"
+    # no active metrics: nothing is recorded
+    BpmnParser().parse_bpmn_img(bpmn_path, img_path)
+    assert len(metrics.histograms) == 0
+
+    with metrics.activate():
+        BpmnParser().parse_bpmn_img(bpmn_path, img_path)
+        with pytest.raises(InvalidBpmnException):
+            choreography = bpmn_path.read_bytes().replace(b"</definitions>", b"<choreography /></definitions>")
+            BpmnParser().parse_bpmn_img(choreography, img_path)
+
+    assert metrics.histograms[("parse_ms", ())].count == 2
+    assert metrics.histograms[("decode_ms", ())].count == 1
+    assert metrics.counters[("bytes_read_total", ())] > 2 * img_path.stat().st_size
+    error_type = "BPMN Choreography diagrams are not implemented."
+    assert metrics.counters[("invalid_bpmn_total", (("error_type", error_type),))] == 1
+
+    # workers record into unpickled (empty) copies and send back snapshots
+    worker_metrics = pickle.loads(pickle.dumps(metrics))
+    assert worker_metrics.sinks == [] and len(worker_metrics.counters) == 0
+    worker_metrics.inc("invalid_bpmn_total", error_type=error_type)
+    metrics.merge(worker_metrics.snapshot())
+
+    metrics.flush()
+    prom = (tmp_path / "export.prom").read_text()
+    assert f'pybpmn_invalid_bpmn_total{{error_type="{error_type}"}} 2' in prom
+    assert 'pybpmn_parse_ms_bucket{le="+Inf"} 2' in prom
+    record = json.loads((tmp_path / "export.jsonl").read_text().splitlines()[-1])
+    assert record["histograms"]["pybpmn_parse_ms"]["count"] == 2
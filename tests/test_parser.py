@@ -1,8 +1,10 @@
 from pathlib import Path
 
-from yamlu.img import Annotation
+import numpy as np
+import pytest
+from yamlu.img import Annotation, BoundingBox
 
-from pybpmn.parser import BpmnParser
+from pybpmn.parser import BpmnParser, InvalidBpmnException
 from pybpmn import syntax
 
 resource_path = Path(__file__).resolve().parent / "resources"
@@ -25,6 +27,16 @@ def test_bpmn_label_without_bounds():
     assert len(anns) > 0
 
 
+def test_bpmn_shape_without_bounds():
+    xml = (resource_path / "label_without_bounds.bpmn").read_text()
+    xml = xml.replace('<omgdc:Bounds x="315.3" y="233.48" width="164.06" height="93.66" />', '')
+    with pytest.raises(InvalidBpmnException, match="task without bounds"):
+        BpmnParser().parse_bpmn_anns(xml.encode())
+    # no error if the shape is excluded
+    anns = BpmnParser(excluded_categories={syntax.TASK}).parse_bpmn_anns(xml.encode())
+    assert [a.category for a in anns] == [syntax.POOL]
+
+
 def test_bpmn_different_ns_mapping():
     bpmn_path = resource_path / "no_default_bpmn_ns.bpmn"
     parser = BpmnParser()
@@ -39,4 +51,118 @@ def test_bpmn_association_to_sequenceflow():
     assert isinstance(a.arrow_next, Annotation)
     assert a.arrow_next.category == syntax.TEXT_ANNOTATION
     assert isinstance(a.arrow_prev, Annotation)
-    assert a.arrow_prev.category == syntax.SEQUENCE_FLOW
\ No newline at end of file
+    assert a.arrow_prev.category == syntax.SEQUENCE_FLOW
+
+
+def test_validate():
+    parser = BpmnParser()
+    for bpmn_path in resource_path.glob("*.bpmn"):
+        assert parser.validate(bpmn_path) == []
+
+    xml = (resource_path / "assocation_to_sequence_flow.bpmn").read_text()
+    # duplicate id, missing model element and an edge without waypoints
+    xml = xml.replace('<bpmn:endEvent id="Event_1mixmrp">',
+                      '<bpmn:task id="Activity_0133fck" />\n<bpmn:endEvent id="Event_1mixmrp">')
+    xml = xml.replace('bpmnElement="Event_1mixmrp"', 'bpmnElement="Event_missing"')
+    xml = xml.replace('''<di:waypoint x="192" y="209" />
+        <di:waypoint x="250" y="209" />''', '')
+    errors = parser.validate(xml.encode())
+    assert sorted(e.error_type for e in errors) == [
+        "Duplicate model element id", "Missing model element", "sequenceFlow without waypoints"
+    ]
+
+
+def _invalid_fixtures():
+    process = (resource_path / "process.bpmn").read_text()
+    lane_shape = """<bpmndi:BPMNShape id="Lane_0ingj91_di" bpmnElement="Lane_0ingj91" isHorizontal="true">
+        <omgdc:Bounds x="50" y="236" width="1150" height="297" />
+      </bpmndi:BPMNShape>"""
+    return [
+        # lane without shape
+        process.replace(lane_shape, ""),
+        # shape without bounds
+        process.replace('<omgdc:Bounds x="50" y="236" width="1150" height="297" />', ""),
+        # data association without sourceRef
+        process.replace("<sourceRef>DataObjectReference_1eb6xce</sourceRef>", ""),
+        # no diagram
+        process[:process.index("<bpmndi:BPMNDiagram")] + "</definitions>",
+        process.replace("</definitions>", "<choreography /></definitions>"),
+    ]
+
+
+def test_validate_consistent_with_parse():
+    parser = BpmnParser()
+    fixtures = [p.read_bytes() for p in sorted(resource_path.glob("*.bpmn"))]
+    fixtures += [xml.encode() for xml in _invalid_fixtures()]
+    for xml in fixtures:
+        try:
+            parser.parse_bpmn_anns(xml)
+            parsed = True
+        except InvalidBpmnException:
+            parsed = False
+        assert (parser.validate(xml) == []) == parsed
+
+
+def test_edge_geometry():
+    bpmn_path = resource_path / "process.bpmn"
+    anns = BpmnParser().parse_bpmn_anns(bpmn_path)
+    edge_anns = [a for a in anns if a.category in syntax.BPMNDI_EDGE_CATEGORIES]
+    assert len(edge_anns) > 0
+    for a in edge_anns:
+        assert a.waypoints.shape[1] == 2
+        assert a.bb == BoundingBox.from_points(a.waypoints, allow_neg_coord=True)
+
+
+def test_iter_diagrams():
+    bpmn_path = resource_path / "multiple_diagrams.bpmn"
+    parser = BpmnParser()
+    diagrams = list(parser.iter_diagrams(bpmn_path))
+    assert [d.name for d in diagrams] == ["Order", "Shipping"]
+
+    anns = diagrams[0].parse_anns()
+    assert len(anns) == len(parser.parse_bpmn_anns(bpmn_path))
+    assert [a.id for a in diagrams[1].parse_anns()] == ["Task_2"]
+
+    xml = bpmn_path.read_text()
+    xml = xml.replace(xml[xml.index('<bpmndi:BPMNPlane id="Plane_2"'):xml.rindex("</bpmndi:BPMNDiagram>")], "")
+    diagrams = list(parser.iter_diagrams(xml.encode()))
+    assert diagrams[1].bpmn_element is None
+    with pytest.raises(InvalidBpmnException, match="Missing BPMNPlane"):
+        diagrams[1].parse_anns()
+
+
+def test_parse_bpmn_img_target_max_size():
+    bpmn_path = resource_path / "process.bpmn"
+    img_path = resource_path / "process.jpg"
+
+    ai = BpmnParser().parse_bpmn_img(bpmn_path, img_path)
+    ai_small = BpmnParser(target_max_size=500).parse_bpmn_img(bpmn_path, img_path)
+    assert max(ai_small.size) == 500
+
+    scale = 500 / max(ai.size)
+    for a, a_small in zip(ai.annotations, ai_small.annotations):
+        assert np.allclose(np.array(a.bb.tlbr) * scale, a_small.bb.tlbr, atol=1.0)
+        if "head" in a:
+            assert np.allclose(a.head * scale, a_small.head, atol=1.0)
+
+
+def test_category_filter_pushdown():
+    bpmn_path = resource_path / "assocation_to_sequence_flow.bpmn"
+    anns = BpmnParser(excluded_categories={syntax.TEXT_ANNOTATION}).parse_bpmn_anns(bpmn_path)
+    a = [a for a in anns if a.category == syntax.ASSOCIATION][0]
+    assert "arrow_next" not in a
+    assert a.arrow_prev.category == syntax.SEQUENCE_FLOW
+
+    parser = BpmnParser(included_categories={syntax.TASK, syntax.SEQUENCE_FLOW})
+    anns = parser.parse_bpmn_anns(resource_path / "process.bpmn")
+    assert {a.category for a in anns} == {syntax.TASK, syntax.SEQUENCE_FLOW}
+    for a in anns:
+        if a.category == syntax.SEQUENCE_FLOW:
+            assert all(a.get(rel) in anns for rel in ["arrow_prev", "arrow_next"] if rel in a)
+    assert parser.validate(resource_path / "process.bpmn") == []
+
+    # the geometry of the kept elements is read one by one, and has to match the bulk extraction
+    all_anns = [a for a in BpmnParser().parse_bpmn_anns(resource_path / "process.bpmn")
+                if a.category in {syntax.TASK, syntax.SEQUENCE_FLOW}]
+    assert [a.bb for a in anns] == [a.bb for a in all_anns]
+    assert all(np.array_equal(a.waypoints, b.waypoints) for a, b in zip(anns, all_anns) if "waypoints" in a)
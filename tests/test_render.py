@@ -0,0 +1,32 @@
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from pybpmn import syntax
+from pybpmn.dataset import HDBPMN_CATEGORY_GROUPS
+from pybpmn.parser import BpmnParser
+from pybpmn.render import category_palette, render_ann_img, save_ann_imgs
+
+resource_path = Path(__file__).resolve().parent / "resources"
+
+
+def test_render_ann_img():
+    ai = BpmnParser().parse_bpmn_img(resource_path / "process.bpmn", resource_path / "process.jpg")
+    palette = category_palette()
+    img = np.asarray(render_ann_img(ai, line_width=1, draw_links=False))
+
+    task = next(a for a in ai.annotations if a.category == syntax.TASK)
+    l, t = round(task.bb.l), round(task.bb.t)
+    assert tuple(img[t, l + 5]) == palette[syntax.TASK]
+    assert set(palette).issuperset(c for cats in HDBPMN_CATEGORY_GROUPS.values() for c in cats)
+
+    preview = render_ann_img(ai, max_size=400)
+    assert max(preview.size) == 400
+
+
+def test_save_ann_imgs(tmp_path):
+    ai = BpmnParser().parse_bpmn_img(resource_path / "process.bpmn", resource_path / "process.jpg")
+    paths = save_ann_imgs([ai], tmp_path, n_jobs=2, max_size=300)
+    assert paths == [tmp_path / "process_bb.jpg"]
+    assert max(Image.open(paths[0]).size) == 300
@@ -0,0 +1,83 @@
+import csv
+import json
+from pathlib import Path
+
+import numpy as np
+
+from pybpmn import syntax
+from pybpmn.parser import BpmnParser
+from pybpmn.sapsam import BPMN2_NAMESPACE, SapSamReader
+
+resource_path = Path(__file__).resolve().parent / "resources"
+
+
+def test_parse_model_json():
+    anns = SapSamReader().parse_model_json((resource_path / "sapsam_model.json").read_text())
+    id_to_ann = {a.id: a for a in anns}
+
+    assert id_to_ann["taskB"].category == "userTask"
+    assert id_to_ann["timer"].category == "timerBoundaryEvent"
+    assert id_to_ann["assoc"].category == syntax.DATA_ASSOCIATION
+    assert "system" not in id_to_ann
+    # child bounds are relative to their parent
+    assert id_to_ann["taskA"].bb.ltrb == (230, 140, 330, 220)
+    assert id_to_ann["taskA"].pool is id_to_ann["pool"]
+    assert id_to_ann["taskA"].lane is id_to_ann["lane1"]
+    assert id_to_ann["data"].pool is None
+
+    flow = id_to_ann["flow2"]
+    assert flow.arrow_prev is id_to_ann["taskA"] and flow.arrow_next is id_to_ann["taskB"]
+    # first and last waypoints are on the border of the source and target
+    assert np.array_equal(flow.waypoints, [[280, 220], [280, 255], [280, 290]])
+
+
+def test_iter_csv(tmp_path):
+    model_json = (resource_path / "sapsam_model.json").read_text()
+    invalid_json = json.dumps({"childShapes": [{"resourceId": "t", "stencil": {"id": "Task"}}]})
+    csv_path = tmp_path / "0-1000.csv"
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Model ID", "Name", "Namespace", "Model JSON"])
+        for i in range(5):
+            writer.writerow([f"m{i}", "claims", BPMN2_NAMESPACE, model_json])
+        writer.writerow(["epc", "", "http://b3mn.org/stencilset/epc#", "{}"])
+        writer.writerow(["invalid", "", BPMN2_NAMESPACE, invalid_json])
+        writer.writerow(["malformed", "", BPMN2_NAMESPACE, model_json[:100]])
+        writer.writerow(["no_id", "", BPMN2_NAMESPACE, json.dumps({"childShapes": [{"stencil": {"id": "Task"}}]})])
+        writer.writerow(["m5", "claims", BPMN2_NAMESPACE, model_json])
+
+    models = list(SapSamReader().iter_csv([csv_path]))
+    assert [m.model_id for m in models] == ["m0", "m1", "m2", "m3", "m4", "invalid", "malformed", "no_id", "m5"]
+    assert [m.error.error_type for m in models[5:8]] == ["task without bounds", "Invalid model JSON",
+                                                         "Invalid model JSON"]
+    assert all(m.anns is None for m in models[5:8]) and models[-1].error is None
+
+    parallel_models = list(SapSamReader().iter_csv([csv_path], n_jobs=2, chunk_size=2))
+    assert [m.model_id for m in parallel_models] == [m.model_id for m in models]
+    assert [a.category for a in parallel_models[0].anns] == [a.category for a in models[0].anns]
+
+
+def test_iter_csv_large_model_json(tmp_path):
+    model = json.loads((resource_path / "sapsam_model.json").read_text())
+    model["properties"] = {"documentation": "x" * 200_000}
+    csv_path = tmp_path / "0-1000.csv"
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Model ID", "Name", "Namespace", "Model JSON"])
+        writer.writerow(["large", "claims", BPMN2_NAMESPACE, json.dumps(model)])
+
+    limit = csv.field_size_limit()
+    models = list(SapSamReader().iter_csv([csv_path]))
+    assert [m.model_id for m in models] == ["large"] and models[0].error is None
+    # the process-global limit is only raised while reading
+    assert csv.field_size_limit() == limit
+
+
+def test_parse_model_json_unlinked_pools():
+    parser = BpmnParser(link_pools=False)
+    anns = SapSamReader(parser).parse_model_json((resource_path / "sapsam_model.json").read_text())
+    id_to_ann = {a.id: a for a in anns}
+
+    # the id of the pool shape, Signavio JSON has no process ids
+    assert id_to_ann["taskA"].pool == "pool"
+    assert id_to_ann["data"].pool is None
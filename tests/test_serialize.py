@@ -0,0 +1,38 @@
+import pickle
+from pathlib import Path
+
+import numpy as np
+from yamlu.img import Annotation
+
+from pybpmn import serialize
+from pybpmn.parser import BpmnParser
+
+resource_path = Path(__file__).resolve().parent / "resources"
+
+
+def test_serialize_roundtrip():
+    parser = BpmnParser(link_text_rel_two_way=True)
+    anns = parser.parse_bpmn_img(resource_path / "process.bpmn", resource_path / "process.jpg").annotations
+    data = serialize.dumps(anns)
+    assert len(data) < len(pickle.dumps(anns))
+
+    anns_back = serialize.loads(data)
+    assert len(anns_back) == len(anns)
+    for a, b in zip(anns, anns_back):
+        assert a.category == b.category
+        assert a.bb == b.bb
+        assert set(a.extra_fields) == set(b.extra_fields)
+        for k, v in a.extra_fields.items():
+            if isinstance(v, Annotation):
+                assert anns.index(v) == anns_back.index(b.get(k))
+            elif isinstance(v, np.ndarray):
+                assert np.array_equal(v, b.get(k))
+            else:
+                assert v == b.get(k)
+
+    cols = serialize.loads_columns(data)
+    edge_idx = next(i for i, a in enumerate(anns) if "waypoints" in a)
+    start, end = cols.waypoint_offsets[edge_idx:edge_idx + 2]
+    assert np.array_equal(cols.waypoints[start:end], anns[edge_idx].waypoints)
+    assert anns[cols.relations["arrow_next"][edge_idx]] is anns[edge_idx].arrow_next
+    assert cols.strings["id"][edge_idx] == anns[edge_idx].id
@@ -0,0 +1,48 @@
+from pathlib import Path
+
+import numpy as np
+from yamlu.coco import Dataset
+
+from pybpmn import syntax
+from pybpmn.constants import ARROW_KEYPOINT_FIELDS, RELATIONS
+from pybpmn.parser import BpmnParser
+from pybpmn.shards import ShardReader, compile_split
+
+resource_path = Path(__file__).resolve().parent / "resources"
+
+
+class _ProcessDataset(Dataset):
+    def __init__(self, dataset_path: Path, n_imgs: int):
+        super().__init__(
+            dataset_path=dataset_path,
+            split_n_imgs={"train": n_imgs},
+            coco_categories=[{"id": i, "name": c} for i, c in enumerate(syntax.ALL_CATEGORIES)],
+            keypoint_fields=list(ARROW_KEYPOINT_FIELDS),
+            relation_fields=list(RELATIONS),
+        )
+        self.parser = BpmnParser()
+
+    def get_split_ann_img(self, split: str, idx: int):
+        return self.parser.parse_bpmn_img(resource_path / "process.bpmn", resource_path / "process.jpg")
+
+
+def test_compile_split(tmp_path):
+    ds = _ProcessDataset(tmp_path / "coco", n_imgs=3)
+    split_root = compile_split(ds, "train", tmp_path / "shards", target_max_size=500, shard_size=2)
+
+    reader = ShardReader(split_root)
+    assert len(reader) == 3
+    assert len(reader.shard_names) == 2
+
+    ai = ds.get_split_ann_img("train", 0)
+    sample = reader[2]
+    assert max(sample.img.shape[:2]) == 500
+    assert sample.scale == 500 / max(ai.img.size)
+    assert np.allclose(sample.boxes, np.array([a.bb.tlbr for a in ai.annotations]) * sample.scale, atol=1e-3)
+
+    ai_back = reader.to_annotated_image(2)
+    assert ai_back.categories == ai.categories
+    for a, a_back in zip(ai.annotations, ai_back.annotations):
+        assert ("head" in a) == ("head" in a_back)
+        if "arrow_next" in a:
+            assert ai.annotations.index(a.arrow_next) == ai_back.annotations.index(a_back.arrow_next)
@@ -0,0 +1,34 @@
+from pathlib import Path
+
+import numpy as np
+
+from pybpmn.parser import BpmnParser
+from pybpmn.targets import batch_targets, diagram_targets, target_size
+
+resource_path = Path(__file__).resolve().parent / "resources"
+
+
+def test_diagram_targets():
+    ai = BpmnParser().parse_bpmn_img(resource_path / "process.bpmn", resource_path / "process.jpg")
+    t = diagram_targets(ai, stride=4)
+
+    w, h = target_size(ai.width, ai.height, 4)
+    assert t.edge_masks.shape == (len(t.edge_idxs), h, w)
+    assert t.heatmaps.shape == (2, h, w)
+    for mask, idx in zip(t.edge_masks, t.edge_idxs):
+        a = ai.annotations[idx]
+        x, y = np.rint(a.waypoints / 4).astype(int).T
+        assert mask[y, x].all()
+        x, y = np.rint(a.head / 4).astype(int)
+        assert t.heatmaps[1, y, x] > 0.9
+
+
+def test_batch_targets_reuses_buffers():
+    ai = BpmnParser().parse_bpmn_img(resource_path / "process.bpmn", resource_path / "process.jpg")
+    first = batch_targets([ai, ai], stride=8)
+    expected = [np.copy(arr) for arr in first]
+
+    targets = batch_targets([ai], stride=8, out=first)
+    assert np.shares_memory(targets.edge_masks, first.edge_masks)
+    assert np.array_equal(targets.edge_masks, expected[0][expected[1] == 0])
+    assert np.array_equal(targets.heatmaps[0], expected[3][1])
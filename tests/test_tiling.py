@@ -0,0 +1,35 @@
+from pathlib import Path
+
+import numpy as np
+
+from pybpmn.parser import BpmnParser
+from pybpmn.tiling import iter_tiles, tile_grid
+
+resource_path = Path(__file__).resolve().parent / "resources"
+
+
+def test_tile_grid():
+    tiles = tile_grid(1600, 500, tile_size=800, overlap=200)
+    assert tiles.tolist() == [[0, 0, 800, 500], [600, 0, 1400, 500], [800, 0, 1600, 500]]
+
+
+def test_iter_tiles():
+    ai = BpmnParser().parse_bpmn_img(resource_path / "process.bpmn", resource_path / "process.jpg")
+    tiles = list(iter_tiles(ai, tile_size=800, overlap=200))
+    assert len(tiles) == 6
+
+    for tile in tiles:
+        l, t, r, b = tile.ltrb
+        anns = tile.ai.annotations
+        assert tile.ai.img.size == (r - l, b - t) == tile.ai.size
+        assert len(anns) == len(tile.ann_idxs) == len(tile.visibility) > 0
+        assert np.all((tile.visibility > 0) & (tile.visibility <= 1))
+        for a, idx, visibility in zip(anns, tile.ann_idxs, tile.visibility):
+            src = ai.annotations[idx]
+            assert a.category == src.category
+            assert 0 <= a.bb.l <= a.bb.r <= r - l and 0 <= a.bb.t <= a.bb.b <= b - t
+            if visibility == 1:
+                assert np.allclose(a.bb.tlbr, np.array(src.bb.tlbr) - [t, l, t, l])
+            for rel in ["arrow_prev", "arrow_next", "text_belongs_to", "lane", "pool"]:
+                related = a.get(rel) if rel in a else None
+                assert related is None or any(related is other for other in anns), rel
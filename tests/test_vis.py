@@ -0,0 +1,34 @@
+from pathlib import Path
+
+from PIL import Image
+
+from pybpmn import vis
+from pybpmn.vis import RenderCache
+
+resource_path = Path(__file__).resolve().parent / "resources"
+
+
+def test_render_cache(tmp_path, monkeypatch):
+    # bpmn-to-image (npm) is not required for testing the cache
+    rendered = []
+
+    def fake_bpmn_to_image(bpmn_path: Path, png_path: Path, shift_to_origin=False):
+        rendered.append(bpmn_path.name)
+        img = Image.new("RGBA", (100, 50), (0, 0, 0, 255))
+        img.save(png_path)
+        return img
+
+    monkeypatch.setattr(vis, "bpmn_to_image", fake_bpmn_to_image)
+
+    cache = RenderCache(tmp_path / "cache")
+    img = cache.render(resource_path / "process.bpmn")
+    img_cached = cache.render(resource_path / "process.bpmn")
+    assert rendered == ["process.bpmn"]
+    assert img_cached.size == img.size
+
+    cache.render(resource_path / "process.bpmn", shift_to_origin=True)
+    assert len(rendered) == 2
+
+    cache.max_bytes = 0
+    cache.evict()
+    assert len(list(cache.cache_dir.glob("*.png"))) == 0
@@ -0,0 +1,71 @@
+from pathlib import Path
+
+import numpy as np
+from lxml import etree
+from yamlu.img import Annotation, BoundingBox
+
+from pybpmn import syntax
+from pybpmn.constants import NS_MAP
+from pybpmn.parser import BpmnParser, get_tag_without_ns
+from pybpmn.util import parse_annotation_background_width
+from pybpmn.writer import bpmn_bytes, write_bpmn
+
+resource_path = Path(__file__).resolve().parent / "resources"
+
+
+def test_round_trip(tmp_path):
+    anns = BpmnParser().parse_bpmn_anns(resource_path / "process.bpmn")
+    bpmn_path = tmp_path / "process.bpmn"
+    write_bpmn(anns, bpmn_path, background_size=1000)
+    anns_back = BpmnParser().parse_bpmn_anns(bpmn_path)
+
+    assert parse_annotation_background_width(bpmn_path) == 1000
+    assert [a.category for a in anns_back] == [a.category for a in anns]
+    idx = {id(a): i for i, a in enumerate(anns)}
+    idx_back = {id(a): i for i, a in enumerate(anns_back)}
+    for a, a_back in zip(anns, anns_back):
+        assert a_back.bb.tlbr == a.bb.tlbr
+        assert a_back.extra_fields.keys() == a.extra_fields.keys()
+        for k, v in a.extra_fields.items():
+            if isinstance(v, Annotation):
+                assert idx_back[id(a_back.get(k))] == idx[id(v)], k
+            elif isinstance(v, np.ndarray):
+                assert np.array_equal(a_back.get(k), v)
+            else:
+                assert a_back.get(k) == v
+
+
+def test_write_annotations_without_ids():
+    subprocess = Annotation(syntax.SUBPROCESS_EXPANDED, BoundingBox.from_xywh(0, 0, 400, 200))
+    task = Annotation(syntax.TASK, BoundingBox.from_xywh(50, 50, 100, 80), name="check")
+    event = Annotation(syntax.TIMER_INTERMEDIATE_EVENT, BoundingBox.from_xywh(250, 72, 36, 36))
+    flow = Annotation(syntax.SEQUENCE_FLOW, BoundingBox.from_ltrb([150, 90, 251, 91]),
+                      waypoints=np.array([[150, 90], [250, 90]]), arrow_prev=task, arrow_next=event)
+
+    data = bpmn_bytes([subprocess, task, event, flow])
+    # shapes within the expanded subprocess are written as its children
+    subprocess_el = etree.fromstring(data).find("process/subProcess", NS_MAP)
+    assert [get_tag_without_ns(el) for el in subprocess_el] == ["task", "intermediateCatchEvent", "sequenceFlow"]
+
+    anns = BpmnParser().parse_bpmn_anns(data)
+
+    assert [a.category for a in anns] == [syntax.SUBPROCESS_EXPANDED, syntax.TASK, syntax.TIMER_INTERMEDIATE_EVENT,
+                                          syntax.SEQUENCE_FLOW]
+    assert anns[1].name == "check"
+    assert anns[3].arrow_prev is anns[1] and anns[3].arrow_next is anns[2]
+
+
+def test_round_trip_with_excluded_categories():
+    parser = BpmnParser(excluded_categories={syntax.EXCLUSIVE_GATEWAY})
+    anns = parser.parse_bpmn_anns(resource_path / "process.bpmn")
+    anns_back = parser.parse_bpmn_anns(bpmn_bytes(anns))
+
+    # sequence flows from or to the excluded gateways are skipped with their labels
+    def has_ends(a):
+        return all(rel in a and a.get(rel) is not None for rel in ["arrow_prev", "arrow_next"])
+
+    kept = [a for a in anns if a.category not in syntax.BPMNDI_EDGE_CATEGORIES or has_ends(a)]
+    kept_ids = {id(a) for a in kept}
+    kept = [a for a in kept if a.category != syntax.LABEL or id(a.text_belongs_to) in kept_ids]
+    assert len(kept) < len(anns)
+    assert [(a.category, a.bb.tlbr) for a in anns_back] == [(a.category, a.bb.tlbr) for a in kept]